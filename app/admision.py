@@ -0,0 +1,192 @@
+import asyncio
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+from app.metrics import registro
+from app.core.config import (
+    BCRYPT_MAX_CONCURRENTES,
+    BCRYPT_MAX_COLA,
+    BCRYPT_ESPERA_MAX,
+    LOGIN_IP_POR_SEGUNDO,
+    LOGIN_IP_RAFAGA,
+    LOGIN_USUARIO_POR_SEGUNDO,
+    LOGIN_USUARIO_RAFAGA,
+    FORWARDED_ALLOW_IPS,
+)
+
+_AYUDA_RECHAZOS = "Peticiones rechazadas por el control de admisión"
+
+
+class Sobrecarga(Exception):
+    # Se traduce a 503 + Retry-After (ver main.py)
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class LimiteExcedido(Exception):
+    # Se traduce a 429 + Retry-After (ver main.py)
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class LimitadorConcurrencia:
+    # Como mucho `maximo` operaciones a la vez y `cola` esperando turno; lo
+    # que no cabe se rechaza al momento en vez de acumular latencia. Así una
+    # avalancha de logins no se come la CPU que necesitan las rutas baratas.
+
+    def __init__(self, nombre: str, maximo: int, cola: int, espera_max: float):
+        self.nombre = nombre
+        self.maximo = maximo
+        self.cola = cola
+        self.espera_max = espera_max
+        self.en_curso = 0
+        self.en_cola = 0
+        self._semaforo: Optional[asyncio.Semaphore] = None
+
+    @property
+    def activo(self) -> bool:
+        return self.maximo > 0
+
+    @asynccontextmanager
+    async def turno(self):
+        if not self.activo:
+            yield
+            return
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.maximo)
+
+        if self._semaforo.locked():
+            if self.en_cola >= self.cola:
+                registro.inc("admision_rechazos_total", _AYUDA_RECHAZOS, limite=self.nombre, motivo="cola_llena")
+                raise Sobrecarga(self.espera_max)
+            self.en_cola += 1
+            try:
+                await asyncio.wait_for(self._semaforo.acquire(), self.espera_max)
+            except asyncio.TimeoutError:
+                registro.inc("admision_rechazos_total", _AYUDA_RECHAZOS, limite=self.nombre, motivo="espera")
+                raise Sobrecarga(self.espera_max)
+            finally:
+                self.en_cola -= 1
+        else:
+            await self._semaforo.acquire()
+
+        self.en_curso += 1
+        try:
+            yield
+        finally:
+            self.en_curso -= 1
+            self._semaforo.release()
+
+
+class CubosTokens:
+    # Un token bucket por clave (IP, username...): `rafaga` intentos seguidos
+    # y luego `por_segundo`. Las claves menos usadas se olvidan al pasar de `maxsize`
+
+    def __init__(self, nombre: str, por_segundo: float, rafaga: int, maxsize: int = 100000):
+        self.nombre = nombre
+        self.por_segundo = por_segundo
+        self.rafaga = rafaga
+        self.maxsize = maxsize
+        self._cubos: "OrderedDict[Hashable, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def activo(self) -> bool:
+        return self.por_segundo > 0 and self.rafaga > 0
+
+    def consumir(self, clave: Hashable) -> Optional[float]:
+        # None si hay token; si no, segundos hasta el siguiente
+        if not self.activo:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._cubos.get(clave, (self.rafaga, ahora))
+            tokens = min(self.rafaga, tokens + (ahora - ultimo) * self.por_segundo)
+            if tokens < 1:
+                self._cubos[clave] = (tokens, ahora)
+                self._cubos.move_to_end(clave)
+                return (1 - tokens) / self.por_segundo
+            self._cubos[clave] = (tokens - 1, ahora)
+            self._cubos.move_to_end(clave)
+            while len(self._cubos) > self.maxsize:
+                self._cubos.popitem(last=False)
+        return None
+
+    def limpiar(self):
+        with self._lock:
+            self._cubos.clear()
+
+
+limitador_bcrypt = LimitadorConcurrencia("bcrypt", BCRYPT_MAX_CONCURRENTES, BCRYPT_MAX_COLA, BCRYPT_ESPERA_MAX)
+login_por_ip = CubosTokens("login_ip", LOGIN_IP_POR_SEGUNDO, LOGIN_IP_RAFAGA)
+login_por_usuario = CubosTokens("login_usuario", LOGIN_USUARIO_POR_SEGUNDO, LOGIN_USUARIO_RAFAGA)
+
+
+class ProxiesConfianza:
+    # IP real del cliente: se recorre X-Forwarded-For de derecha a izquierda
+    # mientras el salto sea un proxy de confianza. La primera dirección que no
+    # lo es la añadió un proxy nuestro y no se puede falsificar; lo que haya
+    # más a la izquierda lo escribe el cliente
+
+    def __init__(self, proxies: list[str]):
+        self.todos = "*" in proxies
+        self.redes = [ipaddress.ip_network(p, strict=False) for p in proxies if p != "*"]
+
+    def es_proxy(self, ip: str) -> bool:
+        if self.todos:
+            return True
+        try:
+            direccion = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(direccion in red for red in self.redes)
+
+    def ip_cliente(self, peer: Optional[str], x_forwarded_for: Optional[str]) -> Optional[str]:
+        if peer is None or not x_forwarded_for or not self.es_proxy(peer):
+            return peer
+        saltos = [ip.strip() for ip in x_forwarded_for.split(",") if ip.strip()]
+        for ip in reversed(saltos):
+            if not self.es_proxy(ip):
+                return ip
+        # Todos los saltos son proxies ("*" incluido): el más lejano
+        return saltos[0] if saltos else peer
+
+
+proxies_confianza = ProxiesConfianza(FORWARDED_ALLOW_IPS)
+
+
+def ip_cliente(request) -> Optional[str]:
+    return proxies_confianza.ip_cliente(
+        request.client.host if request.client else None,
+        request.headers.get("x-forwarded-for"),
+    )
+
+
+def comprobar_login(ip: Optional[str], username: str):
+    # Antes de tocar la base de datos o bcrypt: un intento de más cuesta
+    # un diccionario, no 250 ms de CPU
+    for cubos, clave in ((login_por_ip, ip), (login_por_usuario, username.strip().lower())):
+        if clave is None:
+            continue
+        espera = cubos.consumir(clave)
+        if espera is not None:
+            registro.inc("admision_rechazos_total", _AYUDA_RECHAZOS, limite=cubos.nombre, motivo="tasa")
+            raise LimiteExcedido(espera)
+
+
+def _metricas_admision():
+    return [
+        ("admision_en_curso", "gauge", "Operaciones dentro del limitador",
+         [({"limite": limitador_bcrypt.nombre}, limitador_bcrypt.en_curso)]),
+        ("admision_en_cola", "gauge", "Operaciones esperando turno en el limitador",
+         [({"limite": limitador_bcrypt.nombre}, limitador_bcrypt.en_cola)]),
+    ]
+
+registro.registrar_colector(_metricas_admision)
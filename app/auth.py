@@ -1,20 +1,61 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy import or_, update
 from jose import jwt, JWTError
+from pydantic import BaseModel
 
 from app.database import get_db
 from app.models import Usuario
-from app.security import verify_password
-from app.core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.security import hash_password_async, necesita_rehash, verify_password_async
+from app.admision import Sobrecarga, comprobar_login, ip_cliente
+from app.cache import TTLCache
+from app.metrics import registro, temporizador
+from app.refresh_tokens import emitir_refresh_token, rotar_refresh_token
+from app.core.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    PRINCIPAL_CACHE_TTL,
+    PRINCIPAL_CACHE_SIZE,
+    JWT_STATELESS_CLAIMS,
+    TOKEN_VERSION_CACHE_TTL,
+)
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# username -> columnas del usuario autenticado
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+# id -> (username, token_version) vigentes, para revocar tokens sin cargar la fila entera
+version_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=TOKEN_VERSION_CACHE_TTL)
+
+def _metricas_cache():
+    muestras = {"principal": principal_cache.stats(), "token_version": version_cache.stats()}
+    return [
+        ("auth_cache_hits_total", "counter", "Aciertos de las cachés de autenticación",
+         [({"cache": nombre}, stats["hits"]) for nombre, stats in muestras.items()]),
+        ("auth_cache_misses_total", "counter", "Fallos de las cachés de autenticación",
+         [({"cache": nombre}, stats["misses"]) for nombre, stats in muestras.items()]),
+        ("auth_cache_size", "gauge", "Entradas en las cachés de autenticación",
+         [({"cache": nombre}, stats["size"]) for nombre, stats in muestras.items()]),
+    ]
+
+registro.registrar_colector(_metricas_cache)
+
+
+@dataclass(frozen=True)
+class Claims:
+    id: int
+    username: str
+    es_admin: bool
+    version: int
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -22,64 +63,212 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credential_exception = HTTPException(
-        status_code=401,
-        detail="No se pudo identificar al usuario",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def crear_token_usuario(user: Usuario) -> str:
+    data = {"sub": user.username}
+    if JWT_STATELESS_CLAIMS:
+        data.update({"uid": user.id, "adm": bool(user.es_admin), "ver": user.token_version or 0})
+    return create_access_token(data)
+
+def emitir_tokens(db: Session, user: Usuario) -> dict:
+    access_token = crear_token_usuario(user)
+    refresh_token = emitir_refresh_token(db, user.id, user.username)
+    db.commit()
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer"
+    }
+
+def buscar_por_login(db: Session, login: str):
+    return db.query(Usuario).filter(
+        or_(
+            Usuario.username == login,
+            Usuario.mail == login
+        )
+    ).first()
+
+
+async def nuevo_hash(password: str) -> Optional[str]:
+    # El rehash es oportunista: si bcrypt está saturado se deja para otro login
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credential_exception
-    except (JWTError, KeyError, TypeError):
-        raise credential_exception
-    
-    user = db.query(Usuario).filter(Usuario.nombre == username).first()
-    if user is None:
-        raise credential_exception
-    return user
+        return await hash_password_async(password)
+    except Sobrecarga:
+        return None
+
+def guardar_rehash(db: Session, usuario_id: int, hash_anterior: str, hash_nuevo: str) -> bool:
+    # Condicionado al hash anterior: no pisa un cambio de contraseña concurrente
+    result = db.execute(
+        update(Usuario)
+        .where(Usuario.id == usuario_id, Usuario.password == hash_anterior)
+        .values(password=hash_nuevo)
+    )
+    db.commit()
+    if result.rowcount:
+        registro.inc("bcrypt_rehash_total", "Hashes actualizados al coste vigente tras un login")
+    return bool(result.rowcount)
+
+async def rehash_password(bind, usuario_id: int, username: str, password: str, hash_anterior: str):
+    hash_nuevo = await nuevo_hash(password)
+    if hash_nuevo is None:
+        return
+    def guardar():
+        # Sesión propia: la de la petición ya se ha cerrado
+        with Session(bind=bind) as db:
+            return guardar_rehash(db, usuario_id, hash_anterior, hash_nuevo)
+    if await run_in_threadpool(guardar):
+        principal_cache.invalidate(username)
 
 
 @router.post("/login")
-def login(
+async def login(
+    request: Request,
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)  
 ):
-    user = db.query(Usuario).filter(
-        or_(
-            Usuario.username == form_data.username,
-            Usuario.mail == form_data.username
-        )
-    ).first()
+    comprobar_login(ip_cliente(request), form_data.username)
+
+    # La consulta va a un hilo y bcrypt al pool de procesos: el event loop queda libre
+    user = await run_in_threadpool(buscar_por_login, db, form_data.username)
 
-    if not user or not verify_password(form_data.password, user.password):
+    if not user or not await verify_password_async(form_data.password, user.password):
         raise HTTPException(status_code=401, detail="Usuario o contraseña incorrecto")
-    
-    token = create_access_token({"sub": user.username})
-    return {"access_token": token, "token_type": "bearer"}
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credential_exception = HTTPException(
+    # Hash con un coste distinto del vigente: se rehace después de responder
+    if necesita_rehash(user.password):
+        background_tasks.add_task(
+            rehash_password, db.get_bind(), user.id, user.username, form_data.password, user.password
+        )
+
+    return await run_in_threadpool(emitir_tokens, db, user)
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+@router.post("/token/refresh")
+def refrescar_token(datos: RefreshRequest, db: Session = Depends(get_db)):
+    # Renovar la sesión cuesta un SHA-256 y un par de consultas, no un bcrypt
+    resultado = rotar_refresh_token(db, datos.refresh_token)
+    if resultado is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Refresh token inválido",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    usuario_id, username, refresh_token = resultado
+    user = db.get(Usuario, usuario_id)
+    if user is None or user.username != username:
+        raise credential_exception()
+
+    return {
+        "access_token": crear_token_usuario(user),
+        "refresh_token": refresh_token,
+        "token_type": "bearer"
+    }
+
+def credential_exception() -> HTTPException:
+    return HTTPException(
         status_code=401,
         detail="No se pudo identificar al usuario",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decodificar_token(token: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credential_exception
+        with temporizador("jwt_decode_duration_seconds", "Tiempo de verificar y decodificar el JWT"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload.get("sub") is None:
+            raise credential_exception()
     except (JWTError, KeyError, TypeError):
-        raise credential_exception
+        raise credential_exception()
+    return payload
 
-    user = db.query(Usuario).filter(Usuario.username == username).first()
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    payload = decodificar_token(token)
+
+    user = cargar_principal(db, payload["sub"])
     if user is None:
-        raise credential_exception
+        raise credential_exception()
+    if "ver" in payload and payload["ver"] != (user.token_version or 0):
+        raise credential_exception()
     return user
 
-def requiere_admin(current_user: Usuario = Depends(get_current_user)):
-    if not current_user.es_admin:
+def identidad_actual(db: Session, usuario_id: int) -> Optional[tuple[str, int]]:
+    # (username, token_version) por PK; None significa que el usuario ya no existe.
+    # El username ata el uid del token a su dueño aunque el id fuera de otro
+    identidad = version_cache.get(usuario_id) if version_cache.activa else None
+    if identidad is None:
+        fila = db.query(Usuario.username, Usuario.token_version).filter(Usuario.id == usuario_id).first()
+        if fila is None:
+            return None
+        identidad = (fila.username, fila.token_version or 0)
+        version_cache.set(usuario_id, identidad)
+    return identidad
+
+def get_current_claims(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Claims:
+    # Para rutas que solo necesitan identidad o rol: con tokens "stateless"
+    # no se carga la fila del usuario, solo se comprueba su versión
+    payload = decodificar_token(token)
+
+    if JWT_STATELESS_CLAIMS and "uid" in payload:
+        try:
+            claims = Claims(
+                id=int(payload["uid"]),
+                username=payload["sub"],
+                es_admin=bool(payload["adm"]),
+                version=int(payload["ver"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            raise credential_exception()
+        if identidad_actual(db, claims.id) != (claims.username, claims.version):
+            raise credential_exception()
+        return claims
+
+    user = get_current_user(token, db)
+    return Claims(
+        id=user.id,
+        username=user.username,
+        es_admin=bool(user.es_admin),
+        version=user.token_version or 0,
+    )
+
+def snapshot_principal(user: Usuario) -> dict:
+    return {col.key: getattr(user, col.key) for col in Usuario.__table__.columns}
+
+def principal_desde_snapshot(datos: dict) -> Usuario:
+    # Cada petición recibe su propia instancia; al añadirla a la sesión
+    # queda como persistente sin hacer SELECT
+    user = Usuario(**datos)
+    make_transient_to_detached(user)
+    return user
+
+def cargar_principal(db: Session, username: str) -> Optional[Usuario]:
+    datos = principal_cache.get(username) if principal_cache.activa else None
+    if datos is None:
+        user = db.query(Usuario).filter(Usuario.username == username).first()
+        if user is not None:
+            principal_cache.set(username, snapshot_principal(user))
+        return user
+
+    user = principal_desde_snapshot(datos)
+    db.add(user)
+    return user
+
+def invalidar_principal(usuario: Usuario):
+    principal_cache.invalidate(usuario.username)
+    version_cache.invalidate(usuario.id)
+
+def requiere_admin(claims: Claims = Depends(get_current_claims)):
+    if not claims.es_admin:
         raise HTTPException(status_code=403, detail="Se requieren permisos de admin")
-    return current_user
\ No newline at end of file
+    return claims
+
+
+@router.get("/auth/cache")
+def estadisticas_cache(admin: Claims = Depends(requiere_admin)):
+    return {
+        "principal": principal_cache.stats(),
+        "token_version": version_cache.stats(),
+    }
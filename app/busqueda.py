@@ -0,0 +1,133 @@
+import threading
+from bisect import bisect_left
+from typing import Optional
+
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from app.cambios import CREAR
+from app.models import CambioUsuario, Usuario
+
+
+_MAX_CODIGO = chr(0x10FFFF)
+
+def siguiente_prefijo(prefijo: str) -> Optional[str]:
+    # Menor cadena mayor que todas las que empiezan por `prefijo`. El último
+    # carácter Unicode no tiene siguiente: se quita y se sube el anterior; si no
+    # queda nada, None (no hay cota superior, basta con >= prefijo)
+    recortado = prefijo.rstrip(_MAX_CODIGO)
+    if not recortado:
+        return None
+    return recortado[:-1] + chr(ord(recortado[-1]) + 1)
+
+def _escapar_like(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def filtro_prefijo(columna, prefijo: str):
+    # El rango (>= prefijo, < siguiente) lo resuelve el índice B-tree de la columna;
+    # el LIKE solo confirma sobre las filas del rango (en SQLite no distingue mayúsculas)
+    condiciones = [columna >= prefijo]
+    siguiente = siguiente_prefijo(prefijo)
+    if siguiente is not None:
+        condiciones.append(columna < siguiente)
+    condiciones.append(columna.like(_escapar_like(prefijo) + "%", escape="\\"))
+    return and_(*condiciones)
+
+def filtros_busqueda(
+    username: Optional[str] = None,
+    nombre: Optional[str] = None,
+    mail: Optional[str] = None,
+    edad_min: Optional[int] = None,
+    edad_max: Optional[int] = None,
+    es_admin: Optional[bool] = None,
+) -> list:
+    filtros = []
+    if username:
+        filtros.append(filtro_prefijo(Usuario.username, username))
+    if nombre:
+        filtros.append(filtro_prefijo(Usuario.nombre, nombre))
+    if mail:
+        filtros.append(filtro_prefijo(Usuario.mail, mail))
+    if edad_min is not None:
+        filtros.append(Usuario.edad >= edad_min)
+    if edad_max is not None:
+        filtros.append(Usuario.edad <= edad_max)
+    if es_admin is not None:
+        filtros.append(Usuario.es_admin == es_admin)
+    return filtros
+
+
+class IndicePrefijos:
+    # Índice en memoria de usernames: lista ordenada de (username, id) donde un
+    # prefijo es un rango contiguo que se encuentra con bisect.
+    # Se carga al arrancar y se pone al día leyendo las altas del feed de
+    # cambios, así ve también las de otros workers. Las bajas de otros workers
+    # dejan entradas viejas, pero la consulta final filtra por id en la base.
+
+    def __init__(self):
+        self._entradas: list[tuple[str, int]] = []
+        self._cursor = 0
+        self._cargado = False
+        self._lock = threading.Lock()
+
+    @property
+    def cargado(self) -> bool:
+        return self._cargado
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def cargar(self, db: Session, chunk: int = 10000):
+        cursor = db.query(CambioUsuario.seq).order_by(CambioUsuario.seq.desc()).limit(1).scalar() or 0
+        filas = db.execute(
+            select(Usuario.username, Usuario.id).execution_options(yield_per=chunk)
+        )
+        entradas = sorted((username, id_) for username, id_ in filas)
+        with self._lock:
+            self._entradas = entradas
+            self._cursor = cursor
+            self._cargado = True
+
+    def sincronizar(self, db: Session):
+        altas = db.execute(
+            select(CambioUsuario.seq, Usuario.username, Usuario.id)
+            .join(Usuario, Usuario.id == CambioUsuario.usuario_id)
+            .where(CambioUsuario.seq > self._cursor, CambioUsuario.tipo == CREAR)
+            .order_by(CambioUsuario.seq)
+        ).all()
+        if not altas:
+            return
+        with self._lock:
+            for seq, username, id_ in altas:
+                self._agregar(username, id_)
+            self._cursor = max(self._cursor, altas[-1].seq)
+
+    def _agregar(self, username: str, id_: int):
+        entrada = (username, id_)
+        pos = bisect_left(self._entradas, entrada)
+        if pos == len(self._entradas) or self._entradas[pos] != entrada:
+            self._entradas.insert(pos, entrada)
+
+    def quitar(self, username: str, id_: int):
+        with self._lock:
+            entrada = (username, id_)
+            pos = bisect_left(self._entradas, entrada)
+            if pos < len(self._entradas) and self._entradas[pos] == entrada:
+                del self._entradas[pos]
+
+    def candidatos(self, prefijo: str, maximo: int) -> Optional[list[int]]:
+        # ids cuyo username empieza por `prefijo`, o None si hay más de `maximo`
+        # (entonces sale más a cuenta que filtre la base de datos)
+        with self._lock:
+            inicio = bisect_left(self._entradas, (prefijo,))
+            siguiente = siguiente_prefijo(prefijo)
+            if siguiente is None:
+                fin = len(self._entradas)
+            else:
+                fin = bisect_left(self._entradas, (siguiente,), lo=inicio)
+            if fin - inicio > maximo:
+                return None
+            return [id_ for _, id_ in self._entradas[inicio:fin]]
+
+
+indice_usernames = IndicePrefijos()
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import orjson
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.models import CambioUsuario, Usuario
+from app.core.config import CAMBIOS_POLL_SECONDS, CAMBIOS_SSE_MAX_SECONDS
+
+CREAR = "crear"
+ACTUALIZAR = "actualizar"
+ELIMINAR = "eliminar"
+
+# Las escrituras añaden su cambio a la misma transacción: quien llama hace el commit.
+#
+# Garantía del feed: seq crece en el mismo orden en que se confirman las
+# transacciones, así que un lector que avanza su cursor nunca se salta un
+# cambio confirmado (puede haber huecos de seq por transacciones deshechas).
+# Con SQLite las escrituras ya van en serie. En Postgres dos transacciones
+# podrían sacar seq 10 y 11 y confirmar 11 primero; para evitarlo, antes de
+# insertar en cambios_usuarios se toma un advisory lock de transacción que
+# se suelta en el commit. Solo serializa el tramo final de cada escritura
+# (del INSERT del cambio al commit), no la escritura entera.
+
+# Clave del advisory lock ("camb" en ASCII)
+_CLAVE_FEED = 0x63616D62
+
+def _serializar_feed(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": _CLAVE_FEED})
+
+def registrar_cambio(db: Session, usuario_id: int, tipo: str):
+    _serializar_feed(db)
+    db.add(CambioUsuario(usuario_id=usuario_id, tipo=tipo))
+
+def registrar_cambios(db: Session, usuario_ids: list[int], tipo: str):
+    if usuario_ids:
+        _serializar_feed(db)
+        db.execute(insert(CambioUsuario), [{"usuario_id": i, "tipo": tipo} for i in usuario_ids])
+
+
+def ultimo_seq(db: Session) -> int:
+    return db.query(func.max(CambioUsuario.seq)).scalar() or 0
+
+
+def leer_cambios(db: Session, desde: int, limite: int, columnas) -> tuple[list, int, bool]:
+    # Devuelve (cambios, nuevo_cursor, hay_mas). Dentro de una página solo se
+    # emite el último cambio de cada usuario, con su estado actual.
+    filas = db.execute(
+        select(CambioUsuario.seq, CambioUsuario.usuario_id, CambioUsuario.tipo)
+        .where(CambioUsuario.seq > desde)
+        .order_by(CambioUsuario.seq)
+        .limit(limite + 1)
+    ).all()
+
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    if not filas:
+        return [], desde, False
+
+    ultimos = {}
+    for fila in filas:
+        ultimos[fila.usuario_id] = fila
+
+    vivos = [fila.usuario_id for fila in ultimos.values() if fila.tipo != ELIMINAR]
+    estados = {}
+    if vivos:
+        estados = {
+            fila.id: fila
+            for fila in db.execute(select(*columnas).where(Usuario.id.in_(vivos)))
+        }
+
+    cambios = [
+        {
+            "seq": fila.seq,
+            "tipo": fila.tipo,
+            "usuario_id": fila.usuario_id,
+            "usuario": estados.get(fila.usuario_id),
+        }
+        for fila in sorted(ultimos.values(), key=lambda f: f.seq)
+    ]
+    return cambios, filas[-1].seq, hay_mas
+
+
+async def eventos_sse(request, db: Session, desde: int, limite: int, columnas, a_dict, codificar):
+    # Server-Sent Events: consulta seq > cursor cada CAMBIOS_POLL_SECONDS y
+    # cierra a los CAMBIOS_SSE_MAX_SECONDS; el navegador reconecta solo y manda
+    # Last-Event-ID, así que se retoma desde el último cambio recibido
+    cursor = desde
+    fin = time.monotonic() + CAMBIOS_SSE_MAX_SECONDS
+    ultimo_envio = time.monotonic()
+    yield f"retry: {int(CAMBIOS_POLL_SECONDS * 1000)}\n\n"
+    try:
+        while time.monotonic() < fin:
+            if await request.is_disconnected():
+                break
+            cambios, cursor_nuevo, hay_mas = await run_in_threadpool(leer_cambios, db, cursor, limite, columnas)
+            # Libera la conexión entre sondeos
+            await run_in_threadpool(db.close)
+            for cambio in cambios:
+                if cambio["usuario"] is not None:
+                    cambio["usuario"] = a_dict(cambio["usuario"])
+                yield (
+                    f"id: {codificar(cambio['seq'])}\nevent: cambio\n"
+                    f"data: {orjson.dumps(cambio).decode()}\n\n"
+                )
+            cursor = cursor_nuevo
+            if cambios:
+                ultimo_envio = time.monotonic()
+            elif time.monotonic() - ultimo_envio >= 15:
+                # Comentario SSE para que los proxies no corten la conexión
+                yield ": ping\n\n"
+                ultimo_envio = time.monotonic()
+            if not hay_mas:
+                await asyncio.sleep(CAMBIOS_POLL_SECONDS)
+    finally:
+        await run_in_threadpool(db.close)
@@ -3,6 +3,12 @@ import os
 
 load_dotenv()
 
+def _env_bool(nombre: str, default: bool = False) -> bool:
+    valor = os.getenv(nombre)
+    if valor is None:
+        return default
+    return valor.strip().lower() in ("1", "true", "yes", "on")
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 SECRET_KEY = os.getenv("SECRET_KEY")
 
@@ -14,4 +20,132 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(
     os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)
     )
 
+# Paginación de GET /usuarios
+USUARIOS_PAGE_MAX = int(os.getenv("USUARIOS_PAGE_MAX", 1000))
+USUARIOS_STREAM_CHUNK = int(os.getenv("USUARIOS_STREAM_CHUNK", 1000))
+
+# Procesos del servidor. app.serve usa uno por CPU si no se indica; un
+# uvicorn a secas es un solo proceso
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+
+# Procesos dedicados a bcrypt (0 = sin pool, se usan hilos). Cada worker del
+# servidor tiene su pool: por defecto se reparten las CPUs entre ellos
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", max(1, (os.cpu_count() or 1) // max(SERVER_WORKERS, 1))))
+
+# Caché de usuarios autenticados (TTL en segundos, 0 = desactivada)
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 30))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 1024))
+
+# Capa de base de datos asíncrona (aiosqlite / asyncpg)
+DB_ASYNC = _env_bool("DB_ASYNC")
+
+# Tokens con id, rol y versión embebidos ("stateless claims")
+JWT_STATELESS_CLAIMS = _env_bool("JWT_STATELESS_CLAIMS")
+TOKEN_VERSION_CACHE_TTL = float(os.getenv("TOKEN_VERSION_CACHE_TTL", 10))
+
+# Refresh tokens rotativos
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+REFRESH_SWEEP_SECONDS = int(os.getenv("REFRESH_SWEEP_SECONDS", 300))
+
+# Importación masiva de usuarios
+BULK_MAX_FILAS = int(os.getenv("BULK_MAX_FILAS", 10000))
+BULK_INSERT_BATCH = int(os.getenv("BULK_INSERT_BATCH", 1000))
+
+# Middleware de métricas y GET /metrics
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+
+# Profiler SQL (opt-in): log de consultas lentas, cabeceras por petición y aviso de N+1
+SQL_PROFILER = _env_bool("SQL_PROFILER")
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", 100))
+SQL_NPLUS1_THRESHOLD = int(os.getenv("SQL_NPLUS1_THRESHOLD", 10))
+
+# Feed de cambios (GET /usuarios/changes)
+CAMBIOS_PAGE_MAX = int(os.getenv("CAMBIOS_PAGE_MAX", 1000))
+CAMBIOS_POLL_SECONDS = float(os.getenv("CAMBIOS_POLL_SECONDS", 1))
+CAMBIOS_SSE_MAX_SECONDS = float(os.getenv("CAMBIOS_SSE_MAX_SECONDS", 300))
+
+# Búsqueda de usuarios: índice de prefijos en memoria (opcional)
+SEARCH_PREFIX_INDEX = _env_bool("SEARCH_PREFIX_INDEX")
+SEARCH_PREFIX_MAX_CANDIDATOS = int(os.getenv("SEARCH_PREFIX_MAX_CANDIDATOS", 5000))
+
+# Lecturas por id: POST /usuarios/batch-get y agrupación de GET /usuarios/{id}
+# concurrentes en un solo IN (ventana en ms; 0 la desactiva)
+BATCH_GET_MAX = int(os.getenv("BATCH_GET_MAX", 1000))
+USUARIOS_COALESCE_MS = float(os.getenv("USUARIOS_COALESCE_MS", 2))
+USUARIOS_COALESCE_MAX = int(os.getenv("USUARIOS_COALESCE_MAX", 100))
+
+# PATCH/DELETE /usuarios: filas por UPDATE/DELETE (y por transacción)
+BULK_ADMIN_CHUNK = int(os.getenv("BULK_ADMIN_CHUNK", 1000))
+
+# Réplicas de lectura (URLs separadas por comas); sin ellas todo va al primario
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# "round_robin" o "least_busy" (menos sesiones abiertas)
+REPLICA_STRATEGY = os.getenv("REPLICA_STRATEGY", "round_robin")
+# Lectura del primario tras escribir (read-your-writes) y pausa de una réplica caída
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", 30))
+
+# Pool de conexiones (no aplica a SQLite en memoria)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Segundos antes de reciclar una conexión (-1 nunca); por debajo del idle timeout del servidor/proxy
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+
+# PRAGMAs de cada conexión SQLite. WAL deja leer mientras otro escribe;
+# synchronous=NORMAL con WAL solo arriesga la última transacción ante un corte
+# de luz; cache_size negativo son KiB. SQLITE_PRAGMAS=0 los desactiva
+SQLITE_PRAGMAS = {} if not _env_bool("SQLITE_PRAGMAS", True) else {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64000)),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 268435456)),
+}
+
+# Group commit de las altas (POST /usuarios): se juntan en una transacción
+# cada SIGNUP_GROUP_COMMIT_MS o al llegar a SIGNUP_GROUP_COMMIT_MAX filas
+SIGNUP_GROUP_COMMIT = _env_bool("SIGNUP_GROUP_COMMIT")
+SIGNUP_GROUP_COMMIT_MS = float(os.getenv("SIGNUP_GROUP_COMMIT_MS", 5))
+SIGNUP_GROUP_COMMIT_MAX = int(os.getenv("SIGNUP_GROUP_COMMIT_MAX", 100))
+
+# Filtro de Bloom de usernames y mails ocupados (GET /usuarios/disponible)
+BLOOM_CAPACIDAD = int(os.getenv("BLOOM_CAPACIDAD", 1000000))
+BLOOM_FALSOS_POSITIVOS = float(os.getenv("BLOOM_FALSOS_POSITIVOS", 0.01))
+BLOOM_SYNC_SECONDS = float(os.getenv("BLOOM_SYNC_SECONDS", 1))
+
+# Control de admisión de bcrypt: operaciones simultáneas, cola de espera y
+# espera máxima antes de responder 503 (BCRYPT_MAX_CONCURRENTES=0 lo desactiva)
+BCRYPT_MAX_CONCURRENTES = int(os.getenv("BCRYPT_MAX_CONCURRENTES", max(BCRYPT_WORKERS, 1) * 2))
+BCRYPT_MAX_COLA = int(os.getenv("BCRYPT_MAX_COLA", 64))
+BCRYPT_ESPERA_MAX = float(os.getenv("BCRYPT_ESPERA_MAX", 5))
+# Importaciones masivas: contraseñas por turno del limitador y turnos que
+# pueden ocupar a la vez entre todas (el resto queda para logins y altas)
+BCRYPT_IMPORT_LOTE = int(os.getenv("BCRYPT_IMPORT_LOTE", 4))
+BCRYPT_IMPORT_CUOTA = int(os.getenv("BCRYPT_IMPORT_CUOTA", max(1, BCRYPT_MAX_CONCURRENTES // 2)))
+# Token buckets de /login (intentos por segundo y ráfaga); 0 los desactiva
+LOGIN_IP_POR_SEGUNDO = float(os.getenv("LOGIN_IP_POR_SEGUNDO", 10))
+LOGIN_IP_RAFAGA = int(os.getenv("LOGIN_IP_RAFAGA", 100))
+LOGIN_USUARIO_POR_SEGUNDO = float(os.getenv("LOGIN_USUARIO_POR_SEGUNDO", 0.2))
+LOGIN_USUARIO_RAFAGA = int(os.getenv("LOGIN_USUARIO_RAFAGA", 10))
+# Proxies (IPs o redes, separadas por comas) de los que se acepta
+# X-Forwarded-For para saber la IP del cliente. Detrás del proxy de Render
+# todas las conexiones llegan desde él: sin esto comparten un cubo. "*" confía
+# en cualquiera y toma la primera IP de la cabecera, que el cliente puede inventar
+FORWARDED_ALLOW_IPS = [ip.strip() for ip in os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1").split(",") if ip.strip()]
+
+# Coste de bcrypt. Con BCRYPT_ROUNDS se fija; si no, al arrancar se elige el
+# mayor coste cuyo hash quepa en BCRYPT_TARGET_MS (0: coste por defecto, 12)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 0))
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", 250))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", 10))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", 16))
 
+# Servidor de producción (python -m app.serve): keep-alive en segundos, cola de
+# conexiones pendientes del socket y tiempo para drenar peticiones al parar
+SERVER_HOST = os.getenv("HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("PORT", 8000))
+SERVER_KEEPALIVE = float(os.getenv("SERVER_KEEPALIVE", 5))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048))
+SERVER_GRACEFUL_SECONDS = float(os.getenv("SERVER_GRACEFUL_SECONDS", 30))
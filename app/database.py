@@ -1,17 +1,84 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from app.core.config import DATABASE_URL
+import time
 
-connect_args = {}
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, 
-        connect_args={"check_same_thread": False}
+from app.metrics import registro
+from app.core.config import (
+    DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    SQLITE_PRAGMAS,
 )
-else:
-    engine = create_engine(DATABASE_URL)
-    
+
+
+class QueuePoolMedido(QueuePool):
+    # Mide cuánto espera cada checkout: si crece, el pool se queda corto
+    # (incluye abrir una conexión nueva cuando hay que tirar del overflow)
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registro.observar(
+                "db_pool_checkout_wait_seconds",
+                "Espera para obtener una conexión del pool",
+                time.perf_counter() - inicio,
+                pool=self.logging_name or "primario",
+            )
+
+
+def es_sqlite_en_memoria(url: str) -> bool:
+    return url.startswith("sqlite") and (url.rstrip("/").endswith(":") or ":memory:" in url or "mode=memory" in url)
+
+def opciones_pool(url: str, nombre: str = "primario", medido: bool = True) -> dict:
+    # Una SQLite en memoria vive en una sola conexión: se deja el pool por defecto
+    if es_sqlite_en_memoria(url):
+        return {"connect_args": {"check_same_thread": False}}
+
+    opciones = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_logging_name": nombre,
+    }
+    if medido:
+        opciones["poolclass"] = QueuePoolMedido
+    if url.startswith("sqlite"):
+        opciones["connect_args"] = {"check_same_thread": False}
+    return opciones
+
+def aplicar_pragmas(engine: Engine, pragmas: dict = SQLITE_PRAGMAS):
+    # Se ejecutan en cada conexión nueva; journal_mode=WAL es persistente en el
+    # fichero, el resto es por conexión
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for nombre, valor in pragmas.items():
+                cursor.execute(f"PRAGMA {nombre}={valor}")
+        finally:
+            cursor.close()
+
+# foreign_keys no es de rendimiento: va siempre, también con SQLITE_PRAGMAS=0.
+# Sin él SQLite ignora el ON DELETE CASCADE de refresh_tokens
+PRAGMAS_SQLITE = {"foreign_keys": "ON", **SQLITE_PRAGMAS}
+
+def crear_engine(url: str, nombre: str = "primario") -> Engine:
+    nuevo = create_engine(url, **opciones_pool(url, nombre))
+    if url.startswith("sqlite"):
+        aplicar_pragmas(nuevo, PRAGMAS_SQLITE)
+    return nuevo
+
+
+engine = crear_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -21,6 +88,22 @@ SessionLocal = sessionmaker(
 
 Base = declarative_base()
 
+
+def _metricas_pool():
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return []
+    return [
+        ("db_pool_checked_out", "gauge", "Conexiones prestadas ahora mismo",
+         [({"pool": "primario"}, pool.checkedout())]),
+        ("db_pool_size", "gauge", "Conexiones abiertas en el pool (sin overflow)",
+         [({"pool": "primario"}, pool.size())]),
+        ("db_pool_overflow", "gauge", "Conexiones de overflow en uso (negativo: huecos libres)",
+         [({"pool": "primario"}, pool.overflow())]),
+    ]
+
+registro.registrar_colector(_metricas_pool)
+
 # Dependency
 def get_db():
     db = SessionLocal()
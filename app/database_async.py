@@ -0,0 +1,64 @@
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.database import PRAGMAS_SQLITE, aplicar_pragmas, opciones_pool
+from app.core.config import DATABASE_URL
+
+# Drivers asíncronos según el esquema de DATABASE_URL
+_DRIVERS_ASYNC = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def url_async(url: str) -> str:
+    esquema, separador, resto = url.partition("://")
+    if not separador:
+        raise ValueError(f"DATABASE_URL inválida: {url}")
+    return f"{_DRIVERS_ASYNC.get(esquema, esquema)}://{resto}"
+
+
+_async_engine: Optional[AsyncEngine] = None
+_AsyncSessionLocal: Optional[async_sessionmaker] = None
+
+def get_async_engine() -> AsyncEngine:
+    # Se crea bajo demanda: el driver (aiosqlite/asyncpg) solo hace falta en modo async
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        opciones = opciones_pool(DATABASE_URL, medido=False)
+        if "pool_size" in opciones:
+            opciones["poolclass"] = AsyncAdaptedQueuePool
+        _async_engine = create_async_engine(url_async(DATABASE_URL), **opciones)
+        if DATABASE_URL.startswith("sqlite"):
+            aplicar_pragmas(_async_engine.sync_engine, PRAGMAS_SQLITE)
+        _AsyncSessionLocal = async_sessionmaker(
+            bind=_async_engine,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    return _async_engine
+
+def olvidar_async_engine():
+    # Tras un fork: las conexiones heredadas se abandonan sin cerrarlas
+    # (son del padre) y el engine se vuelve a crear bajo demanda
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        _async_engine.sync_engine.dispose(close=False)
+    _async_engine = None
+    _AsyncSessionLocal = None
+
+async def dispose_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _AsyncSessionLocal = None
+
+# Dependency
+async def get_async_db():
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
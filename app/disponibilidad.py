@@ -0,0 +1,138 @@
+import hashlib
+import math
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.cambios import CREAR
+from app.models import CambioUsuario, Usuario
+from app.core.config import BLOOM_CAPACIDAD, BLOOM_FALSOS_POSITIVOS, BLOOM_SYNC_SECONDS
+
+
+class FiltroBloom:
+    # Conjunto probabilístico: "no está" es seguro, "puede estar" hay que
+    # confirmarlo. No admite borrados; una baja sigue dando "puede estar"
+    # hasta que se recarga, y la base de datos lo resuelve.
+
+    def __init__(self, capacidad: int, falsos_positivos: float):
+        self.bits = max(8, int(-capacidad * math.log(falsos_positivos) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacidad * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.elementos = 0
+
+    def _posiciones(self, clave: str):
+        # Doble hashing (Kirsch-Mitzenmacher) a partir de un solo blake2b
+        digest = hashlib.blake2b(clave.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def agregar(self, clave: str):
+        for pos in self._posiciones(clave):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+        self.elementos += 1
+
+    def __contains__(self, clave: str) -> bool:
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._posiciones(clave))
+
+
+class Disponibilidad:
+    # Usernames y mails ocupados. Se carga al arrancar, se actualiza en cada
+    # alta de este proceso y, como mucho cada BLOOM_SYNC_SECONDS, con las
+    # altas del feed de cambios (las de otros workers).
+
+    def __init__(self, capacidad: int = BLOOM_CAPACIDAD, falsos_positivos: float = BLOOM_FALSOS_POSITIVOS):
+        self.capacidad = capacidad
+        self.falsos_positivos = falsos_positivos
+        self._filtro = FiltroBloom(capacidad, falsos_positivos)
+        self._cursor = 0
+        self._ultima_sync = 0.0
+        self._cargado = False
+        self._lock = threading.Lock()
+
+    @property
+    def cargado(self) -> bool:
+        return self._cargado
+
+    def cargar(self, db: Session, chunk: int = 10000):
+        cursor = db.query(CambioUsuario.seq).order_by(CambioUsuario.seq.desc()).limit(1).scalar() or 0
+        total = db.query(func.count(Usuario.id)).scalar() or 0
+        # Si la tabla ya supera la capacidad prevista se dimensiona para ella
+        filtro = FiltroBloom(max(self.capacidad, 2 * total), self.falsos_positivos)
+        filas = db.execute(select(Usuario.username, Usuario.mail).execution_options(yield_per=chunk))
+        for username, mail in filas:
+            filtro.agregar("u:" + username)
+            filtro.agregar("m:" + mail)
+        with self._lock:
+            self._filtro = filtro
+            self._cursor = cursor
+            self._ultima_sync = time.monotonic()
+            self._cargado = True
+
+    def sincronizar(self, db: Session):
+        if time.monotonic() - self._ultima_sync < BLOOM_SYNC_SECONDS:
+            return
+        altas = db.execute(
+            select(CambioUsuario.seq, Usuario.username, Usuario.mail)
+            .join(Usuario, Usuario.id == CambioUsuario.usuario_id)
+            .where(CambioUsuario.seq > self._cursor, CambioUsuario.tipo == CREAR)
+            .order_by(CambioUsuario.seq)
+        ).all()
+        with self._lock:
+            for _, username, mail in altas:
+                self._filtro.agregar("u:" + username)
+                self._filtro.agregar("m:" + mail)
+            if altas:
+                self._cursor = max(self._cursor, altas[-1].seq)
+            self._ultima_sync = time.monotonic()
+
+    def agregar(self, username: str, mail: str):
+        with self._lock:
+            self._filtro.agregar("u:" + username)
+            self._filtro.agregar("m:" + mail)
+
+    def puede_estar_ocupado(self, campo: str, valor: str) -> bool:
+        # Sin cargar no se sabe nada: hay que preguntar a la base de datos
+        if not self._cargado:
+            return True
+        return ("u:" if campo == "username" else "m:") + valor in self._filtro
+
+    def stats(self) -> dict:
+        return {
+            "cargado": self._cargado,
+            "elementos": self._filtro.elementos,
+            "bits": self._filtro.bits,
+            "hashes": self._filtro.hashes,
+        }
+
+
+disponibilidad = Disponibilidad()
+
+
+def campo_de_error(exc: IntegrityError) -> Optional[str]:
+    # Respaldo de campo_ocupado si la fila ya no está (baja concurrente).
+    # SQLite: "UNIQUE constraint failed: usuarios.username";
+    # Postgres: "Key (username)=(...) already exists". Si chocan los dos,
+    # el índice que sale depende del orden en que se crearon
+    mensaje = str(exc.orig).lower()
+    for campo in ("username", "mail"):
+        if f"usuarios.{campo}" in mensaje or f"({campo})" in mensaje:
+            return campo
+    return None
+
+
+def campo_ocupado(db: Session, username: str, mail: str) -> Optional[str]:
+    # Si chocan los dos se informa del username, siempre el mismo
+    filas = db.execute(
+        select(Usuario.username, Usuario.mail)
+        .where((Usuario.username == username) | (Usuario.mail == mail))
+        .limit(2)
+    ).all()
+    if any(fila.username == username for fila in filas):
+        return "username"
+    return "mail" if filas else None
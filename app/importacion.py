@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.cambios import CREAR, registrar_cambios
+from app.models import Usuario
+from app.core.config import BULK_INSERT_BATCH
+
+# Tamaño de los IN (...) de la comprobación de duplicados
+_CHUNK_IN = 500
+
+
+class FormatoInvalido(ValueError):
+    pass
+
+
+def parsear_filas(contenido: bytes, content_type: str) -> list:
+    # Acepta un array JSON, NDJSON (un objeto por línea) o CSV con cabecera
+    tipo = content_type.split(";")[0].strip().lower()
+    try:
+        texto = contenido.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise FormatoInvalido("El contenido debe estar en UTF-8")
+
+    if tipo in ("text/csv", "application/csv"):
+        return [
+            {clave: valor for clave, valor in fila.items() if valor not in ("", None)}
+            for fila in csv.DictReader(io.StringIO(texto))
+        ]
+
+    try:
+        if tipo in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            return [json.loads(linea) for linea in texto.splitlines() if linea.strip()]
+        filas = json.loads(texto)
+    except json.JSONDecodeError as e:
+        raise FormatoInvalido(f"JSON inválido: {e.msg} (línea {e.lineno})")
+
+    if not isinstance(filas, list):
+        raise FormatoInvalido("Se esperaba un array de usuarios")
+    return filas
+
+
+def validar_filas(filas: list, modelo) -> tuple[list, dict]:
+    # Devuelve [(indice, UsuarioCreate)] válidos y {indice: error}
+    validas = []
+    errores = {}
+    vistos_username = set()
+    vistos_mail = set()
+
+    for i, fila in enumerate(filas):
+        if not isinstance(fila, dict):
+            errores[i] = "La fila debe ser un objeto"
+            continue
+        try:
+            usuario = modelo.model_validate(fila)
+        except ValidationError as e:
+            errores[i] = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            continue
+        if usuario.edad < 0:
+            errores[i] = "No se puede tener edad negativa"
+            continue
+        if usuario.username in vistos_username or usuario.mail in vistos_mail:
+            errores[i] = "Usuario repetido en la importación"
+            continue
+        vistos_username.add(usuario.username)
+        vistos_mail.add(usuario.mail)
+        validas.append((i, usuario))
+
+    return validas, errores
+
+
+def existentes(db: Session, usernames: list[str], mails: list[str]) -> tuple[set, set]:
+    # Una consulta por bloque en vez de un SELECT por usuario
+    usernames_tomados = set()
+    mails_tomados = set()
+    for inicio in range(0, max(len(usernames), len(mails)), _CHUNK_IN):
+        bloque_u = usernames[inicio:inicio + _CHUNK_IN]
+        bloque_m = mails[inicio:inicio + _CHUNK_IN]
+        filas = db.execute(
+            select(Usuario.username, Usuario.mail).where(
+                or_(Usuario.username.in_(bloque_u), Usuario.mail.in_(bloque_m))
+            )
+        )
+        for username, mail in filas:
+            usernames_tomados.add(username)
+            mails_tomados.add(mail)
+    return usernames_tomados, mails_tomados
+
+
+def insertar_lotes(db: Session, filas: list[dict]) -> dict:
+    # INSERT ... RETURNING con executemany, una transacción por lote.
+    # Si un lote choca con un alta concurrente se reintenta fila a fila
+    # para poder decir exactamente cuál falló.
+    # Devuelve {username: id o None si ya existía}
+    ids = {}
+    for inicio in range(0, len(filas), BULK_INSERT_BATCH):
+        lote = filas[inicio:inicio + BULK_INSERT_BATCH]
+        try:
+            result = db.execute(
+                insert(Usuario).returning(Usuario.id, Usuario.username),
+                lote
+            )
+            nuevos = {username: id_ for id_, username in result}
+            registrar_cambios(db, list(nuevos.values()), CREAR)
+            db.commit()
+            ids.update(nuevos)
+        except IntegrityError:
+            db.rollback()
+            for fila in lote:
+                try:
+                    id_ = db.execute(insert(Usuario).returning(Usuario.id), fila).scalar_one()
+                    registrar_cambios(db, [id_], CREAR)
+                    db.commit()
+                    ids[fila["username"]] = id_
+                except IntegrityError:
+                    db.rollback()
+                    ids[fila["username"]] = None
+    return ids
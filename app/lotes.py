@@ -0,0 +1,137 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+# cargar_lote(bind, claves) -> {clave: valor}; las claves que falten resuelven a None
+CargaLote = Callable[[Any, list], Awaitable[dict]]
+
+
+class CargadorLotes:
+    # Estilo dataloader: las búsquedas por clave que llegan dentro de la misma
+    # ventana se agrupan en una sola llamada a cargar_lote. Se agrupa por bind
+    # (engine): cada lote abre su propia sesión sobre él y la cierra al acabar.
+    # No se usa la sesión de ninguna petición: si la primera se cancela o
+    # termina antes, su sesión se cierra mientras el lote aún podría estar
+    # usándola desde otro hilo. Los valores se comparten entre peticiones,
+    # así que deben ser inmutables (filas, modelos de lectura).
+
+    def __init__(self, cargar_lote: CargaLote, ventana: float, maximo: int):
+        self._cargar_lote = cargar_lote
+        self.ventana = ventana
+        self.maximo = maximo
+        # bind -> ({clave: futuro}, temporizador)
+        self._grupos: dict[Hashable, tuple] = {}
+        self.lotes = 0
+        self.claves = 0
+
+    @property
+    def activo(self) -> bool:
+        return self.ventana > 0 and self.maximo > 1
+
+    async def cargar(self, bind, clave: Hashable):
+        # Solo se agrupan peticiones del mismo bind (p. ej. la misma réplica):
+        # una lectura que debe ir al primario no puede resolverse en otra base
+        if not self.activo:
+            return (await self._cargar_lote(bind, [clave])).get(clave)
+
+        loop = asyncio.get_running_loop()
+        if bind not in self._grupos:
+            temporizador = loop.call_later(self.ventana, self._despachar, bind)
+            self._grupos[bind] = ({}, temporizador)
+        pendientes = self._grupos[bind][0]
+
+        futuro = pendientes.get(clave)
+        if futuro is None:
+            futuro = loop.create_future()
+            pendientes[clave] = futuro
+            if len(pendientes) >= self.maximo:
+                self._despachar(bind)
+        # shield: si una petición se cancela, el resto del lote sigue esperando
+        return await asyncio.shield(futuro)
+
+    def _despachar(self, bind):
+        entrada = self._grupos.pop(bind, None)
+        if entrada is None:
+            return
+        pendientes, temporizador = entrada
+        temporizador.cancel()
+        asyncio.ensure_future(self._resolver(bind, pendientes))
+
+    async def _resolver(self, bind, pendientes: dict):
+        self.lotes += 1
+        self.claves += len(pendientes)
+        try:
+            valores = await self._cargar_lote(bind, list(pendientes))
+        except Exception as exc:
+            for futuro in pendientes.values():
+                if not futuro.done():
+                    futuro.set_exception(exc)
+            return
+        for clave, futuro in pendientes.items():
+            if not futuro.done():
+                futuro.set_result(valores.get(clave))
+
+    def stats(self) -> dict:
+        return {"lotes": self.lotes, "claves": self.claves}
+
+
+# escribir_lote(bind, items) -> un resultado por item, en el mismo orden;
+# si un resultado es una excepción se lanza solo en la petición de ese item
+EscrituraLote = Callable[[Any, list], Awaitable[list]]
+
+
+class EscritorLotes:
+    # Group commit: las escrituras que llegan dentro de la misma ventana se
+    # hacen en una sola transacción (un fsync para todas). Como en
+    # CargadorLotes, el lote abre su propia sesión sobre el bind del primero
+    # que llega; todas las altas van al primario.
+
+    def __init__(self, escribir_lote: EscrituraLote, ventana: float, maximo: int):
+        self._escribir_lote = escribir_lote
+        self.ventana = ventana
+        self.maximo = maximo
+        self._bind = None
+        self._pendientes: list[tuple[Any, asyncio.Future]] = []
+        self._temporizador = None
+        self.lotes = 0
+        self.items = 0
+
+    async def escribir(self, bind, item):
+        loop = asyncio.get_running_loop()
+        if not self._pendientes:
+            self._bind = bind
+            self._temporizador = loop.call_later(self.ventana, self._despachar)
+        futuro = loop.create_future()
+        self._pendientes.append((item, futuro))
+        if len(self._pendientes) >= self.maximo:
+            self._despachar()
+        return await asyncio.shield(futuro)
+
+    def _despachar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        pendientes, bind = self._pendientes, self._bind
+        self._pendientes, self._bind = [], None
+        if pendientes:
+            asyncio.ensure_future(self._resolver(bind, pendientes))
+
+    async def _resolver(self, bind, pendientes: list):
+        self.lotes += 1
+        self.items += len(pendientes)
+        try:
+            resultados = await self._escribir_lote(bind, [item for item, _ in pendientes])
+        except Exception as exc:
+            for _, futuro in pendientes:
+                if not futuro.done():
+                    futuro.set_exception(exc)
+            return
+        for (_, futuro), resultado in zip(pendientes, resultados):
+            if futuro.done():
+                continue
+            if isinstance(resultado, Exception):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+
+    def stats(self) -> dict:
+        return {"lotes": self.lotes, "items": self.items}
@@ -1,16 +1,88 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
 from app.usuarios import router as usuarios_router
 from app.auth import router as auth_router
+from app.security import calibrar_al_arrancar, shutdown_bcrypt_pool
+from app.metrics import MetricsMiddleware, registro
+from app.database import SessionLocal
+from app.busqueda import indice_usernames
+from app.disponibilidad import disponibilidad
+from app.replicas import EscriturasMiddleware, enrutador
+from app.admision import LimiteExcedido, Sobrecarga
+from app.core.config import DB_ASYNC, METRICS_ENABLED, SQL_PROFILER, SEARCH_PREFIX_INDEX
+
+logger = logging.getLogger("app")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("bcrypt: coste %s para hashes nuevos", await run_in_threadpool(calibrar_al_arrancar))
+    with SessionLocal() as db:
+        try:
+            await run_in_threadpool(disponibilidad.cargar, db)
+        except SQLAlchemyError:
+            db.rollback()
+            # Sin filtro cada comprobación va a la base de datos, pero la app arranca
+            logger.warning("No se pudo cargar el filtro de disponibilidad", exc_info=True)
+        if SEARCH_PREFIX_INDEX:
+            await run_in_threadpool(indice_usernames.cargar, db)
+    yield
+    shutdown_bcrypt_pool()
+    enrutador.dispose()
+    if DB_ASYNC:
+        from app.database_async import dispose_async_engine
+        await dispose_async_engine()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# El último middleware añadido es el más externo: métricas envuelve al profiler
+app.add_middleware(EscriturasMiddleware)
+if SQL_PROFILER:
+    from app.profiler import ProfilerMiddleware
+    app.add_middleware(ProfilerMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Respuestas rápidas del control de admisión, antes de gastar CPU en bcrypt
+@app.exception_handler(Sobrecarga)
+async def sobrecarga(request: Request, exc: Sobrecarga):
+    return ORJSONResponse(
+        {"detail": "Servidor saturado, inténtalo de nuevo"},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(LimiteExcedido)
+async def limite_excedido(request: Request, exc: LimiteExcedido):
+    return ORJSONResponse(
+        {"detail": "Demasiados intentos, espera antes de reintentar"},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 # Routers
+# En modo async las rutas async def van primero y tapan a sus equivalentes síncronas
+# (las rutas con {usuario_id:int} solo casan con números: no tapan /usuarios/search y compañía)
+if DB_ASYNC:
+    from app.usuarios_async import router as usuarios_async_router
+    app.include_router(usuarios_async_router)
+
 app.include_router(usuarios_router)
 app.include_router(auth_router)
 
 @app.get("/")
 def read_root():
-    return{"mensaje": "Backend Python funcionando"}
\ No newline at end of file
+    return{"mensaje": "Backend Python funcionando"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registro.exponer(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,76 @@
+from typing import Iterator, Optional
+
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.orm import Session
+
+from app.cambios import ACTUALIZAR, ELIMINAR, registrar_cambios
+from app.models import RefreshToken, Usuario
+from app.core.config import BULK_ADMIN_CHUNK
+
+
+def bloques_ids(db: Session, ids: Optional[list[int]], filtros: list) -> Iterator[list[int]]:
+    # Lista explícita: se trocea tal cual. Filtro: se recorre por keyset sobre
+    # la PK y se resuelve cada bloque justo antes de procesarlo, así un filtro
+    # que afecta a media tabla no se materializa entero en memoria
+    if ids is not None:
+        unicos = sorted(set(ids))
+        for inicio in range(0, len(unicos), BULK_ADMIN_CHUNK):
+            yield unicos[inicio:inicio + BULK_ADMIN_CHUNK]
+        return
+
+    ultimo_id = 0
+    while True:
+        bloque = db.execute(
+            select(Usuario.id)
+            .where(Usuario.id > ultimo_id, *filtros)
+            .order_by(Usuario.id)
+            .limit(BULK_ADMIN_CHUNK)
+        ).scalars().all()
+        if not bloque:
+            return
+        yield bloque
+        ultimo_id = bloque[-1]
+
+
+def actualizar_en_bloque(db: Session, ids: Optional[list[int]], filtros: list, valores: dict) -> list:
+    # UPDATE ... WHERE id IN (...) RETURNING, una transacción por bloque.
+    # Devuelve (id, username) de las filas tocadas para invalidar cachés
+    cambios = dict(valores)
+    cambios["version"] = Usuario.version + 1
+    if "es_admin" in valores:
+        # Igual que en actualizar_usuario: cambiar de rol revoca los tokens emitidos
+        cambios["token_version"] = case(
+            (Usuario.es_admin.is_not(valores["es_admin"]), Usuario.token_version + 1),
+            else_=Usuario.token_version,
+        )
+
+    afectados = []
+    for bloque in bloques_ids(db, ids, filtros):
+        filas = db.execute(
+            update(Usuario)
+            .where(Usuario.id.in_(bloque))
+            .values(cambios)
+            .returning(Usuario.id, Usuario.username)
+            .execution_options(synchronize_session=False)
+        ).all()
+        registrar_cambios(db, [fila.id for fila in filas], ACTUALIZAR)
+        db.commit()
+        afectados.extend(filas)
+    return afectados
+
+
+def eliminar_en_bloque(db: Session, ids: Optional[list[int]], filtros: list) -> list:
+    afectados = []
+    for bloque in bloques_ids(db, ids, filtros):
+        # El CASCADE de refresh_tokens no se aplica en SQLite sin PRAGMA foreign_keys
+        db.execute(delete(RefreshToken).where(RefreshToken.usuario_id.in_(bloque)))
+        filas = db.execute(
+            delete(Usuario)
+            .where(Usuario.id.in_(bloque))
+            .returning(Usuario.id, Usuario.username)
+            .execution_options(synchronize_session=False)
+        ).all()
+        registrar_cambios(db, [fila.id for fila in filas], ELIMINAR)
+        db.commit()
+        afectados.extend(filas)
+    return afectados
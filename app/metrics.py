@@ -0,0 +1,216 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Límites en segundos, al estilo de los clientes de Prometheus
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class EstadoPeticion:
+    # Acumuladores de una petición. El middleware lo guarda en un ContextVar;
+    # los hilos del threadpool reciben una copia del contexto que apunta al
+    # mismo objeto, así que lo que sumen ahí se ve al terminar la petición.
+    __slots__ = ("scope", "db_segundos", "db_consultas", "sentencias")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope if scope is not None else {}
+        self.db_segundos = 0.0
+        self.db_consultas = 0
+        self.sentencias: dict = {}
+
+    @property
+    def ruta(self) -> str:
+        # El router escribe la ruta en el scope al resolverla. Usamos la plantilla
+        # ("/usuarios/{usuario_id}") y nunca la URL real, para no disparar la
+        # cardinalidad de las series
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "<sin_ruta>"
+
+
+peticion_actual: ContextVar[Optional[EstadoPeticion]] = ContextVar("peticion_actual", default=None)
+
+
+class Histograma:
+    __slots__ = ("buckets", "conteos", "suma", "total")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.conteos[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+def _formatear_labels(labels: tuple, extra: str = "") -> str:
+    partes = [f'{k}="{_escapar(v)}"' for k, v in labels]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tipos: dict[str, tuple[str, str]] = {}
+        self._valores: dict[str, dict[tuple, object]] = {}
+        self._colectores: list[Callable[[], list]] = []
+
+    def _serie(self, nombre: str, tipo: str, ayuda: str):
+        if nombre not in self._tipos:
+            self._tipos[nombre] = (tipo, ayuda)
+            self._valores[nombre] = {}
+        return self._valores[nombre]
+
+    def inc(self, nombre: str, ayuda: str, valor: float = 1, **labels):
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            serie = self._serie(nombre, "counter", ayuda)
+            serie[clave] = serie.get(clave, 0) + valor
+
+    def gauge_add(self, nombre: str, ayuda: str, valor: float, **labels):
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            serie = self._serie(nombre, "gauge", ayuda)
+            serie[clave] = serie.get(clave, 0) + valor
+
+    def observar(self, nombre: str, ayuda: str, valor: float, buckets=BUCKETS_LATENCIA, **labels):
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            serie = self._serie(nombre, "histogram", ayuda)
+            histograma = serie.get(clave)
+            if histograma is None:
+                histograma = serie[clave] = Histograma(buckets)
+            histograma.observar(valor)
+
+    def registrar_colector(self, colector: Callable[[], list]):
+        # El colector devuelve [(nombre, tipo, ayuda, [(labels_dict, valor)])]
+        # y se evalúa solo al exponer, sin coste por petición
+        self._colectores.append(colector)
+
+    def exponer(self) -> str:
+        lineas = []
+        with self._lock:
+            for nombre, (tipo, ayuda) in self._tipos.items():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for labels, valor in self._valores[nombre].items():
+                    if tipo == "histogram":
+                        acumulado = 0
+                        for limite, conteo in zip(valor.buckets, valor.conteos):
+                            acumulado += conteo
+                            le = 'le="%s"' % limite
+                            lineas.append(f"{nombre}_bucket{_formatear_labels(labels, le)} {acumulado}")
+                        le = 'le="+Inf"'
+                        lineas.append(f"{nombre}_bucket{_formatear_labels(labels, le)} {valor.total}")
+                        lineas.append(f"{nombre}_sum{_formatear_labels(labels)} {valor.suma}")
+                        lineas.append(f"{nombre}_count{_formatear_labels(labels)} {valor.total}")
+                    else:
+                        lineas.append(f"{nombre}{_formatear_labels(labels)} {valor}")
+
+        for colector in self._colectores:
+            for nombre, tipo, ayuda, muestras in colector():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for labels, valor in muestras:
+                    lineas.append(f"{nombre}{_formatear_labels(tuple(sorted(labels.items())))} {valor}")
+
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+
+@contextmanager
+def temporizador(nombre: str, ayuda: str, **labels):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro.observar(nombre, ayuda, time.perf_counter() - inicio, **labels)
+
+
+# Tiempo de base de datos: se escucha en la clase Engine para cubrir todos
+# los engines (principal, réplicas, el de los tests...)
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_consulta", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    pila = conn.info.get("inicio_consulta")
+    if not pila:
+        return
+    duracion = time.perf_counter() - pila.pop()
+    estado = peticion_actual.get()
+    if estado is not None:
+        estado.db_segundos += duracion
+        estado.db_consultas += 1
+
+
+class MetricsMiddleware:
+    # Middleware ASGI puro (sin BaseHTTPMiddleware) para que el coste por
+    # petición sea un par de perf_counter y unas sumas bajo un lock
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metodo = scope["method"]
+        # Si otro middleware ya abrió el estado de la petición, se comparte
+        estado = peticion_actual.get()
+        token = None
+        if estado is None:
+            estado = EstadoPeticion(scope)
+            token = peticion_actual.set(estado)
+        status = 500
+        inicio = time.perf_counter()
+        # La ruta aún no se conoce: el gauge se cuenta por método
+        registro.gauge_add("http_requests_in_flight", "Peticiones en curso", 1, method=metodo)
+
+        async def send_con_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_status)
+        finally:
+            duracion = time.perf_counter() - inicio
+            if token is not None:
+                peticion_actual.reset(token)
+            ruta = estado.ruta
+
+            registro.gauge_add("http_requests_in_flight", "Peticiones en curso", -1, method=metodo)
+            registro.inc("http_requests_total", "Peticiones HTTP", method=metodo, route=ruta, status=str(status))
+            registro.observar(
+                "http_request_duration_seconds", "Latencia de las peticiones HTTP",
+                duracion, method=metodo, route=ruta
+            )
+            if estado.db_consultas:
+                registro.observar(
+                    "db_request_duration_seconds", "Tiempo de base de datos por petición",
+                    estado.db_segundos, route=ruta
+                )
+                registro.observar(
+                    "db_queries_per_request", "Consultas SQL por petición",
+                    estado.db_consultas, buckets=BUCKETS_CONSULTAS, route=ruta
+                )
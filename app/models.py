@@ -1,14 +1,51 @@
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, func
 from app.database import Base
 
 
 class Usuario(Base):
+    # sqlite_autoincrement: un id borrado no se reutiliza, así un token o una
+    # caché con el id de un usuario eliminado nunca apunta a otro
     __tablename__ = "usuarios"
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
-    nombre = Column(String, nullable=False)
+    nombre = Column(String, index=True, nullable=False)
     username = Column(String, unique=True, index=True, nullable=False)
     mail = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
-    edad = Column(Integer, nullable=False)
+    edad = Column(Integer, index=True, nullable=False)
     es_admin = Column(Boolean, default=False)
+    # Se incrementa para invalidar los tokens emitidos (cambio de rol, etc.)
+    token_version = Column(Integer, nullable=False, default=0)
+    # Versión de la fila: se incrementa en cada modificación y sirve de ETag
+    version = Column(Integer, nullable=False, default=1)
+    actualizado_en = Column(DateTime(timezone=True), nullable=False, default=func.now(), onupdate=func.now())
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"), index=True, nullable=False)
+    # Dueño del token al emitirlo: al rotar se comprueba que la fila sigue siendo suya
+    username = Column(String, nullable=False)
+    # SHA-256 del token: es aleatorio y largo, no necesita bcrypt
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # Todos los tokens de una misma cadena de rotación comparten familia
+    familia = Column(String(32), index=True, nullable=False)
+    # Epoch en segundos (UTC)
+    expira = Column(Integer, index=True, nullable=False)
+    revocado = Column(Boolean, default=False, nullable=False)
+
+
+class CambioUsuario(Base):
+    # Feed de cambios: una fila por alta, modificación o baja de un usuario.
+    # sqlite_autoincrement evita que SQLite reutilice seq tras borrar filas
+    __tablename__ = "cambios_usuarios"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, index=True, nullable=False)
+    # "crear", "actualizar" o "eliminar" (tombstone)
+    tipo = Column(String(10), nullable=False)
+    creado_en = Column(DateTime(timezone=True), nullable=False, default=func.now())
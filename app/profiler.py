@@ -0,0 +1,115 @@
+import logging
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from app.metrics import EstadoPeticion, peticion_actual, registro
+from app.core.config import SQL_SLOW_MS, SQL_NPLUS1_THRESHOLD
+
+logger = logging.getLogger("app.sql")
+
+# Listas IN (?, ?, ?) de distinto tamaño cuentan como la misma sentencia
+_RE_LISTA_IN = re.compile(r"\bIN\s*\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)\s*,?)+\)", re.IGNORECASE)
+_RE_ESPACIOS = re.compile(r"\s+")
+
+_activo = False
+
+
+def forma_sentencia(statement: str) -> str:
+    forma = _RE_LISTA_IN.sub("IN (...)", statement)
+    return _RE_ESPACIOS.sub(" ", forma).strip()
+
+
+def _etiqueta(ruta: str) -> str:
+    # Comentario al estilo sqlcommenter para ver la ruta en los logs de la base
+    return " /* route='%s' */" % ruta.replace("*/", "").replace("'", "")
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    estado = peticion_actual.get()
+    conn.info.setdefault("profiler", []).append((time.perf_counter(), forma_sentencia(statement)))
+    if estado is None:
+        return statement, parameters
+    return statement + _etiqueta(f"{estado.scope.get('method', '')} {estado.ruta}".strip()), parameters
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    pila = conn.info.get("profiler")
+    if not pila:
+        return
+    inicio, forma = pila.pop()
+    duracion_ms = (time.perf_counter() - inicio) * 1000
+
+    estado = peticion_actual.get()
+    if estado is not None:
+        estado.sentencias[forma] = estado.sentencias.get(forma, 0) + 1
+
+    if duracion_ms >= SQL_SLOW_MS:
+        ruta = estado.ruta if estado is not None else "<fuera_de_peticion>"
+        registro.inc("sql_slow_queries_total", "Consultas por encima de SQL_SLOW_MS", route=ruta)
+        logger.warning("Consulta lenta (%.1f ms) en %s: %s", duracion_ms, ruta, forma[:500])
+
+
+def activar_profiler():
+    global _activo
+    if _activo:
+        return
+    event.listen(Engine, "before_cursor_execute", _antes_de_ejecutar, retval=True)
+    event.listen(Engine, "after_cursor_execute", _despues_de_ejecutar)
+    _activo = True
+
+
+def desactivar_profiler():
+    global _activo
+    if not _activo:
+        return
+    event.remove(Engine, "before_cursor_execute", _antes_de_ejecutar)
+    event.remove(Engine, "after_cursor_execute", _despues_de_ejecutar)
+    _activo = False
+
+
+def revisar_n_mas_1(estado: EstadoPeticion, umbral: int = SQL_NPLUS1_THRESHOLD) -> list:
+    # La misma forma de sentencia repetida muchas veces en una petición suele
+    # ser un bucle que consulta fila a fila (N+1)
+    repetidas = [(forma, veces) for forma, veces in estado.sentencias.items() if veces >= umbral]
+    for forma, veces in repetidas:
+        registro.inc("sql_nplus1_warnings_total", "Posibles N+1 detectados", route=estado.ruta)
+        logger.warning("Posible N+1 en %s: %d veces %s", estado.ruta, veces, forma[:500])
+    return repetidas
+
+
+class ProfilerMiddleware:
+    # Añade X-DB-Queries y Server-Timing a la respuesta. Reutiliza el estado
+    # del MetricsMiddleware si está activo; si no, crea el suyo.
+
+    def __init__(self, app):
+        self.app = app
+        activar_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        estado = peticion_actual.get()
+        token = None
+        if estado is None:
+            estado = EstadoPeticion(scope)
+            token = peticion_actual.set(estado)
+
+        async def send_con_cabeceras(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("X-DB-Queries", str(estado.db_consultas))
+                headers.append("Server-Timing", f'db;dur={estado.db_segundos * 1000:.2f};desc="{estado.db_consultas} queries"')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_cabeceras)
+        finally:
+            if token is not None:
+                peticion_actual.reset(token)
+            revisar_n_mas_1(estado)
@@ -0,0 +1,121 @@
+import hashlib
+import secrets
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+
+from app.models import RefreshToken, Usuario
+from app.core.config import REFRESH_TOKEN_EXPIRE_DAYS, REFRESH_SWEEP_SECONDS
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class RevocacionStore:
+    # Hashes de refresh tokens ya rotados o revocados, con su caducidad.
+    # Evita ir a la base de datos cuando alguien reutiliza un token viejo;
+    # la tabla refresh_tokens sigue siendo la fuente de verdad.
+
+    def __init__(self, sweep_seconds: int):
+        self.sweep_seconds = sweep_seconds
+        self._revocados: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._ultimo_barrido = time.time()
+
+    def revocar(self, token_hash: str, expira: int):
+        with self._lock:
+            self._revocados[token_hash] = expira
+
+    def esta_revocado(self, token_hash: str) -> bool:
+        with self._lock:
+            return token_hash in self._revocados
+
+    def barrer(self, db: Session, ahora: Optional[int] = None) -> bool:
+        # Quita de memoria y de la tabla lo que ya caducó; como mucho una vez por intervalo
+        ahora = int(ahora if ahora is not None else time.time())
+        with self._lock:
+            if ahora - self._ultimo_barrido < self.sweep_seconds:
+                return False
+            self._ultimo_barrido = ahora
+            self._revocados = {h: exp for h, exp in self._revocados.items() if exp > ahora}
+        db.execute(delete(RefreshToken).where(RefreshToken.expira <= ahora))
+        db.commit()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._revocados)
+
+
+revocaciones = RevocacionStore(REFRESH_SWEEP_SECONDS)
+
+
+def emitir_refresh_token(db: Session, usuario_id: int, username: str, familia: Optional[str] = None) -> str:
+    # Añade el token a la sesión; el commit lo hace quien llama
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        usuario_id=usuario_id,
+        username=username,
+        token_hash=hash_token(token),
+        familia=familia or secrets.token_hex(8),
+        expira=int(time.time()) + REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+        revocado=False,
+    ))
+    return token
+
+
+def revocar_familia(db: Session, familia: str):
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.familia == familia)
+        .values(revocado=True)
+    )
+    db.commit()
+
+
+def rotar_refresh_token(db: Session, token: str) -> Optional[tuple[int, str, str]]:
+    # Devuelve (usuario_id, username, nuevo_token) o None si el token no es válido.
+    # Reutilizar un token ya rotado revoca toda su familia.
+    token_hash = hash_token(token)
+    ahora = int(time.time())
+
+    revocaciones.barrer(db, ahora)
+
+    if revocaciones.esta_revocado(token_hash):
+        fila = db.query(RefreshToken.familia).filter(RefreshToken.token_hash == token_hash).first()
+        if fila is not None:
+            revocar_familia(db, fila.familia)
+        return None
+
+    fila = db.query(RefreshToken).filter(RefreshToken.token_hash == token_hash).first()
+    if fila is None or fila.expira <= ahora:
+        return None
+    if fila.revocado:
+        revocar_familia(db, fila.familia)
+        return None
+    # El usuario ya no existe (o el id es de otro): el token muere con su dueño
+    dueno = db.query(Usuario.username).filter(Usuario.id == fila.usuario_id).scalar()
+    if dueno != fila.username:
+        revocar_familia(db, fila.familia)
+        return None
+
+    # UPDATE condicional: si dos peticiones rotan el mismo token a la vez, solo gana una.
+    # La que pierde ha presentado un token ya usado: es una reutilización y,
+    # como arriba, se revoca la familia (también el token que acaba de emitir la otra)
+    result = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == fila.id, RefreshToken.revocado == False)  # noqa: E712
+        .values(revocado=True)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        revocar_familia(db, fila.familia)
+        return None
+
+    nuevo = emitir_refresh_token(db, fila.usuario_id, fila.username, fila.familia)
+    db.commit()
+    revocaciones.revocar(token_hash, fila.expira)
+    return fila.usuario_id, fila.username, nuevo
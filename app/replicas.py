@@ -0,0 +1,171 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
+
+from fastapi import Depends, Request
+from jose import jwt, JWTError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.cache import TTLCache
+from app.database import crear_engine, get_db
+from app.metrics import registro
+from app.core.config import (
+    DATABASE_REPLICA_URLS,
+    REPLICA_STRATEGY,
+    REPLICA_STICKY_SECONDS,
+    REPLICA_RETRY_SECONDS,
+)
+
+logger = logging.getLogger("app.replicas")
+
+_METODOS_LECTURA = {"GET", "HEAD", "OPTIONS"}
+
+
+class Replica:
+    def __init__(self, nombre: str, url: str):
+        self.nombre = nombre
+        self.engine = crear_engine(url, nombre)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.en_uso = 0
+        self.caida_hasta = 0.0
+
+    @property
+    def sana(self) -> bool:
+        return time.monotonic() >= self.caida_hasta
+
+
+class EnrutadorLecturas:
+    # Reparte las lecturas entre réplicas. Una réplica que falla al conectar
+    # se aparta REPLICA_RETRY_SECONDS y mientras tanto se lee del primario.
+    # Tras una escritura, el mismo usuario lee del primario durante
+    # REPLICA_STICKY_SECONDS para ver sus propios cambios aunque la réplica
+    # vaya con retraso (por proceso, como el resto de cachés).
+
+    def __init__(self, urls: list[str], estrategia: str = "round_robin"):
+        if estrategia not in ("round_robin", "least_busy"):
+            raise ValueError(f"REPLICA_STRATEGY desconocida: {estrategia}")
+        self.replicas = [Replica(f"replica{i}", url) for i, url in enumerate(urls)]
+        self.estrategia = estrategia
+        self._turno = itertools.count()
+        self._lock = threading.Lock()
+        self._escrituras = TTLCache(maxsize=100000, ttl=REPLICA_STICKY_SECONDS)
+
+    @property
+    def activo(self) -> bool:
+        return bool(self.replicas)
+
+    def elegir(self) -> Optional[Replica]:
+        sanas = [replica for replica in self.replicas if replica.sana]
+        if not sanas:
+            return None
+        with self._lock:
+            if self.estrategia == "least_busy":
+                replica = min(sanas, key=lambda r: r.en_uso)
+            else:
+                replica = sanas[next(self._turno) % len(sanas)]
+            replica.en_uso += 1
+        return replica
+
+    def liberar(self, replica: Replica):
+        with self._lock:
+            replica.en_uso -= 1
+
+    def marcar_caida(self, replica: Replica):
+        replica.caida_hasta = time.monotonic() + REPLICA_RETRY_SECONDS
+        logger.warning("Réplica %s no disponible; se lee del primario %ss", replica.nombre, REPLICA_RETRY_SECONDS)
+
+    def registrar_escritura(self, sujeto: str):
+        self._escrituras.set(sujeto, True)
+
+    def debe_usar_primario(self, sujeto: Optional[str]) -> bool:
+        return sujeto is not None and self._escrituras.get(sujeto) is not None
+
+    def dispose(self, close: bool = True):
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+
+enrutador = EnrutadorLecturas(DATABASE_REPLICA_URLS, REPLICA_STRATEGY)
+
+
+def _metricas_replicas():
+    if not enrutador.activo:
+        return []
+    return [
+        ("db_replica_sesiones", "gauge", "Sesiones de lectura abiertas por réplica",
+         [({"replica": r.nombre}, r.en_uso) for r in enrutador.replicas]),
+        ("db_replica_sana", "gauge", "1 si la réplica recibe lecturas",
+         [({"replica": r.nombre}, int(r.sana)) for r in enrutador.replicas]),
+    ]
+
+registro.registrar_colector(_metricas_replicas)
+
+
+def sujeto_no_verificado(authorization: Optional[str]) -> Optional[str]:
+    # Solo decide a qué base va la lectura; la autenticación real se hace aparte
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.get_unverified_claims(authorization[7:]).get("sub")
+    except JWTError:
+        return None
+
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    # Sesión para rutas que solo leen. Sin réplicas, o si el usuario acaba de
+    # escribir, es la misma sesión del primario que get_db (que no abre
+    # conexión hasta usarse)
+    if not enrutador.activo or enrutador.debe_usar_primario(
+        sujeto_no_verificado(request.headers.get("authorization"))
+    ):
+        yield db
+        return
+
+    replica = enrutador.elegir()
+    if replica is None:
+        yield db
+        return
+
+    lectura = replica.SessionLocal()
+    try:
+        # La conexión se abre aquí y no en la primera consulta, para poder
+        # caer al primario si la réplica no responde
+        lectura.connection()
+    except DBAPIError:
+        enrutador.marcar_caida(replica)
+        lectura.close()
+        enrutador.liberar(replica)
+        yield db
+        return
+
+    try:
+        yield lectura
+    finally:
+        lectura.close()
+        enrutador.liberar(replica)
+
+
+class EscriturasMiddleware:
+    # Tras una escritura con éxito anota al usuario del token para que sus
+    # siguientes lecturas vayan al primario
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not enrutador.activo or scope["type"] != "http" or scope["method"] in _METODOS_LECTURA:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_anotando(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = dict(scope["headers"])
+                sujeto = sujeto_no_verificado(headers.get(b"authorization", b"").decode("latin-1"))
+                if sujeto is not None:
+                    enrutador.registrar_escritura(sujeto)
+            await send(message)
+
+        await self.app(scope, receive, send_anotando)
@@ -1,13 +1,189 @@
+import asyncio
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
 from passlib.context import CryptContext
+from passlib.hash import bcrypt as bcrypt_handler
+
+from app.core.config import (
+    BCRYPT_WORKERS,
+    BCRYPT_ROUNDS,
+    BCRYPT_TARGET_MS,
+    BCRYPT_MIN_ROUNDS,
+    BCRYPT_MAX_ROUNDS,
+    BCRYPT_IMPORT_LOTE,
+    BCRYPT_IMPORT_CUOTA,
+)
+from app.metrics import registro, temporizador
+from app.admision import limitador_bcrypt
+
+_AYUDA_BCRYPT = "Tiempo de bcrypt visto desde la petición (incluye la espera en el pool)"
+
+def _contexto(rounds: int) -> CryptContext:
+    # min_rounds y max_rounds iguales: needs_update marca cualquier hash con
+    # otro coste, también los más caros si la calibración baja el coste
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+# Coste vigente: BCRYPT_ROUNDS o, si no se fija, el que calcule
+# calibrar_rounds() al arrancar
+bcrypt_rounds = BCRYPT_ROUNDS or 12
+pwd_context = _contexto(bcrypt_rounds)
+_calibrado = False
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pool de procesos para bcrypt: se crea la primera vez que se usa,
+# así cada worker del servidor tiene el suyo propio
+_bcrypt_pool: Optional[ProcessPoolExecutor] = None
+# Turnos de limitador_bcrypt que pueden tener a la vez las importaciones
+_cuota_importacion: Optional[asyncio.Semaphore] = None
 
-def hash_password(password: str) -> str:
-    # bcrypt solo admite 72 bytes. Truncamos UTF-8 seguro
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
+    # bcrypt solo admite 72 bytes. Truncamos UTF-8 seguro.
+    # Los procesos del pool no ven la calibración del padre: el coste viaja como argumento
     truncated = password.encode("utf-8")[:72]
-    return pwd_context.hash(truncated)
+    if rounds is None or rounds == bcrypt_rounds:
+        return pwd_context.hash(truncated)
+    return bcrypt_handler.using(rounds=rounds).hash(truncated)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     truncated = plain_password.encode("utf-8")[:72]
-    return pwd_context.verify(truncated, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(truncated, hashed_password)
+
+
+def necesita_rehash(hashed_password: str) -> bool:
+    # Solo mira la cabecera del hash ($2b$<coste>$...): no cuesta un bcrypt
+    return pwd_context.needs_update(hashed_password)
+
+
+def configurar_rounds(rounds: int):
+    global bcrypt_rounds, pwd_context
+    bcrypt_rounds = rounds
+    pwd_context = _contexto(rounds)
+
+
+def calibrar_rounds(objetivo_ms: float = BCRYPT_TARGET_MS) -> int:
+    # bcrypt dobla su coste con cada round: se mide un coste bajo y se
+    # extrapola al mayor que quepa en el objetivo
+    base = 8
+    handler = bcrypt_handler.using(rounds=base)
+    medidas = []
+    for _ in range(3):
+        inicio = time.perf_counter()
+        handler.hash(b"calibracion")
+        medidas.append((time.perf_counter() - inicio) * 1000)
+    ms_base = min(medidas)
+    rounds = base + int(math.floor(math.log2(objetivo_ms / ms_base))) if ms_base > 0 else BCRYPT_MAX_ROUNDS
+    return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+
+
+def calibrar_al_arrancar() -> int:
+    # BCRYPT_ROUNDS fijo manda; BCRYPT_TARGET_MS=0 deja el coste por defecto.
+    # Una vez por proceso: app.serve calibra antes del fork y los workers lo
+    # heredan, así todos usan el mismo coste y no se rehashean entre ellos
+    global _calibrado
+    if not _calibrado and not BCRYPT_ROUNDS and BCRYPT_TARGET_MS > 0:
+        configurar_rounds(calibrar_rounds())
+    _calibrado = True
+    return bcrypt_rounds
+
+
+def _metricas_bcrypt():
+    return [("bcrypt_rounds", "gauge", "Coste de bcrypt para hashes nuevos", [({}, bcrypt_rounds)])]
+
+registro.registrar_colector(_metricas_bcrypt)
+
+
+def get_bcrypt_pool() -> Optional[ProcessPoolExecutor]:
+    global _bcrypt_pool
+    # BCRYPT_WORKERS=0 desactiva el pool y usa los hilos del event loop
+    if BCRYPT_WORKERS <= 0:
+        return None
+    if _bcrypt_pool is None:
+        # spawn evita heredar hilos y conexiones abiertas del proceso padre
+        _bcrypt_pool = ProcessPoolExecutor(
+            max_workers=BCRYPT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _bcrypt_pool
+
+
+def olvidar_bcrypt_pool():
+    # Tras un fork el pool heredado es del padre: el hijo crea el suyo
+    global _bcrypt_pool
+    _bcrypt_pool = None
+
+
+def shutdown_bcrypt_pool():
+    global _bcrypt_pool
+    if _bcrypt_pool is not None:
+        _bcrypt_pool.shutdown(wait=True, cancel_futures=True)
+        _bcrypt_pool = None
+
+
+# Las dos pasan por limitador_bcrypt: si no hay turno ni sitio en la cola
+# se lanza Sobrecarga (503) en vez de encolar más trabajo en el pool
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    async with limitador_bcrypt.turno():
+        with temporizador("bcrypt_duration_seconds", _AYUDA_BCRYPT, op="hash"):
+            return await loop.run_in_executor(get_bcrypt_pool(), hash_password, password, bcrypt_rounds)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    async with limitador_bcrypt.turno():
+        with temporizador("bcrypt_duration_seconds", _AYUDA_BCRYPT, op="verify"):
+            return await loop.run_in_executor(
+                get_bcrypt_pool(), verify_password, plain_password, hashed_password
+            )
+
+
+def _hash_lote(passwords: list[str], rounds: Optional[int] = None) -> list[str]:
+    return [hash_password(password, rounds) for password in passwords]
+
+
+async def hash_passwords_async(passwords: list[str]) -> list[str]:
+    # Importaciones: trozos de BCRYPT_IMPORT_LOTE contraseñas y cada trozo con
+    # su turno en limitador_bcrypt, como un login más. Entre todas las
+    # importaciones no ocupan más de BCRYPT_IMPORT_CUOTA turnos a la vez, así
+    # una importación grande no deja sin bcrypt a logins y altas
+    global _cuota_importacion
+    if not passwords:
+        return []
+    if _cuota_importacion is None:
+        _cuota_importacion = asyncio.Semaphore(max(BCRYPT_IMPORT_CUOTA, 1))
+
+    tam = max(BCRYPT_IMPORT_LOTE, 1)
+    trozos = [passwords[i:i + tam] for i in range(0, len(passwords), tam)]
+    resultados: list = [None] * len(trozos)
+    siguiente = 0
+    fallo = False
+
+    loop = asyncio.get_running_loop()
+    pool = get_bcrypt_pool()
+
+    async def trabajador():
+        nonlocal siguiente, fallo
+        while siguiente < len(trozos) and not fallo:
+            i = siguiente
+            siguiente += 1
+            try:
+                async with _cuota_importacion, limitador_bcrypt.turno():
+                    resultados[i] = await loop.run_in_executor(pool, _hash_lote, trozos[i], bcrypt_rounds)
+            except BaseException:
+                # Sobrecarga u otro error: los demás trabajadores dejan de pedir turnos
+                fallo = True
+                raise
+
+    with temporizador("bcrypt_duration_seconds", _AYUDA_BCRYPT, op="hash_lote"):
+        await asyncio.gather(*(trabajador() for _ in range(min(max(BCRYPT_IMPORT_CUOTA, 1), len(trozos)))))
+    return [hashed for trozo in resultados for hashed in trozo]
@@ -0,0 +1,189 @@
+"""Carga usuarios sintéticos para probar con tablas de tamaño real.
+
+    python -m app.seed --filas 1000000 --seed 42
+    python -m app.seed --filas 50000 --url sqlite:///./otra.db --limpiar
+
+Las contraseñas no se hashean fila a fila: se precalculan --hashes hashes
+(bcrypt al coste vigente) y cada usuario reutiliza uno. El usuario i tiene
+la contraseña "seed<i % hashes>", útil para pruebas de carga del login.
+Con la misma semilla y la misma tabla de partida el resultado es idéntico
+(salvo la sal de esos pocos hashes).
+
+Pensado para una base sin tráfico: durante la carga SQLite va sin journal,
+con bloqueo exclusivo y sin los índices que no son UNIQUE.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import Index, create_engine, delete, event, func, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models import CambioUsuario, RefreshToken, Usuario
+from app.cambios import CREAR, registrar_cambios
+from app.security import hash_password
+from app.core.config import DATABASE_URL
+
+NOMBRES = (
+    "Ana", "Luis", "María", "Carlos", "Lucía", "Javier", "Sofía", "Pablo", "Elena", "Diego",
+    "Laura", "Jorge", "Marta", "Andrés", "Paula", "Miguel", "Carmen", "Raúl", "Irene", "Sergio",
+    "Nuria", "Álvaro", "Sara", "Hugo", "Claudia", "Iván", "Alba", "Rubén", "Julia", "Adrián",
+)
+APELLIDOS = (
+    "García", "Martínez", "López", "Sánchez", "Pérez", "Gómez", "Martín", "Jiménez", "Ruiz", "Hernández",
+    "Díaz", "Moreno", "Muñoz", "Álvarez", "Romero", "Alonso", "Gutiérrez", "Navarro", "Torres", "Domínguez",
+    "Vázquez", "Ramos", "Gil", "Ramírez", "Serrano", "Blanco", "Molina", "Morales", "Suárez", "Ortega",
+)
+DOMINIOS = ("gmail.com", "hotmail.com", "yahoo.es", "outlook.com", "empresa.com", "correo.es")
+
+# Solo durante la carga: sin fsync ni journal en disco. Al acabar se vuelve a WAL
+PRAGMAS_CARGA = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": -262144,
+    "locking_mode": "EXCLUSIVE",
+}
+
+
+def _ascii(texto: str) -> str:
+    return texto.translate(str.maketrans("áéíóúÁÉÍÓÚñÑ", "aeiouAEIOUnN")).lower()
+
+
+def generar_filas(inicio: int, cantidad: int, rnd: random.Random, hashes: list[str], ratio_admin: float):
+    nombres = [(nombre, _ascii(nombre)) for nombre in NOMBRES]
+    apellidos = [(apellido, _ascii(apellido)) for apellido in APELLIDOS]
+    for i in range(inicio, inicio + cantidad):
+        nombre, nombre_ascii = rnd.choice(nombres)
+        apellido, apellido_ascii = rnd.choice(apellidos)
+        # Sufijo con el índice: únicos sin tener que comprobarlo
+        username = f"{nombre_ascii}.{apellido_ascii}{i}"
+        yield {
+            "id": i,
+            "nombre": f"{nombre} {apellido}",
+            "username": username,
+            "mail": f"{username}@{rnd.choice(DOMINIOS)}",
+            "password": hashes[i % len(hashes)],
+            # Más jóvenes que mayores, entre 18 y 90
+            "edad": int(rnd.triangular(18, 90, 28)),
+            "es_admin": rnd.random() < ratio_admin,
+            "token_version": 0,
+            "version": 1,
+        }
+
+
+def _indices_secundarios() -> list[Index]:
+    # Los que no son UNIQUE: sin ellos la carga no pierde ninguna comprobación
+    # y reconstruirlos al final de una vez sale más barato que mantenerlos fila a fila
+    return [indice for indice in Usuario.__table__.indexes if not indice.unique]
+
+
+def _pragmas_carga(engine: Engine):
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for nombre, valor in PRAGMAS_CARGA.items():
+            cursor.execute(f"PRAGMA {nombre}={valor}")
+        cursor.close()
+
+
+_ULTIMO_ID_POSTGRES = "SELECT pg_sequence_last_value(pg_get_serial_sequence('usuarios', 'id')::regclass)"
+_AJUSTAR_SECUENCIA_POSTGRES = (
+    "SELECT setval(pg_get_serial_sequence('usuarios', 'id'), (SELECT max(id) FROM usuarios)) "
+    "WHERE EXISTS (SELECT 1 FROM usuarios)"
+)
+
+
+def sembrar(url: str, filas: int, semilla: int, lote: int, num_hashes: int,
+            ratio_admin: float, feed: bool = False, limpiar: bool = False, progreso: bool = False) -> float:
+    es_sqlite = url.startswith("sqlite")
+    engine = create_engine(url)
+    es_postgres = engine.dialect.name == "postgresql"
+    if es_sqlite:
+        _pragmas_carga(engine)
+    Base.metadata.create_all(bind=engine)
+
+    hashes = [hash_password(f"seed{k}") for k in range(num_hashes)]
+    rnd = random.Random(semilla)
+
+    inicio_carga = time.perf_counter()
+    with engine.begin() as conn:
+        if limpiar:
+            conn.execute(delete(RefreshToken))
+            conn.execute(delete(CambioUsuario))
+            conn.execute(delete(Usuario))
+            if es_sqlite:
+                # Carga desde cero: los ids vuelven a empezar en 1
+                conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'usuarios'"))
+        # Los ids siguen tras los ya existentes: una segunda carga no choca. Van
+        # explícitos (id = índice del generador) y nunca por debajo de la
+        # secuencia de AUTOINCREMENT, para no reutilizar ids de usuarios borrados
+        inicio = conn.execute(select(func.max(Usuario.id))).scalar() or 0
+        if es_sqlite:
+            secuencia = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'usuarios'")).scalar()
+            inicio = max(inicio, secuencia or 0)
+        elif es_postgres and not limpiar:
+            secuencia = conn.execute(text(_ULTIMO_ID_POSTGRES)).scalar()
+            inicio = max(inicio, secuencia or 0)
+        inicio += 1
+        for indice in _indices_secundarios():
+            indice.drop(conn, checkfirst=True)
+
+    generador = generar_filas(inicio, filas, rnd, hashes, ratio_admin)
+    cargadas = 0
+    try:
+        while cargadas < filas:
+            bloque = [next(generador) for _ in range(min(lote, filas - cargadas))]
+            # Un executemany por bloque y una transacción por bloque.
+            # Sin feed no hace falta RETURNING y el INSERT es más barato
+            with Session(engine) as db:
+                if feed:
+                    ids = db.execute(insert(Usuario).returning(Usuario.id), bloque).scalars().all()
+                    registrar_cambios(db, list(ids), CREAR)
+                else:
+                    db.execute(insert(Usuario), bloque)
+                db.commit()
+            cargadas += len(bloque)
+            if progreso:
+                print(f"\r{cargadas}/{filas}", end="", flush=True)
+    finally:
+        if progreso:
+            print()
+        # También si la carga falla a medias: la tabla no se queda sin índices
+        with engine.begin() as conn:
+            for indice in _indices_secundarios():
+                indice.create(conn, checkfirst=True)
+            if es_postgres:
+                # Los ids explícitos no avanzan la secuencia: sin esto los
+                # siguientes POST /usuarios chocarían con la clave primaria
+                conn.execute(text(_AJUSTAR_SECUENCIA_POSTGRES))
+    if es_sqlite:
+        with engine.connect() as conn:
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+            conn.execute(text("ANALYZE"))
+            conn.commit()
+    engine.dispose()
+    return time.perf_counter() - inicio_carga
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", default=DATABASE_URL)
+    parser.add_argument("--lote", type=int, default=50000, help="filas por executemany y transacción")
+    parser.add_argument("--hashes", type=int, default=8, help="hashes bcrypt precalculados a repartir")
+    parser.add_argument("--admins", type=float, default=0.001, help="proporción de administradores")
+    parser.add_argument("--feed", action="store_true", help="registrar también las altas en el feed de cambios")
+    parser.add_argument("--limpiar", action="store_true", help="borrar los usuarios existentes antes de cargar")
+    args = parser.parse_args()
+
+    segundos = sembrar(args.url, args.filas, args.seed, args.lote, args.hashes, args.admins,
+                      feed=args.feed, limpiar=args.limpiar, progreso=True)
+    print(f"{args.filas} usuarios en {segundos:.1f} s ({args.filas / segundos:,.0f} filas/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Servidor de producción: varios workers uvicorn con la app cargada antes del fork.
+
+    python -m app.serve
+    python -m app.serve --workers 4 --port 10000 --keepalive 75 --backlog 4096
+
+El proceso maestro importa la app, calibra bcrypt y abre el socket una sola
+vez; después hace fork de --workers procesos (por defecto uno por CPU) que
+aceptan conexiones del mismo socket. Si un worker muere se relanza. Con
+SIGTERM o SIGINT cada worker deja de aceptar conexiones, termina las
+peticiones en curso (hasta SERVER_GRACEFUL_SECONDS) y se cierra.
+
+Usa uvloop y httptools si están instalados. Sin fork (Windows) arranca un
+solo proceso.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import signal
+import socket
+import time
+
+logger = logging.getLogger("app.serve")
+
+# Un worker que muere antes de esto se relanza con una pausa, para no entrar
+# en un bucle de forks si falla al arrancar (p. ej. la base de datos no responde)
+_VIDA_MINIMA = 1.0
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", help="HOST (0.0.0.0)")
+    parser.add_argument("--port", type=int, help="PORT (8000)")
+    parser.add_argument("--workers", type=int, help="WEB_CONCURRENCY (una por CPU)")
+    parser.add_argument("--keepalive", type=float, help="SERVER_KEEPALIVE, segundos (5)")
+    parser.add_argument("--backlog", type=int, help="SERVER_BACKLOG, conexiones pendientes (2048)")
+    parser.add_argument("--graceful", type=float, help="SERVER_GRACEFUL_SECONDS, drenaje al parar (30)")
+    parser.add_argument("--forwarded-allow-ips", help="FORWARDED_ALLOW_IPS, proxies de confianza (127.0.0.1)")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+
+def _aplicar_entorno(args):
+    # app.core.config lee el entorno al importarse: los argumentos van antes
+    # de importar la app. BCRYPT_WORKERS se reparte según WEB_CONCURRENCY
+    valores = {
+        "HOST": args.host,
+        "PORT": args.port,
+        "WEB_CONCURRENCY": args.workers,
+        "SERVER_KEEPALIVE": args.keepalive,
+        "SERVER_BACKLOG": args.backlog,
+        "SERVER_GRACEFUL_SECONDS": args.graceful,
+        "FORWARDED_ALLOW_IPS": args.forwarded_allow_ips,
+    }
+    for nombre, valor in valores.items():
+        if valor is not None:
+            os.environ[nombre] = str(valor)
+    os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1))
+
+
+def _disponible(modulo: str) -> bool:
+    return importlib.util.find_spec(modulo) is not None
+
+
+def _abrir_socket(host: str, port: int, backlog: int) -> socket.socket:
+    familia = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(familia, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def _conexiones_propias():
+    # Un fork copia los pools con sus sockets abiertos: si padre e hijo usan
+    # la misma conexión el protocolo se corrompe. close=False las abandona sin
+    # cerrarlas (cerrarlas desde el hijo cortaría las del padre) y cada worker
+    # abre las suyas al primer uso, también las de las réplicas
+    from app.database import engine
+    from app.database_async import olvidar_async_engine
+    from app.replicas import enrutador
+    from app.security import olvidar_bcrypt_pool
+
+    engine.dispose(close=False)
+    enrutador.dispose(close=False)
+    olvidar_async_engine()
+    olvidar_bcrypt_pool()
+
+
+class Maestro:
+    def __init__(self, app, sock: socket.socket, workers: int, opciones: dict, graceful: float):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.opciones = opciones
+        self.graceful = graceful
+        self.hijos: dict[int, float] = {}
+        self.parando = False
+        self.limite = 0.0
+
+    def _worker(self):
+        import uvicorn
+
+        # El maestro reparte las señales; en el hijo las gestiona uvicorn
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        _conexiones_propias()
+        config = uvicorn.Config(self.app, **self.opciones)
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def _lanzar(self):
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                self._worker()
+            except BaseException:
+                logger.exception("El worker %s terminó con error", os.getpid())
+                codigo = 1
+            finally:
+                os._exit(codigo)
+        self.hijos[pid] = time.monotonic()
+
+    def _parar(self, signum, frame):
+        if self.parando:
+            # Segunda señal: no se espera más
+            self._matar()
+            return
+        logger.info("Señal %s: drenando %s workers", signal.Signals(signum).name, len(self.hijos))
+        self.parando = True
+        # Margen sobre el drenaje de uvicorn para el shutdown del lifespan
+        self.limite = time.monotonic() + self.graceful + 5
+        for pid in self.hijos:
+            self._senal(pid, signal.SIGTERM)
+
+    def _matar(self):
+        for pid in self.hijos:
+            self._senal(pid, signal.SIGKILL)
+
+    @staticmethod
+    def _senal(pid: int, senal: int):
+        try:
+            os.kill(pid, senal)
+        except ProcessLookupError:
+            pass
+
+    def ejecutar(self):
+        signal.signal(signal.SIGTERM, self._parar)
+        signal.signal(signal.SIGINT, self._parar)
+        for _ in range(self.workers):
+            self._lanzar()
+        logger.info("Maestro %s con %s workers", os.getpid(), self.workers)
+
+        while self.hijos:
+            pid, estado = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.parando and time.monotonic() > self.limite:
+                    logger.warning("Drenaje agotado: se matan %s workers", len(self.hijos))
+                    self._matar()
+                time.sleep(0.2)
+                continue
+            inicio = self.hijos.pop(pid, None)
+            if inicio is None or self.parando:
+                continue
+            logger.warning("El worker %s terminó (estado %s); se relanza", pid, os.waitstatus_to_exitcode(estado))
+            if time.monotonic() - inicio < _VIDA_MINIMA:
+                time.sleep(_VIDA_MINIMA)
+            self._lanzar()
+        self.sock.close()
+
+
+def main():
+    args = _argumentos()
+    _aplicar_entorno(args)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s",
+    )
+
+    # Carga previa: imports, routers y calibración de bcrypt una sola vez; los
+    # workers lo heredan con el fork. Las conexiones se abren ya en cada worker
+    from app.core.config import (
+        SERVER_HOST,
+        SERVER_PORT,
+        SERVER_WORKERS,
+        SERVER_KEEPALIVE,
+        SERVER_BACKLOG,
+        SERVER_GRACEFUL_SECONDS,
+        BCRYPT_WORKERS,
+    )
+    from app.main import app
+    from app.security import calibrar_al_arrancar
+
+    opciones = {
+        "loop": "uvloop" if _disponible("uvloop") else "asyncio",
+        "http": "httptools" if _disponible("httptools") else "h11",
+        "timeout_keep_alive": SERVER_KEEPALIVE,
+        "timeout_graceful_shutdown": SERVER_GRACEFUL_SECONDS,
+        "backlog": SERVER_BACKLOG,
+        "log_level": args.log_level,
+        "lifespan": "on",
+        # La IP del cliente la saca la app de X-Forwarded-For (FORWARDED_ALLOW_IPS,
+        # ver app.admision): uvicorn deja la del proxy para no hacerlo dos veces
+        "proxy_headers": False,
+    }
+    logger.info(
+        "loop %s, http %s, %s workers con %s procesos de bcrypt cada uno",
+        opciones["loop"], opciones["http"], SERVER_WORKERS, BCRYPT_WORKERS,
+    )
+
+    if not hasattr(os, "fork"):
+        import uvicorn
+        logger.warning("Sin fork en esta plataforma: un solo proceso")
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT, **opciones)
+        return
+
+    logger.info("bcrypt: coste %s para hashes nuevos", calibrar_al_arrancar())
+    sock = _abrir_socket(SERVER_HOST, SERVER_PORT, SERVER_BACKLOG)
+    logger.info("Escuchando en %s:%s (backlog %s)", SERVER_HOST, SERVER_PORT, SERVER_BACKLOG)
+    Maestro(app, sock, max(SERVER_WORKERS, 1), opciones, SERVER_GRACEFUL_SECONDS).ejecutar()
+
+
+if __name__ == "__main__":
+    main()
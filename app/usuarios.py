@@ -1,15 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException
+import base64
+import binascii
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+import orjson
 
 from app.database import  get_db
-from app.auth import get_current_user, requiere_admin
-from app.models import Usuario
-from app.security import hash_password
+from app.metrics import registro
+from app.replicas import get_read_db
+from app.auth import Claims, get_current_user, get_current_claims, requiere_admin, invalidar_principal
+from app.models import RefreshToken, Usuario
+from app.security import hash_password_async, hash_passwords_async
+from app.importacion import FormatoInvalido, parsear_filas, validar_filas, existentes, insertar_lotes
+from app.cambios import CREAR, ACTUALIZAR, ELIMINAR, registrar_cambio, leer_cambios, ultimo_seq, eventos_sse
+from app.busqueda import filtros_busqueda, indice_usernames
+from app.lotes import CargadorLotes, EscritorLotes
+from app.disponibilidad import disponibilidad, campo_de_error, campo_ocupado
+from app.masivo import actualizar_en_bloque, eliminar_en_bloque
+from app.core.config import (
+    USUARIOS_PAGE_MAX,
+    USUARIOS_STREAM_CHUNK,
+    BULK_MAX_FILAS,
+    CAMBIOS_PAGE_MAX,
+    SEARCH_PREFIX_INDEX,
+    SEARCH_PREFIX_MAX_CANDIDATOS,
+    BATCH_GET_MAX,
+    USUARIOS_COALESCE_MS,
+    USUARIOS_COALESCE_MAX,
+    SIGNUP_GROUP_COMMIT,
+    SIGNUP_GROUP_COMMIT_MS,
+    SIGNUP_GROUP_COMMIT_MAX,
+)
 
 
 router = APIRouter()
 
+# Columnas que se pueden devolver al cliente (nunca el hash de la contraseña)
+COLUMNAS_PUBLICAS = (
+    Usuario.id,
+    Usuario.username,
+    Usuario.mail,
+    Usuario.nombre,
+    Usuario.edad,
+    Usuario.es_admin,
+)
+CAMPOS_PUBLICOS = {columna.key: columna for columna in COLUMNAS_PUBLICAS}
+
+def usuario_a_dict(usuario) -> dict:
+    return {
+        "id": usuario.id,
+        "username": usuario.username,
+        "mail": usuario.mail,
+        "nombre": usuario.nombre,
+        "edad": usuario.edad,
+        "es_admin": usuario.es_admin
+    }
+
+# El cursor es opaco para el cliente: base64 del último id devuelto
+def codificar_cursor(ultimo_id: int) -> str:
+    raw = json.dumps({"id": ultimo_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decodificar_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        ultimo_id = int(data["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return ultimo_id
+
 class UsuarioCreate(BaseModel):
     username: str
     mail: str
@@ -27,30 +96,185 @@ class UsuarioCreate(BaseModel):
             raise ValueError("La contraseña debe tener al menos 6 caracteres")
         return value
 
+# Modelo de lectura: nunca incluye el hash de la contraseña.
+# from_attributes permite validarlo directamente desde filas u objetos ORM
 class UsuarioOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     username: str
     mail: str
-    password: str
     nombre: str
     edad: int
     es_admin: bool
 
-@router.post("/usuarios")
-def crear_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
-    
-    existing = db.query(Usuario).filter(
-        (Usuario.username == usuario.username) | (Usuario.mail == usuario.mail)
-        ).first()
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="El usuario ya existe")
+class UsuarioPagina(BaseModel):
+    items: list[UsuarioOut]
+    next_cursor: Optional[str] = None
+
+# ETag fuerte a partir del id y la versión de la fila
+# (con ?fields= cada proyección es una representación distinta y lleva su propio ETag)
+def etag_usuario(usuario_id: int, version: int, campos: Optional[tuple] = None) -> str:
+    if campos:
+        return f'"u{usuario_id}-v{version}-{".".join(campos)}"'
+    return f'"u{usuario_id}-v{version}"'
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    if not if_none_match:
+        return False
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato == "*" or candidato.removeprefix("W/") == etag:
+            return True
+    return False
+
+def no_modificado(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+def poner_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def campos_proyeccion(
+    fields: Optional[str] = Query(
+        None,
+        description="Campos a devolver separados por comas: " + ",".join(CAMPOS_PUBLICOS),
+    )
+) -> Optional[tuple]:
+    # Devuelve los campos en el orden de COLUMNAS_PUBLICAS (ETag estable) y
+    # siempre con id, que hace falta para el cursor de paginación
+    if fields is None:
+        return None
+    pedidos = {campo.strip() for campo in fields.split(",") if campo.strip()}
+    desconocidos = pedidos - CAMPOS_PUBLICOS.keys()
+    if not pedidos or desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no permitidos: {', '.join(sorted(desconocidos)) or fields!r}. "
+                   f"Disponibles: {', '.join(CAMPOS_PUBLICOS)}",
+        )
+    pedidos.add("id")
+    return tuple(campo for campo in CAMPOS_PUBLICOS if campo in pedidos)
+
+def columnas_de(campos: Optional[tuple]) -> tuple:
+    if campos is None:
+        return COLUMNAS_PUBLICAS
+    return tuple(CAMPOS_PUBLICOS[campo] for campo in campos)
+
+def proyectar(fila, campos: Optional[tuple]) -> dict:
+    if campos is None:
+        return usuario_a_dict(fila)
+    return {campo: getattr(fila, campo) for campo in campos}
+
+def respuesta_pagina(filas, next_cursor: Optional[str], campos: Optional[tuple]) -> Response:
+    if campos is None:
+        pagina = UsuarioPagina.model_validate(
+            {"items": filas, "next_cursor": next_cursor},
+            from_attributes=True
+        )
+        return respuesta_modelo(pagina)
+    # Una proyección no cumple UsuarioOut: se serializa directamente con orjson
+    cuerpo = {"items": [proyectar(fila, campos) for fila in filas], "next_cursor": next_cursor}
+    return Response(orjson.dumps(cuerpo), media_type="application/json")
+
+def respuesta_usuario(fila, etag: str, campos: tuple) -> Response:
+    return Response(
+        orjson.dumps(proyectar(fila, campos)),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+def respuesta_modelo(modelo: BaseModel) -> Response:
+    # pydantic-core serializa a JSON en un solo paso; al devolver un Response
+    # FastAPI no vuelve a validar ni pasa por jsonable_encoder
+    return Response(modelo.model_dump_json(), media_type="application/json")
+
+def conflicto(campo: Optional[str]) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail={"mensaje": "El usuario ya existe", "campo": campo},
+    )
+
+def _campo_en_conflicto(db: Session, exc: IntegrityError, usuario: UsuarioCreate) -> Optional[str]:
+    db.rollback()
+    return campo_ocupado(db, usuario.username, usuario.mail) or campo_de_error(exc)
+
+def _guardar_usuario(db: Session, nuevo: Usuario) -> Usuario:
+    db.add(nuevo)
+    db.flush()
+    registrar_cambio(db, nuevo.id, CREAR)
+    db.commit()
+    db.refresh(nuevo)
+    return nuevo
+
+class UsuarioDuplicado(Exception):
+    def __init__(self, campo: Optional[str]):
+        super().__init__(campo)
+        self.campo = campo
 
+def _abrir_transaccion(db: Session):
+    # pysqlite no emite BEGIN antes de un SAVEPOINT: el SAVEPOINT sería la
+    # transacción más externa y cada RELEASE confirmaría su fila por separado.
+    # IMMEDIATE toma ya el bloqueo de escritura y evita un SQLITE_BUSY a mitad
+    # del lote. Postgres abre la transacción solo con la primera sentencia
+    conexion = db.connection()
+    if conexion.dialect.name == "sqlite":
+        conexion.exec_driver_sql("BEGIN IMMEDIATE")
+
+def guardar_lote(db: Session, nuevos: list[Usuario]) -> list:
+    # Una transacción para todo el lote y un SAVEPOINT por fila: un duplicado
+    # solo deshace su propia fila y se devuelve como error de esa petición
+    _abrir_transaccion(db)
+    resultados = []
+    for nuevo in nuevos:
+        try:
+            with db.begin_nested():
+                db.add(nuevo)
+                db.flush()
+                registrar_cambio(db, nuevo.id, CREAR)
+            # Se copia antes del commit, que expira los objetos
+            resultados.append(usuario_a_dict(nuevo))
+        except IntegrityError as exc:
+            # El SAVEPOINT ya se deshizo: la transacción del lote sigue viva
+            campo = campo_ocupado(db, nuevo.username, nuevo.mail) or campo_de_error(exc)
+            resultados.append(UsuarioDuplicado(campo))
+    db.commit()
+    return resultados
+
+def _guardar_lote_en(bind, nuevos: list[Usuario]) -> list:
+    # Sesión propia del lote, no la de la petición que lo abrió: esa puede
+    # cerrarse (petición cancelada) mientras el lote sigue en el threadpool
+    with Session(bind=bind) as db:
+        return guardar_lote(db, nuevos)
+
+async def _escribir_usuarios(bind, nuevos: list[Usuario]) -> list:
+    return await run_in_threadpool(_guardar_lote_en, bind, nuevos)
+
+escritor_altas = EscritorLotes(
+    _escribir_usuarios,
+    ventana=SIGNUP_GROUP_COMMIT_MS / 1000,
+    maximo=SIGNUP_GROUP_COMMIT_MAX,
+)
+
+@router.post("/usuarios", response_model=UsuarioOut)
+async def crear_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
     if usuario.edad < 0:
         raise HTTPException(status_code=400, detail= "No se puede tener edad negativa"
         )
-    
-    hashed = hash_password(usuario.password)
+
+    # Las restricciones UNIQUE son la garantía real: se inserta y se captura el
+    # IntegrityError. Solo si el filtro de Bloom dice que el nombre o el mail
+    # pueden estar cogidos se pregunta antes, para no pagar un bcrypt en balde
+    if disponibilidad.cargado and (
+        disponibilidad.puede_estar_ocupado("username", usuario.username)
+        or disponibilidad.puede_estar_ocupado("mail", usuario.mail)
+    ):
+        campo = await run_in_threadpool(campo_ocupado, db, usuario.username, usuario.mail)
+        if campo is not None:
+            raise conflicto(campo)
+
+    hashed = await hash_password_async(usuario.password)
     
     nuevo = Usuario(
         username=usuario.username,
@@ -61,99 +285,503 @@ def crear_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
         es_admin=usuario.es_admin
      )
 
-    db.add(nuevo)
-    db.commit()
-    db.refresh(nuevo)
+    if SIGNUP_GROUP_COMMIT:
+        try:
+            creado = await escritor_altas.escribir(db.get_bind(), nuevo)
+        except UsuarioDuplicado as exc:
+            # Otra alta con el mismo username o mail ganó la carrera
+            raise conflicto(exc.campo)
+    else:
+        try:
+            creado = usuario_a_dict(await run_in_threadpool(_guardar_usuario, db, nuevo))
+        except IntegrityError as exc:
+            raise conflicto(await run_in_threadpool(_campo_en_conflicto, db, exc, usuario))
 
-    return {"id": nuevo.id, 
-            "nombre": nuevo.nombre,
-            "username": nuevo.username,
-            "mail": nuevo.mail,
-            "edad": nuevo.edad,
-            "es_admin": nuevo.es_admin
-            }
-    
+    disponibilidad.agregar(usuario.username, usuario.mail)
+    return creado
 
-@router.get("/usuarios")
-def listar_usuarios(
+async def _leer_importacion(request: Request) -> tuple[bytes, str]:
+    content_type = request.headers.get("content-type", "application/json")
+    if not content_type.startswith("multipart/form-data"):
+        return await request.body(), content_type
+
+    form = await request.form()
+    archivo = form.get("archivo")
+    if archivo is None or isinstance(archivo, str):
+        raise HTTPException(status_code=400, detail="Falta el fichero 'archivo'")
+    nombre = (archivo.filename or "").lower()
+    if nombre.endswith(".csv"):
+        tipo = "text/csv"
+    elif nombre.endswith((".ndjson", ".jsonl")):
+        tipo = "application/x-ndjson"
+    else:
+        tipo = archivo.content_type or "application/json"
+    return await archivo.read(), tipo
+
+@router.post("/usuarios/bulk")
+async def importar_usuarios(
+    request: Request,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    admin: Claims = Depends(requiere_admin)
+):
+    contenido, content_type = await _leer_importacion(request)
+    try:
+        filas = parsear_filas(contenido, content_type)
+    except FormatoInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(filas) > BULK_MAX_FILAS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_FILAS} usuarios por importación")
+
+    validas, errores = validar_filas(filas, UsuarioCreate)
+
+    # Duplicados contra la base de datos en una consulta por bloque
+    tomados_username, tomados_mail = await run_in_threadpool(
+        existentes, db, [u.username for _, u in validas], [u.mail for _, u in validas]
+    )
+    pendientes = []
+    for i, usuario in validas:
+        if usuario.username in tomados_username or usuario.mail in tomados_mail:
+            errores[i] = "El usuario ya existe"
+        else:
+            pendientes.append((i, usuario))
+
+    hashes = await hash_passwords_async([usuario.password for _, usuario in pendientes])
+    registros = [
+        {
+            "username": usuario.username,
+            "mail": usuario.mail,
+            "nombre": usuario.nombre,
+            "edad": usuario.edad,
+            "password": hashed,
+            "es_admin": usuario.es_admin,
+        }
+        for (_, usuario), hashed in zip(pendientes, hashes)
+    ]
+    ids = await run_in_threadpool(insertar_lotes, db, registros)
+
+    resultados = {i: {"fila": i + 1, "estado": "error", "detalle": detalle} for i, detalle in errores.items()}
+    for i, usuario in pendientes:
+        nuevo_id = ids.get(usuario.username)
+        if nuevo_id is None:
+            resultados[i] = {"fila": i + 1, "estado": "error", "detalle": "El usuario ya existe"}
+        else:
+            resultados[i] = {"fila": i + 1, "estado": "creado", "id": nuevo_id, "username": usuario.username}
+            disponibilidad.agregar(usuario.username, usuario.mail)
+
+    creados = sum(1 for r in resultados.values() if r["estado"] == "creado")
+    return {
+        "total": len(filas),
+        "creados": creados,
+        "errores": len(filas) - creados,
+        "resultados": [resultados[i] for i in sorted(resultados)]
+    }
+
+def _stream_usuarios(db: Session, after: int, campos: Optional[tuple] = None):
+    # Lee en bloques con yield_per y escribe NDJSON bloque a bloque,
+    # así la memoria no depende del tamaño de la tabla
+    try:
+        stmt = (
+            select(*columnas_de(campos))
+            .where(Usuario.id > after)
+            .order_by(Usuario.id)
+            .execution_options(yield_per=USUARIOS_STREAM_CHUNK)
+        )
+        lineas = []
+        for fila in db.execute(stmt):
+            lineas.append(orjson.dumps(proyectar(fila, campos)))
+            if len(lineas) >= USUARIOS_STREAM_CHUNK:
+                yield b"\n".join(lineas) + b"\n"
+                lineas.clear()
+        if lineas:
+            yield b"\n".join(lineas) + b"\n"
+    finally:
+        db.close()
+
+@router.get("/usuarios", response_model=UsuarioPagina)
+def listar_usuarios(
+    limit: int = Query(100, ge=1, le=USUARIOS_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    campos: Optional[tuple] = Depends(campos_proyeccion),
+    db: Session = Depends(get_read_db),
+    claims: Claims = Depends(get_current_claims)
 ):
-    if not current_user.es_admin:
+    if not claims.es_admin:
         raise  HTTPException(status_code=403, detail="No tienes permisos de admin")
-    return db.query(Usuario).all()
+
+    ultimo_id = decodificar_cursor(after)
+
+    if stream:
+        return StreamingResponse(
+            _stream_usuarios(db, ultimo_id, campos),
+            media_type="application/x-ndjson"
+        )
+
+    # Paginación por keyset sobre la PK: pedimos uno de más para saber si hay otra página
+    filas = db.execute(
+        select(*columnas_de(campos))
+        .where(Usuario.id > ultimo_id)
+        .order_by(Usuario.id)
+        .limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        next_cursor = codificar_cursor(filas[-1].id)
+
+    return respuesta_pagina(filas, next_cursor, campos)
+
+def _ocupado_en_db(db: Session, campo: str, valor: str) -> bool:
+    columna = Usuario.username if campo == "username" else Usuario.mail
+    return db.query(Usuario.id).filter(columna == valor).first() is not None
+
+def comprobar_disponibilidad(db: Session, valores: dict) -> dict:
+    if disponibilidad.cargado:
+        disponibilidad.sincronizar(db)
+    respuesta = {}
+    for campo, valor in valores.items():
+        if not disponibilidad.puede_estar_ocupado(campo, valor):
+            # "No está" en un filtro de Bloom es seguro: no hace falta la base
+            registro.inc("disponibilidad_consultas_total", "Comprobaciones de disponibilidad", fuente="bloom")
+            respuesta[campo] = True
+        else:
+            registro.inc("disponibilidad_consultas_total", "Comprobaciones de disponibilidad", fuente="db")
+            respuesta[campo] = not _ocupado_en_db(db, campo, valor)
+    return respuesta
+
+@router.get("/usuarios/disponible")
+def usuario_disponible(
+    username: Optional[str] = Query(None, min_length=1),
+    mail: Optional[str] = Query(None, min_length=1),
+    db: Session = Depends(get_read_db)
+):
+    valores = {campo: valor for campo, valor in (("username", username), ("mail", mail)) if valor}
+    if not valores:
+        raise HTTPException(status_code=400, detail="Indica username o mail")
+    return comprobar_disponibilidad(db, valores)
+
+@router.get("/usuarios/search", response_model=UsuarioPagina)
+def buscar_usuarios(
+    username: Optional[str] = Query(None, min_length=1),
+    nombre: Optional[str] = Query(None, min_length=1),
+    mail: Optional[str] = Query(None, min_length=1),
+    edad_min: Optional[int] = Query(None, ge=0),
+    edad_max: Optional[int] = Query(None, ge=0),
+    es_admin: Optional[bool] = None,
+    limit: int = Query(100, ge=1, le=USUARIOS_PAGE_MAX),
+    after: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    admin: Claims = Depends(requiere_admin)
+):
+    ultimo_id = decodificar_cursor(after)
+    filtros = filtros_busqueda(username, nombre, mail, edad_min, edad_max, es_admin)
+
+    # Con el índice en memoria, un prefijo de username se traduce en una lista
+    # corta de ids y la base solo comprueba el resto de filtros por PK
+    if SEARCH_PREFIX_INDEX and username and indice_usernames.cargado:
+        indice_usernames.sincronizar(db)
+        ids = indice_usernames.candidatos(username, SEARCH_PREFIX_MAX_CANDIDATOS)
+        if ids is not None:
+            filtros = filtros_busqueda(None, nombre, mail, edad_min, edad_max, es_admin)
+            filtros.append(Usuario.id.in_([i for i in ids if i > ultimo_id]))
+
+    filas = db.execute(
+        select(*COLUMNAS_PUBLICAS)
+        .where(Usuario.id > ultimo_id, *filtros)
+        .order_by(Usuario.id)
+        .limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        next_cursor = codificar_cursor(filas[-1].id)
+
+    pagina = UsuarioPagina.model_validate(
+        {"items": filas, "next_cursor": next_cursor},
+        from_attributes=True
+    )
+    return respuesta_modelo(pagina)
+
+class CambioOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    seq: int
+    tipo: str
+    usuario_id: int
+    usuario: Optional[UsuarioOut] = None
+
+class CambiosPagina(BaseModel):
+    cambios: list[CambioOut]
+    cursor: str
+    hay_mas: bool
+
+@router.get("/usuarios/changes", response_model=CambiosPagina)
+def cambios_usuarios(
+    request: Request,
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=CAMBIOS_PAGE_MAX),
+    sse: bool = False,
+    db: Session = Depends(get_db),
+    admin: Claims = Depends(requiere_admin)
+):
+    # since=head devuelve solo el cursor actual: útil tras una copia inicial con GET /usuarios
+    if since == "head":
+        desde = ultimo_seq(db)
+    else:
+        desde = decodificar_cursor(since or request.headers.get("last-event-id"))
+
+    if sse or "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            eventos_sse(request, db, desde, limit, COLUMNAS_PUBLICAS, usuario_a_dict, codificar_cursor),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    cambios, cursor, hay_mas = leer_cambios(db, desde, limit, COLUMNAS_PUBLICAS)
+    pagina = CambiosPagina.model_validate(
+        {"cambios": cambios, "cursor": codificar_cursor(cursor), "hay_mas": hay_mas},
+        from_attributes=True
+    )
+    return respuesta_modelo(pagina)
 
 class UsuarioUpdate(BaseModel):
     nombre: str
     edad: int
     es_admin: bool
 
-@router.get("/usuarios/me")
-def leer_mi_usuario(current_user: Usuario = Depends(get_current_user)):
-    return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "mail": current_user.mail,
-        "nombre": current_user.nombre,
-        "edad": current_user.edad,
-        "es_admin": current_user.es_admin
-    }
+@router.get("/usuarios/me", response_model=UsuarioOut)
+def leer_mi_usuario(
+    request: Request,
+    response: Response,
+    campos: Optional[tuple] = Depends(campos_proyeccion),
+    current_user: Usuario = Depends(get_current_user)
+):
+    # El usuario ya viene de la caché del principal: aquí solo se recorta la respuesta
+    etag = etag_usuario(current_user.id, current_user.version, campos)
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return no_modificado(etag)
+    if campos is not None:
+        return respuesta_usuario(current_user, etag, campos)
+    poner_etag(response, etag)
+    return UsuarioOut.model_validate(current_user)
 
 @router.delete("/usuarios/me")
 def eliminar_cuenta(
     db: Session = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):    
+    # Sin PRAGMA foreign_keys (bases ya creadas, otros drivers) el CASCADE no
+    # se aplica: los refresh tokens se borran a mano, como en masivo
+    db.execute(delete(RefreshToken).where(RefreshToken.usuario_id == current_user.id))
     db.delete(current_user)
+    registrar_cambio(db, current_user.id, ELIMINAR)
     db.commit()
+    invalidar_principal(current_user)
+    indice_usernames.quitar(current_user.username, current_user.id)
     return {"mensaje": "Ha eliminado su cuenta"}
 
-@router.put("/usuarios/{usuario_id}")
+@router.put("/usuarios/{usuario_id:int}", response_model=UsuarioOut)
 def actualizar_usuario(
     usuario_id: int,
     datos: UsuarioUpdate,
     db: Session = Depends(get_db),
-    admin: Usuario = Depends(requiere_admin)
+    admin: Claims = Depends(requiere_admin)
 ):
     usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
 
     if not usuario:
         raise HTTPException(status_code=404, detail= "Usuario no encontrado")
     
+    # Un cambio de rol invalida los tokens ya emitidos para ese usuario
+    if bool(usuario.es_admin) != datos.es_admin:
+        usuario.token_version = (usuario.token_version or 0) + 1
+
     usuario.nombre = datos.nombre
     usuario.edad = datos.edad
     usuario.es_admin = datos.es_admin
+    usuario.version = (usuario.version or 0) + 1
+    registrar_cambio(db, usuario.id, ACTUALIZAR)
 
     db.commit()
+    invalidar_principal(usuario)
     db.refresh(usuario)
     return usuario
 
-@router.delete("/usuarios/{usuario_id}")
+@router.delete("/usuarios/{usuario_id:int}")
 def eliminar_usuario(
     usuario_id : int,
     db: Session = Depends(get_db),
-    admin: Usuario = Depends(requiere_admin)
+    admin: Claims = Depends(requiere_admin)
 ):
     usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
 
     if not usuario: 
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
 
+    # Igual que en eliminar_cuenta: los refresh tokens no dependen del CASCADE
+    db.execute(delete(RefreshToken).where(RefreshToken.usuario_id == usuario.id))
     db.delete(usuario)
+    registrar_cambio(db, usuario.id, ELIMINAR)
     db.commit()
+    invalidar_principal(usuario)
+    indice_usernames.quitar(usuario.username, usuario.id)
     return {"mensaje": "Usuario eliminado"}
 
 
+class FiltroUsuarios(BaseModel):
+    # Mismos criterios que GET /usuarios/search
+    username: Optional[str] = Field(None, min_length=1)
+    nombre: Optional[str] = Field(None, min_length=1)
+    mail: Optional[str] = Field(None, min_length=1)
+    edad_min: Optional[int] = Field(None, ge=0)
+    edad_max: Optional[int] = Field(None, ge=0)
+    es_admin: Optional[bool] = None
+
+class SeleccionUsuarios(BaseModel):
+    ids: Optional[list[int]] = Field(None, min_length=1, max_length=BULK_MAX_FILAS)
+    filtro: Optional[FiltroUsuarios] = None
+
+    @model_validator(mode="after")
+    def validar_seleccion(self):
+        if (self.ids is None) == (self.filtro is None):
+            raise ValueError("Indica ids o filtro, no ambos")
+        # Un filtro vacío seleccionaría la tabla entera
+        if self.filtro is not None and not self.filtro.model_dump(exclude_none=True):
+            raise ValueError("El filtro no puede estar vacío")
+        return self
 
-@router.get("/usuarios/{usuario_id}", response_model=UsuarioOut)
-def buscar_usuario(
+    def filtros(self) -> list:
+        if self.filtro is None:
+            return []
+        return filtros_busqueda(**self.filtro.model_dump())
+
+class CambiosUsuario(BaseModel):
+    nombre: Optional[str] = None
+    edad: Optional[int] = Field(None, ge=0)
+    es_admin: Optional[bool] = None
+
+class ActualizacionMasiva(SeleccionUsuarios):
+    cambios: CambiosUsuario
+
+    @field_validator("cambios")
+    def validar_cambios(cls, value):
+        if not value.model_dump(exclude_none=True):
+            raise ValueError("No hay nada que cambiar")
+        return value
+
+def _invalidar_afectados(filas):
+    for fila in filas:
+        invalidar_principal(fila)
+
+@router.patch("/usuarios")
+def actualizar_usuarios(
+    datos: ActualizacionMasiva,
+    db: Session = Depends(get_db),
+    admin: Claims = Depends(requiere_admin)
+):
+    # Un UPDATE por bloque en vez de una petición y una transacción por usuario
+    filas = actualizar_en_bloque(
+        db, datos.ids, datos.filtros(), datos.cambios.model_dump(exclude_none=True)
+    )
+    _invalidar_afectados(filas)
+    return {"afectados": len(filas)}
+
+@router.delete("/usuarios")
+def eliminar_usuarios(
+    datos: SeleccionUsuarios,
+    db: Session = Depends(get_db),
+    admin: Claims = Depends(requiere_admin)
+):
+    filas = eliminar_en_bloque(db, datos.ids, datos.filtros())
+    _invalidar_afectados(filas)
+    for fila in filas:
+        indice_usernames.quitar(fila.username, fila.id)
+    return {"afectados": len(filas)}
+
+
+
+def usuarios_por_id(db: Session, ids: list[int]) -> dict:
+    # Un solo WHERE id IN (...) por lote; las filas son inmutables y se pueden
+    # repartir entre peticiones
+    filas = db.execute(
+        select(*COLUMNAS_PUBLICAS, Usuario.version).where(Usuario.id.in_(ids))
+    ).all()
+    return {fila.id: fila for fila in filas}
+
+def usuario_proyectado(db: Session, usuario_id: int, campos: tuple):
+    return db.execute(
+        select(*columnas_de(campos), Usuario.version).where(Usuario.id == usuario_id)
+    ).first()
+
+def _usuarios_por_id_en(bind, ids: list[int]) -> dict:
+    # Sesión propia del lote: vive lo que dura la consulta
+    with Session(bind=bind) as db:
+        return usuarios_por_id(db, ids)
+
+async def _cargar_usuarios(bind, ids: list[int]) -> dict:
+    return await run_in_threadpool(_usuarios_por_id_en, bind, ids)
+
+cargador_usuarios = CargadorLotes(
+    _cargar_usuarios,
+    ventana=USUARIOS_COALESCE_MS / 1000,
+    maximo=USUARIOS_COALESCE_MAX,
+)
+
+
+class BatchGetRequest(BaseModel):
+    ids: list[int]
+
+    @field_validator("ids")
+    @classmethod
+    def limitar_ids(cls, ids):
+        if not ids:
+            raise ValueError("La lista de ids está vacía")
+        if len(ids) > BATCH_GET_MAX:
+            raise ValueError(f"Como máximo {BATCH_GET_MAX} ids por petición")
+        return ids
+
+class BatchGetRespuesta(BaseModel):
+    items: list[UsuarioOut]
+    missing: list[int]
+
+@router.post("/usuarios/batch-get", response_model=BatchGetRespuesta)
+def batch_get_usuarios(datos: BatchGetRequest, db: Session = Depends(get_read_db)):
+    ids = list(dict.fromkeys(datos.ids))
+    encontrados = usuarios_por_id(db, ids)
+    respuesta = BatchGetRespuesta.model_validate(
+        {
+            "items": [encontrados[i] for i in ids if i in encontrados],
+            "missing": [i for i in ids if i not in encontrados],
+        },
+        from_attributes=True
+    )
+    return respuesta_modelo(respuesta)
+
+@router.get("/usuarios/{usuario_id:int}", response_model=UsuarioOut)
+async def buscar_usuario(
     usuario_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    campos: Optional[tuple] = Depends(campos_proyeccion),
+    db: Session = Depends(get_read_db)
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    # Las lecturas concurrentes por id se agrupan en un IN; la fila trae la
+    # versión, así que el 304 sale de la misma consulta. Una proyección pide
+    # sus propias columnas y no pasa por el lote
+    if campos is None:
+        usuario = await cargador_usuarios.cargar(db.get_bind(), usuario_id)
+    else:
+        usuario = await run_in_threadpool(usuario_proyectado, db, usuario_id, campos)
 
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    etag = etag_usuario(usuario.id, usuario.version, campos)
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return no_modificado(etag)
+    if campos is not None:
+        return respuesta_usuario(usuario, etag, campos)
+    poner_etag(response, etag)
     return usuario
 
@@ -0,0 +1,302 @@
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+import orjson
+
+from app.auth import (
+    oauth2_scheme,
+    principal_cache,
+    credential_exception,
+    decodificar_token,
+    snapshot_principal,
+    principal_desde_snapshot,
+    crear_token_usuario,
+    nuevo_hash,
+    guardar_rehash,
+)
+from app.admision import comprobar_login, ip_cliente
+from app.database_async import get_async_db
+from app.disponibilidad import disponibilidad, campo_de_error, campo_ocupado
+from app.lotes import CargadorLotes, EscritorLotes
+from app.cambios import CREAR, registrar_cambio
+from app.models import Usuario
+from app.refresh_tokens import emitir_refresh_token
+from app.security import hash_password_async, necesita_rehash, verify_password_async
+from app.usuarios import (
+    COLUMNAS_PUBLICAS,
+    UsuarioCreate,
+    conflicto,
+    UsuarioOut,
+    UsuarioPagina,
+    respuesta_pagina,
+    respuesta_usuario,
+    campos_proyeccion,
+    columnas_de,
+    proyectar,
+    etag_usuario,
+    etag_coincide,
+    no_modificado,
+    poner_etag,
+    usuario_a_dict,
+    codificar_cursor,
+    decodificar_cursor,
+    UsuarioDuplicado,
+    guardar_lote,
+)
+from app.core.config import (
+    USUARIOS_PAGE_MAX,
+    USUARIOS_STREAM_CHUNK,
+    USUARIOS_COALESCE_MS,
+    USUARIOS_COALESCE_MAX,
+    SIGNUP_GROUP_COMMIT,
+    SIGNUP_GROUP_COMMIT_MS,
+    SIGNUP_GROUP_COMMIT_MAX,
+)
+
+# Versiones async def de las rutas más calientes. Con DB_ASYNC=1 este router
+# se registra antes que los síncronos y los sustituye; el resto de rutas
+# sigue usando get_db.
+router = APIRouter()
+
+
+async def cargar_principal_async(db: AsyncSession, username: str) -> Optional[Usuario]:
+    datos = principal_cache.get(username) if principal_cache.activa else None
+    if datos is None:
+        result = await db.execute(select(Usuario).where(Usuario.username == username))
+        user = result.scalars().first()
+        if user is not None:
+            principal_cache.set(username, snapshot_principal(user))
+        return user
+
+    user = principal_desde_snapshot(datos)
+    db.add(user)
+    return user
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    payload = decodificar_token(token)
+
+    user = await cargar_principal_async(db, payload["sub"])
+    if user is None:
+        raise credential_exception()
+    if "ver" in payload and payload["ver"] != (user.token_version or 0):
+        raise credential_exception()
+    return user
+
+
+async def rehash_password_async(engine, usuario_id: int, username: str, password: str, hash_anterior: str):
+    hash_nuevo = await nuevo_hash(password)
+    if hash_nuevo is None:
+        return
+    async with AsyncSession(engine) as db:
+        actualizado = await db.run_sync(guardar_rehash, usuario_id, hash_anterior, hash_nuevo)
+    if actualizado:
+        principal_cache.invalidate(username)
+
+
+@router.post("/login")
+async def login_async(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+):
+    comprobar_login(ip_cliente(request), form_data.username)
+
+    result = await db.execute(
+        select(Usuario).where(
+            or_(
+                Usuario.username == form_data.username,
+                Usuario.mail == form_data.username
+            )
+        )
+    )
+    user = result.scalars().first()
+
+    if not user or not await verify_password_async(form_data.password, user.password):
+        raise HTTPException(status_code=401, detail="Usuario o contraseña incorrecto")
+
+    if necesita_rehash(user.password):
+        background_tasks.add_task(
+            rehash_password_async, db.bind, user.id, user.username, form_data.password, user.password
+        )
+
+    access_token = crear_token_usuario(user)
+    refresh_token = await db.run_sync(emitir_refresh_token, user.id, user.username)
+    await db.commit()
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer"
+    }
+
+
+async def _escribir_usuarios_async(bind, nuevos: list[Usuario]) -> list:
+    # El mismo lote que la versión síncrona (una transacción, un SAVEPOINT por
+    # fila) en una sesión propia sobre el engine async
+    async with AsyncSession(bind) as db:
+        return await db.run_sync(guardar_lote, nuevos)
+
+
+escritor_altas_async = EscritorLotes(
+    _escribir_usuarios_async,
+    ventana=SIGNUP_GROUP_COMMIT_MS / 1000,
+    maximo=SIGNUP_GROUP_COMMIT_MAX,
+)
+
+
+@router.post("/usuarios", response_model=UsuarioOut)
+async def crear_usuario_async(usuario: UsuarioCreate, db: AsyncSession = Depends(get_async_db)):
+    if usuario.edad < 0:
+        raise HTTPException(status_code=400, detail="No se puede tener edad negativa")
+
+    if disponibilidad.cargado and (
+        disponibilidad.puede_estar_ocupado("username", usuario.username)
+        or disponibilidad.puede_estar_ocupado("mail", usuario.mail)
+    ):
+        campo = await db.run_sync(campo_ocupado, usuario.username, usuario.mail)
+        if campo is not None:
+            raise conflicto(campo)
+
+    nuevo = Usuario(
+        username=usuario.username,
+        mail=usuario.mail,
+        nombre=usuario.nombre,
+        edad=usuario.edad,
+        password=await hash_password_async(usuario.password),
+        es_admin=usuario.es_admin
+    )
+    if SIGNUP_GROUP_COMMIT:
+        try:
+            creado = await escritor_altas_async.escribir(db.bind, nuevo)
+        except UsuarioDuplicado as exc:
+            raise conflicto(exc.campo)
+    else:
+        try:
+            db.add(nuevo)
+            await db.flush()
+            await db.run_sync(registrar_cambio, nuevo.id, CREAR)
+            await db.commit()
+        except IntegrityError as exc:
+            await db.rollback()
+            campo = await db.run_sync(campo_ocupado, usuario.username, usuario.mail) or campo_de_error(exc)
+            raise conflicto(campo)
+        await db.refresh(nuevo)
+        creado = usuario_a_dict(nuevo)
+
+    disponibilidad.agregar(usuario.username, usuario.mail)
+    return creado
+
+
+async def _stream_usuarios_async(db: AsyncSession, after: int, campos: Optional[tuple] = None):
+    try:
+        stmt = (
+            select(*columnas_de(campos))
+            .where(Usuario.id > after)
+            .order_by(Usuario.id)
+            .execution_options(yield_per=USUARIOS_STREAM_CHUNK)
+        )
+        result = await db.stream(stmt)
+        async for bloque in result.partitions():
+            yield b"".join(orjson.dumps(proyectar(fila, campos)) + b"\n" for fila in bloque)
+    finally:
+        await db.close()
+
+@router.get("/usuarios", response_model=UsuarioPagina)
+async def listar_usuarios_async(
+    limit: int = Query(100, ge=1, le=USUARIOS_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    campos: Optional[tuple] = Depends(campos_proyeccion),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Usuario = Depends(get_current_user_async)
+):
+    if not current_user.es_admin:
+        raise HTTPException(status_code=403, detail="No tienes permisos de admin")
+
+    ultimo_id = decodificar_cursor(after)
+
+    if stream:
+        return StreamingResponse(
+            _stream_usuarios_async(db, ultimo_id, campos),
+            media_type="application/x-ndjson"
+        )
+
+    result = await db.execute(
+        select(*columnas_de(campos))
+        .where(Usuario.id > ultimo_id)
+        .order_by(Usuario.id)
+        .limit(limit + 1)
+    )
+    filas = result.all()
+
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        next_cursor = codificar_cursor(filas[-1].id)
+
+    return respuesta_pagina(filas, next_cursor, campos)
+
+
+@router.get("/usuarios/me", response_model=UsuarioOut)
+async def leer_mi_usuario_async(
+    request: Request,
+    response: Response,
+    campos: Optional[tuple] = Depends(campos_proyeccion),
+    current_user: Usuario = Depends(get_current_user_async)
+):
+    etag = etag_usuario(current_user.id, current_user.version, campos)
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return no_modificado(etag)
+    if campos is not None:
+        return respuesta_usuario(current_user, etag, campos)
+    poner_etag(response, etag)
+    return UsuarioOut.model_validate(current_user)
+
+
+async def _cargar_usuarios_async(bind, ids: list[int]) -> dict:
+    # Sesión propia del lote, no la de la petición que lo abrió
+    async with AsyncSession(bind) as db:
+        result = await db.execute(
+            select(*COLUMNAS_PUBLICAS, Usuario.version).where(Usuario.id.in_(ids))
+        )
+        return {fila.id: fila for fila in result.all()}
+
+cargador_usuarios_async = CargadorLotes(
+    _cargar_usuarios_async,
+    ventana=USUARIOS_COALESCE_MS / 1000,
+    maximo=USUARIOS_COALESCE_MAX,
+)
+
+@router.get("/usuarios/{usuario_id:int}", response_model=UsuarioOut)
+async def buscar_usuario_async(
+    usuario_id: int,
+    request: Request,
+    response: Response,
+    campos: Optional[tuple] = Depends(campos_proyeccion),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if campos is None:
+        usuario = await cargador_usuarios_async.cargar(db.bind, usuario_id)
+    else:
+        result = await db.execute(
+            select(*columnas_de(campos), Usuario.version).where(Usuario.id == usuario_id)
+        )
+        usuario = result.first()
+
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    etag = etag_usuario(usuario.id, usuario.version, campos)
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return no_modificado(etag)
+    if campos is not None:
+        return respuesta_usuario(usuario, etag, campos)
+    poner_etag(response, etag)
+    return usuario
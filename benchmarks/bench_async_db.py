@@ -0,0 +1,164 @@
+"""Compara la ruta síncrona (get_db + threadpool) con la async (AsyncSession).
+
+Lanza peticiones concurrentes contra GET /usuarios/{id} en proceso con
+httpx.ASGITransport sobre un mismo fichero SQLite. --latencia-ms simula el
+tiempo de red de una base remota: la ruta síncrona queda limitada por el
+threadpool de AnyIO (40 hilos) y la async solo por el pool de conexiones.
+
+    SECRET_KEY=x python -m benchmarks.bench_async_db --concurrencia 200 --latencia-ms 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from fastapi import FastAPI
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
+
+from app.database import Base, get_db
+from app.database_async import get_async_db
+from app.models import Usuario
+from app.security import hash_password
+from app.usuarios import router as usuarios_router
+from app.usuarios_async import router as usuarios_async_router
+
+
+def simular_latencia(engine, segundos: float, asincrono: bool = False):
+    if segundos <= 0:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _dormir(conn, cursor, statement, parameters, context, executemany):
+        if asincrono:
+            # Con AsyncEngine el evento corre en el event loop (dentro de un greenlet):
+            # hay que esperar sin bloquearlo, igual que haría el driver con la red
+            await_only(asyncio.sleep(segundos))
+        else:
+            time.sleep(segundos)
+
+
+def crear_datos(path: str, filas: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    hashed = hash_password("benchmark")
+    with engine.begin() as conn:
+        conn.execute(insert(Usuario), [
+            {
+                "nombre": f"Usuario {i}",
+                "username": f"user{i}",
+                "mail": f"user{i}@bench.com",
+                "password": hashed,
+                "edad": 18 + i % 60,
+                "es_admin": False,
+            }
+            for i in range(filas)
+        ])
+    engine.dispose()
+
+
+def app_sync(path: str, pool: int, latencia: float) -> tuple[FastAPI, object]:
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        pool_size=pool,
+        max_overflow=0,
+    )
+    simular_latencia(engine, latencia)
+    SessionBench = sessionmaker(bind=engine, autoflush=False)
+
+    def override_get_db():
+        db = SessionBench()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(usuarios_router)
+    app.dependency_overrides[get_db] = override_get_db
+    return app, engine
+
+
+def app_async(path: str, pool: int, latencia: float) -> tuple[FastAPI, object]:
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool,
+        max_overflow=0,
+    )
+    simular_latencia(engine.sync_engine, latencia, asincrono=True)
+    SessionBench = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with SessionBench() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(usuarios_async_router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    return app, engine
+
+
+async def medir(app: FastAPI, peticiones: int, concurrencia: int, filas: int) -> dict:
+    latencias = []
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        async def una(i: int):
+            async with semaforo:
+                inicio = time.perf_counter()
+                response = await client.get(f"/usuarios/{i % filas + 1}")
+                latencias.append(time.perf_counter() - inicio)
+                assert response.status_code == 200, response.text
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(peticiones)))
+        total = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "rps": peticiones / total,
+        "p50_ms": statistics.median(latencias) * 1000,
+        "p99_ms": latencias[int(len(latencias) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=2000)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--filas", type=int, default=1000)
+    parser.add_argument("--pool", type=int, default=200, help="conexiones por engine")
+    parser.add_argument("--latencia-ms", type=float, default=100.0, help="latencia simulada por consulta")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        crear_datos(path, args.filas)
+        latencia = args.latencia_ms / 1000
+
+        for nombre, fabrica in (("sync", app_sync), ("async", app_async)):
+            app, engine = fabrica(path, args.pool, latencia)
+            # Calentamiento: abre las conexiones del pool antes de medir
+            await medir(app, args.concurrencia, args.concurrencia, args.filas)
+            r = await medir(app, args.peticiones, args.concurrencia, args.filas)
+            print(f"{nombre:>5}: {r['rps']:8.0f} req/s  p50 {r['p50_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms")
+            if nombre == "async":
+                await engine.dispose()
+            else:
+                engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""Latencia de /usuarios/search sobre una tabla grande, con y sin índices.
+
+like:    username LIKE 'prefijo%' a secas; en SQLite el LIKE no distingue
+         mayúsculas y no puede usar el índice, así que recorre la tabla
+rango:   filtros_busqueda (rango >= / < sobre el índice + LIKE de confirmación)
+indice:  IndicePrefijos en memoria -> ids -> consulta por PK
+edad:    rango de edad sobre el índice de edad, primera página
+
+    SECRET_KEY=x python -m benchmarks.bench_busqueda --filas 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app.busqueda import IndicePrefijos, filtros_busqueda
+from app.database import Base
+from app.models import Usuario
+from app.usuarios import COLUMNAS_PUBLICAS
+
+
+def medir(nombre: str, funcion, repeticiones: int):
+    funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        filas = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    p50 = tiempos[len(tiempos) // 2]
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    print(f"{nombre:>7}: p50 {p50:8.2f} ms  p95 {p95:8.2f} ms  ({len(filas)} filas)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1000000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    ruta = os.path.join(tempfile.mkdtemp(), "busqueda.db")
+    engine = create_engine(f"sqlite:///{ruta}")
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(42)
+    lote = 50000
+    inicio = time.perf_counter()
+    with engine.begin() as conn:
+        for base in range(0, args.filas, lote):
+            conn.execute(insert(Usuario), [
+                {
+                    "nombre": f"Nombre{rnd.randrange(100000):05d}",
+                    "username": f"user{i:07d}",
+                    "mail": f"user{i:07d}@bench.com",
+                    "password": "$2b$12$" + "x" * 53,
+                    "edad": 18 + rnd.randrange(60),
+                    "es_admin": i % 50 == 0,
+                }
+                for i in range(base, min(base + lote, args.filas))
+            ])
+    print(f"{args.filas} filas en {time.perf_counter() - inicio:.1f} s ({ruta})")
+
+    prefijo = f"user{args.filas // 2:07d}"[:-2]
+    indice = IndicePrefijos()
+
+    with Session(engine) as db:
+        inicio = time.perf_counter()
+        indice.cargar(db)
+        print(f"índice en memoria: {len(indice)} entradas en {time.perf_counter() - inicio:.1f} s")
+
+        def consulta(*filtros):
+            return db.execute(
+                select(*COLUMNAS_PUBLICAS).where(*filtros).order_by(Usuario.id).limit(args.limit + 1)
+            ).all()
+
+        def con_indice():
+            ids = indice.candidatos(prefijo, 1000)
+            return consulta(Usuario.id.in_(ids))
+
+        medir("like", lambda: consulta(Usuario.username.like(prefijo + "%")), args.repeticiones)
+        medir("rango", lambda: consulta(*filtros_busqueda(username=prefijo)), args.repeticiones)
+        medir("indice", con_indice, args.repeticiones)
+        medir("edad", lambda: consulta(*filtros_busqueda(edad_min=30, edad_max=31)), args.repeticiones)
+
+    engine.dispose()
+    os.remove(ruta)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Prueba de carga de la API con percentiles y comparación con una baseline.
+
+Siembra una base SQLite con app.seed y lanza peticiones en bucle cerrado
+(--concurrencia clientes, cada uno manda la siguiente al recibir la
+respuesta) contra cada endpoint por separado, durante --duracion segundos:
+
+login:  POST /login con usuarios sembrados (bcrypt incluido)
+me:     GET /usuarios/me con tokens ya emitidos
+buscar: GET /usuarios/{id} con ids al azar
+
+asgi:     en el mismo proceso con httpx.ASGITransport, como tests/conftest.py
+          (sin red: mide la app y su event loop)
+uvicorn:  contra un servidor uvicorn de verdad en 127.0.0.1
+
+Escribe throughput y p50/p95/p99 por endpoint en --resultados (JSON). Con
+--baseline compara con una ejecución guardada y sale con código 1 si algún
+endpoint empeora más de --umbral; --guardar-baseline la crea o la reemplaza.
+
+    SECRET_KEY=x python -m benchmarks.bench_carga --modo asgi --usuarios 100000
+    SECRET_KEY=x python -m benchmarks.bench_carga --modo uvicorn --workers 2 \\
+        --db /tmp/carga.db --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import httpx
+
+ENDPOINTS = ("login", "me", "buscar")
+# Mismas contraseñas que reparte app.seed: el usuario i tiene "seed<i % hashes>"
+HASHES_SEMILLA = 8
+
+
+def percentil(ordenados: list, q: float) -> float:
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * q))]
+
+
+def resumir(latencias: list, errores: int, segundos: float) -> dict:
+    latencias = sorted(latencias)
+    if not latencias:
+        return {"peticiones": 0, "errores": errores, "rps": 0.0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "rps": round(len(latencias) / segundos, 1),
+        "p50_ms": round(percentil(latencias, 0.50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 0.95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 2),
+    }
+
+
+def comparar(actual: dict, baseline: dict, umbral: float) -> list[str]:
+    # Devuelve las regresiones: menos throughput, más latencia en la cola
+    # o errores donde antes no los había
+    regresiones = []
+    for nombre, medida in actual["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(nombre)
+        if not base or not base["peticiones"]:
+            continue
+        if medida["rps"] < base["rps"] * (1 - umbral):
+            regresiones.append(f"{nombre}: rps {base['rps']} -> {medida['rps']}")
+        for clave in ("p95_ms", "p99_ms"):
+            if medida[clave] is not None and medida[clave] > base[clave] * (1 + umbral):
+                regresiones.append(f"{nombre}: {clave} {base[clave]} -> {medida[clave]}")
+        if medida["errores"] and not base["errores"]:
+            regresiones.append(f"{nombre}: {medida['errores']} errores (baseline sin errores)")
+    return regresiones
+
+
+def preparar_entorno(args, ruta_db: str):
+    # app.core.config lee el entorno al importarse: todo esto va antes de
+    # importar nada de app (y lo hereda el servidor uvicorn)
+    os.environ["DATABASE_URL"] = f"sqlite:///{ruta_db}"
+    # Coste fijo: con la calibración cada máquina elegiría el suyo y las
+    # cifras de /login no serían comparables con la baseline
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    if not args.con_limites:
+        # Todos los logins salen de la misma IP y repiten usuario
+        os.environ["LOGIN_IP_POR_SEGUNDO"] = "0"
+        os.environ["LOGIN_USUARIO_POR_SEGUNDO"] = "0"
+
+
+def sembrar_si_hace_falta(ruta_db: str, usuarios: int):
+    from sqlalchemy import create_engine, func, inspect, select
+    from app.models import Usuario
+    from app.seed import sembrar
+
+    engine = create_engine(f"sqlite:///{ruta_db}")
+    existentes = 0
+    if inspect(engine).has_table(Usuario.__tablename__):
+        with engine.connect() as conn:
+            existentes = conn.execute(select(func.count()).select_from(Usuario)).scalar()
+    engine.dispose()
+    if existentes == usuarios:
+        print(f"reutilizando {ruta_db} ({existentes} usuarios)")
+        return
+    segundos = sembrar(f"sqlite:///{ruta_db}", usuarios, 42, 50000, HASHES_SEMILLA, 0.001, limpiar=True)
+    print(f"{usuarios} usuarios sembrados en {segundos:.1f} s ({ruta_db})")
+
+
+def usernames_de_muestra(ruta_db: str, cantidad: int) -> list[tuple[int, str]]:
+    from sqlalchemy import create_engine, select
+    from app.models import Usuario
+
+    engine = create_engine(f"sqlite:///{ruta_db}")
+    with engine.connect() as conn:
+        filas = conn.execute(
+            select(Usuario.id, Usuario.username).order_by(Usuario.id).limit(cantidad)
+        ).all()
+    engine.dispose()
+    return [(id_, username) for id_, username in filas]
+
+
+async def martillear(cliente: httpx.AsyncClient, peticion, concurrencia: int, duracion: float,
+                     calentamiento: float) -> dict:
+    latencias = []
+    errores = 0
+    inicio = time.perf_counter()
+    inicio_medida = inicio + calentamiento
+    fin = inicio_medida + duracion
+
+    async def trabajador(n: int):
+        nonlocal errores
+        rnd = random.Random(n)
+        while True:
+            t0 = time.perf_counter()
+            if t0 >= fin:
+                return
+            try:
+                response = await peticion(cliente, rnd)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            t1 = time.perf_counter()
+            # Lo del calentamiento no cuenta
+            if t0 < inicio_medida:
+                continue
+            if ok:
+                latencias.append(t1 - t0)
+            else:
+                errores += 1
+
+    await asyncio.gather(*[trabajador(n) for n in range(concurrencia)])
+    return resumir(latencias, errores, time.perf_counter() - inicio_medida)
+
+
+async def ejecutar_endpoints(cliente: httpx.AsyncClient, args, muestra: list) -> dict:
+    async def login(c, rnd):
+        id_, username = rnd.choice(muestra)
+        return await c.post("/login", data={"username": username, "password": f"seed{id_ % HASHES_SEMILLA}"})
+
+    # Tokens para /usuarios/me, emitidos antes de medir
+    tokens = []
+    for id_, username in muestra[:min(len(muestra), max(args.concurrencia, 10))]:
+        response = await cliente.post(
+            "/login", data={"username": username, "password": f"seed{id_ % HASHES_SEMILLA}"}
+        )
+        response.raise_for_status()
+        tokens.append(response.json()["access_token"])
+
+    async def me(c, rnd):
+        return await c.get("/usuarios/me", headers={"Authorization": f"Bearer {rnd.choice(tokens)}"})
+
+    async def buscar(c, rnd):
+        return await c.get(f"/usuarios/{rnd.randint(1, args.usuarios)}")
+
+    peticiones = {"login": login, "me": me, "buscar": buscar}
+    resultados = {}
+    for nombre in args.endpoints:
+        resultados[nombre] = await martillear(
+            cliente, peticiones[nombre], args.concurrencia, args.duracion, args.calentamiento
+        )
+        medida = resultados[nombre]
+        print(f"{nombre:>7}: {medida['rps']:9.1f} req/s  p50 {medida['p50_ms']} ms  "
+              f"p95 {medida['p95_ms']} ms  p99 {medida['p99_ms']} ms  ({medida['errores']} errores)")
+    return resultados
+
+
+async def modo_asgi(args, muestra: list) -> dict:
+    from app.main import app
+
+    # ASGITransport no ejecuta el lifespan: se arranca a mano para medir la
+    # app como en producción (filtro de Bloom cargado, coste de bcrypt, etc.)
+    async with app.router.lifespan_context(app):
+        transporte = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=30) as cliente:
+            return await ejecutar_endpoints(cliente, args, muestra)
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def esperar_servidor(url: str, proceso: subprocess.Popen, timeout: float = 120):
+    limite = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as cliente:
+        while time.monotonic() < limite:
+            if proceso.poll() is not None:
+                raise RuntimeError(f"uvicorn terminó con código {proceso.returncode}")
+            try:
+                if (await cliente.get("/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn no respondió a tiempo")
+
+
+async def modo_uvicorn(args, muestra: list) -> dict:
+    puerto = puerto_libre()
+    url = f"http://127.0.0.1:{puerto}"
+    proceso = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(puerto),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ], cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    try:
+        await esperar_servidor(url, proceso)
+        # Una conexión keep-alive por cliente concurrente
+        limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+        async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as cliente:
+            return await ejecutar_endpoints(cliente, args, muestra)
+    finally:
+        proceso.terminate()
+        try:
+            proceso.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modo", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--usuarios", type=int, default=100000, help="tamaño del dataset sembrado")
+    parser.add_argument("--db", help="fichero SQLite; se reutiliza si ya tiene --usuarios filas")
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--duracion", type=float, default=10, help="segundos medidos por endpoint")
+    parser.add_argument("--calentamiento", type=float, default=2, help="segundos descartados por endpoint")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="lista separada por comas")
+    parser.add_argument("--workers", type=int, default=1, help="procesos de uvicorn (modo uvicorn)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--con-limites", action="store_true", help="mantener los rate limits de /login")
+    parser.add_argument("--resultados", default="resultados_carga.json")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--umbral", type=float, default=0.2, help="empeoramiento tolerado (0.2 = 20%%)")
+    parser.add_argument("--guardar-baseline", action="store_true", help="escribir los resultados en --baseline")
+    args = parser.parse_args()
+    args.endpoints = [nombre.strip() for nombre in args.endpoints.split(",") if nombre.strip()]
+    desconocidos = set(args.endpoints) - set(ENDPOINTS)
+    if desconocidos:
+        parser.error(f"endpoints desconocidos: {', '.join(sorted(desconocidos))}")
+    if args.guardar_baseline and not args.baseline:
+        parser.error("--guardar-baseline necesita --baseline")
+
+    ruta_db = os.path.abspath(args.db or os.path.join(tempfile.mkdtemp(), "carga.db"))
+    preparar_entorno(args, ruta_db)
+    sembrar_si_hace_falta(ruta_db, args.usuarios)
+    muestra = usernames_de_muestra(ruta_db, 1000)
+
+    ejecutar = modo_asgi if args.modo == "asgi" else modo_uvicorn
+    resultados = {
+        "meta": {
+            "modo": args.modo,
+            "usuarios": args.usuarios,
+            "concurrencia": args.concurrencia,
+            "duracion": args.duracion,
+            "workers": args.workers if args.modo == "uvicorn" else 1,
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "endpoints": asyncio.run(ejecutar(args, muestra)),
+    }
+    with open(args.resultados, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2)
+    print(f"resultados en {args.resultados}")
+
+    if not args.baseline:
+        return
+    if args.guardar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+        print(f"baseline guardada en {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no existe {args.baseline}: nada con lo que comparar (usa --guardar-baseline)")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    distinto = [clave for clave in ("modo", "usuarios", "concurrencia", "workers", "bcrypt_rounds")
+                if baseline.get("meta", {}).get(clave) != resultados["meta"][clave]]
+    if distinto:
+        print(f"aviso: la baseline se midió con otros parámetros ({', '.join(distinto)})")
+    regresiones = comparar(resultados, baseline, args.umbral)
+    if regresiones:
+        print(f"REGRESIÓN (umbral {args.umbral:.0%}):")
+        for regresion in regresiones:
+            print(f"  {regresion}")
+        sys.exit(1)
+    print(f"sin regresiones frente a {args.baseline} (umbral {args.umbral:.0%})")
+
+
+if __name__ == "__main__":
+    main()
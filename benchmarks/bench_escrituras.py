@@ -0,0 +1,121 @@
+"""Escritores concurrentes sobre SQLite: engine por defecto frente al perfil afinado.
+
+defecto:  create_engine con check_same_thread=False (journal DELETE,
+          synchronous=FULL, caché de 2 MB), como estaba app/database.py
+afinado:  crear_engine (pool configurable, WAL, synchronous=NORMAL,
+          busy_timeout, cache_size, mmap)
+
+Cada hilo da de alta usuarios de uno en uno, con su cambio en el feed y un
+commit por alta (lo que hace POST /usuarios), mientras otros hilos leen
+páginas de GET /usuarios. Se informa de altas/s, lecturas/s, errores de
+bloqueo y la espera media del pool.
+
+    SECRET_KEY=x python -m benchmarks.bench_escrituras --escritores 8 --altas 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.cambios import CREAR, registrar_cambio
+from app.database import Base, crear_engine
+from app.metrics import registro
+from app.models import Usuario
+from app.usuarios import COLUMNAS_PUBLICAS
+
+
+def ejecutar(engine, escritores: int, lectores: int, altas: int) -> dict:
+    Base.metadata.create_all(bind=engine)
+    errores = [0]
+    lecturas = [0]
+    fin = threading.Event()
+
+    def escritor(n: int):
+        for i in range(altas):
+            with Session(engine) as db:
+                try:
+                    id_ = db.execute(
+                        insert(Usuario).returning(Usuario.id),
+                        {
+                            "nombre": "Bench",
+                            "username": f"w{n}_{i}",
+                            "mail": f"w{n}_{i}@bench.com",
+                            "password": "$2b$12$" + "x" * 53,
+                            "edad": 30,
+                        },
+                    ).scalar_one()
+                    registrar_cambio(db, id_, CREAR)
+                    db.commit()
+                except OperationalError:
+                    db.rollback()
+                    errores[0] += 1
+
+    def lector():
+        while not fin.is_set():
+            with Session(engine) as db:
+                try:
+                    db.execute(select(*COLUMNAS_PUBLICAS).order_by(Usuario.id.desc()).limit(100)).all()
+                    lecturas[0] += 1
+                except OperationalError:
+                    errores[0] += 1
+
+    hilos_lectura = [threading.Thread(target=lector) for _ in range(lectores)]
+    hilos_escritura = [threading.Thread(target=escritor, args=(n,)) for n in range(escritores)]
+    inicio = time.perf_counter()
+    for hilo in hilos_lectura + hilos_escritura:
+        hilo.start()
+    for hilo in hilos_escritura:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    fin.set()
+    for hilo in hilos_lectura:
+        hilo.join()
+    engine.dispose()
+    return {
+        "altas_s": (escritores * altas - errores[0]) / duracion,
+        "lecturas_s": lecturas[0] / duracion,
+        "errores": errores[0],
+        "segundos": duracion,
+    }
+
+
+def espera_media_pool() -> str:
+    serie = registro._valores.get("db_pool_checkout_wait_seconds", {})
+    total = sum(h.suma for h in serie.values())
+    cuenta = sum(h.total for h in serie.values())
+    return f"{total / cuenta * 1000:.2f} ms" if cuenta else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escritores", type=int, default=8)
+    parser.add_argument("--lectores", type=int, default=2)
+    parser.add_argument("--altas", type=int, default=300, help="altas por escritor")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    perfiles = {
+        "defecto": lambda url: create_engine(url, connect_args={"check_same_thread": False}),
+        "afinado": lambda url: crear_engine(url, "bench"),
+    }
+    for nombre, fabrica in perfiles.items():
+        url = f"sqlite:///{os.path.join(directorio, nombre + '.db')}"
+        r = ejecutar(fabrica(url), args.escritores, args.lectores, args.altas)
+        print(
+            f"{nombre:>8}: {r['altas_s']:8.0f} altas/s  {r['lecturas_s']:8.0f} lecturas/s  "
+            f"{r['errores']:4d} errores  ({r['segundos']:.1f} s)"
+        )
+    print(f"espera media del pool (afinado): {espera_media_pool()}")
+
+
+if __name__ == "__main__":
+    main()
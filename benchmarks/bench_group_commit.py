@@ -0,0 +1,89 @@
+"""Altas concurrentes: un commit por alta frente a group commit.
+
+Mide solo la etapa de escritura de POST /usuarios (bcrypt aparte: el hash va
+precalculado). N tareas concurrentes dan de alta usuarios sobre un SQLite en
+fichero, cada una con su propia sesión, como harían N peticiones:
+
+individual:  _guardar_usuario (INSERT + feed + commit) en el threadpool
+agrupado:    escritor_altas (un commit por lote, SAVEPOINT por fila)
+
+    SECRET_KEY=x python -m benchmarks.bench_group_commit --concurrencia 64 --altas 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from app.database import Base, aplicar_pragmas, crear_engine
+from app.lotes import EscritorLotes
+from app.models import Usuario
+from app.usuarios import _escribir_usuarios, _guardar_usuario
+
+HASH = "$2b$12$" + "x" * 53
+
+
+def usuario(prefijo: str, i: int) -> Usuario:
+    return Usuario(
+        nombre="Bench",
+        username=f"{prefijo}{i}",
+        mail=f"{prefijo}{i}@bench.com",
+        password=HASH,
+        edad=30,
+        es_admin=False,
+    )
+
+
+async def ejecutar(Sesion, concurrencia: int, altas: int, escritor=None) -> float:
+    cola = asyncio.Queue()
+    for i in range(altas):
+        cola.put_nowait(i)
+    prefijo = "g" if escritor else "i"
+
+    async def trabajador():
+        while not cola.empty():
+            i = cola.get_nowait()
+            with Sesion() as db:
+                if escritor:
+                    await escritor.escribir(db.get_bind(), usuario(prefijo, i))
+                else:
+                    await run_in_threadpool(_guardar_usuario, db, usuario(prefijo, i))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[trabajador() for _ in range(concurrencia)])
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrencia", type=int, default=64)
+    parser.add_argument("--altas", type=int, default=2000)
+    parser.add_argument("--ventana-ms", type=float, default=5)
+    parser.add_argument("--maximo", type=int, default=100)
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    for synchronous in ("FULL", "NORMAL"):
+        for modo in ("individual", "agrupado"):
+            engine = crear_engine(f"sqlite:///{os.path.join(directorio, f'{modo}_{synchronous}.db')}", "bench")
+            aplicar_pragmas(engine, {"synchronous": synchronous})
+            Base.metadata.create_all(bind=engine)
+            Sesion = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            escritor = None
+            if modo == "agrupado":
+                escritor = EscritorLotes(_escribir_usuarios, args.ventana_ms / 1000, args.maximo)
+            segundos = asyncio.run(ejecutar(Sesion, args.concurrencia, args.altas, escritor))
+            lotes = f"  {escritor.lotes} lotes" if escritor else ""
+            print(f"synchronous={synchronous:<6} {modo:>10}: {args.altas / segundos:8.0f} altas/s{lotes}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
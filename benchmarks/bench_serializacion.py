@@ -0,0 +1,72 @@
+"""Tiempo de serializar una lista de usuarios, antes y después de los modelos de lectura.
+
+antes:  objetos ORM completos -> jsonable_encoder -> json.dumps (lo que hacía
+        FastAPI al devolver db.query(Usuario).all(), con el hash incluido)
+ahora:  filas con las columnas públicas -> UsuarioPagina.model_validate(from_attributes)
+        -> model_dump_json (lo que hace listar_usuarios)
+ndjson: filas -> dict -> orjson, como el modo stream=true
+
+    SECRET_KEY=x python -m benchmarks.bench_serializacion --filas 10000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models import Usuario
+from app.usuarios import COLUMNAS_PUBLICAS, UsuarioPagina, usuario_a_dict
+
+
+def medir(nombre: str, funcion, repeticiones: int):
+    funcion()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        tam = len(funcion())
+    ms = (time.perf_counter() - inicio) / repeticiones * 1000
+    print(f"{nombre:>7}: {ms:8.1f} ms  {tam / 1024:8.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Usuario), [
+            {
+                "nombre": f"Usuario {i}",
+                "username": f"user{i}",
+                "mail": f"user{i}@bench.com",
+                "password": "$2b$12$" + "x" * 53,
+                "edad": 18 + i % 60,
+                "es_admin": i % 50 == 0,
+            }
+            for i in range(args.filas)
+        ])
+
+    with Session(engine) as db:
+        objetos = db.query(Usuario).all()
+        filas = db.execute(select(*COLUMNAS_PUBLICAS)).all()
+
+        medir("antes", lambda: json.dumps(jsonable_encoder(objetos)).encode("utf-8"), args.repeticiones)
+        medir("ahora", lambda: UsuarioPagina.model_validate(
+            {"items": filas, "next_cursor": None}, from_attributes=True
+        ).model_dump_json(), args.repeticiones)
+        medir("ndjson", lambda: b"\n".join(orjson.dumps(usuario_a_dict(f)) for f in filas), args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -362,4 +363,1044 @@ async def test_usuario_existente(client):
     await user_token(client, "Ya existo")
     response = await crear_usuario(client, "Ya existo")
 
-    assert response.status_code == 400, f"Error: {response.text}"
+    assert response.status_code == 409, f"Error: {response.text}"
+    assert response.json()["detail"]["campo"] == "username"
+
+
+#Test 22: Listar usuarios paginado por cursor
+@pytest.mark.asyncio
+async def test_listar_usuarios_paginado(client):
+    token = await admin_token(client, "Paginador")
+    for i in range(3):
+        await crear_usuario(client, f"Paginado{i}")
+
+    ids = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["after"] = cursor
+        response = await client.get("/usuarios", params=params, headers=auth_headers(token))
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["items"]) <= 2
+        assert all("password" not in item for item in data["items"])
+        ids.extend(item["id"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == sorted(ids)
+    assert len(ids) == len(set(ids))
+    assert len(ids) >= 4
+
+    response = await client.get("/usuarios", params={"after": "no-es-un-cursor"}, headers=auth_headers(token))
+    assert response.status_code == 400
+
+#Test 23: Listar usuarios en modo streaming NDJSON
+@pytest.mark.asyncio
+async def test_listar_usuarios_stream(client):
+    token = await admin_token(client, "Streamer")
+
+    pagina = await client.get("/usuarios", params={"limit": 1000}, headers=auth_headers(token))
+    response = await client.get("/usuarios", params={"stream": True}, headers=auth_headers(token))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    filas = [json.loads(linea) for linea in response.text.splitlines() if linea]
+    assert [f["id"] for f in filas] == [u["id"] for u in pagina.json()["items"]]
+    assert all("password" not in f for f in filas)
+
+#Test 24: bcrypt en el pool de procesos
+@pytest.mark.asyncio
+async def test_hash_password_async():
+    from app.security import hash_password_async, verify_password_async
+
+    hashed = await hash_password_async("secreto123")
+    assert hashed != "secreto123"
+    assert await verify_password_async("secreto123", hashed)
+    assert not await verify_password_async("otra_cosa", hashed)
+
+#Test 25: Caché de usuario autenticado e invalidación al eliminar
+@pytest.mark.asyncio
+async def test_cache_principal(client):
+    admin = await admin_token(client, "CacheAdmin")
+    token = await user_token(client, "CacheUser")
+
+    antes = (await client.get("/auth/cache", headers=auth_headers(admin))).json()["principal"]
+    for _ in range(3):
+        response = await client.get("/usuarios/me", headers=auth_headers(token))
+        assert response.status_code == 200
+    despues = (await client.get("/auth/cache", headers=auth_headers(admin))).json()["principal"]
+    assert despues["hits"] >= antes["hits"] + 3
+
+    response = await client.delete("/usuarios/me", headers=auth_headers(token))
+    assert response.status_code == 200
+    response = await client.get("/usuarios/me", headers=auth_headers(token))
+    assert response.status_code == 401
+
+    response = await client.get("/auth/cache", headers=auth_headers(token))
+    assert response.status_code == 401
+
+#Test 26: Tokens con claims embebidos y revocación por versión
+@pytest.mark.asyncio
+async def test_stateless_claims(client, monkeypatch):
+    from jose import jwt
+    import app.auth as auth
+
+    monkeypatch.setattr(auth, "JWT_STATELESS_CLAIMS", True)
+
+    admin = await admin_token(client, "ClaimsAdmin")
+    claims = jwt.get_unverified_claims(admin)
+    assert claims["adm"] is True
+    assert "uid" in claims and "ver" in claims
+
+    token = await admin_token(client, "ClaimsDegradado")
+    response = await client.get("/usuarios", headers=auth_headers(token))
+    assert response.status_code == 200
+
+    user_id = jwt.get_unverified_claims(token)["uid"]
+    response = await client.put(
+        f"/usuarios/{user_id}",
+        headers=auth_headers(admin),
+        json={"nombre": "Degradado", "edad": 30, "es_admin": False}
+    )
+    assert response.status_code == 200
+
+    # El cambio de rol sube la versión: el token anterior deja de valer
+    response = await client.get("/usuarios", headers=auth_headers(token))
+    assert response.status_code == 401
+    response = await client.get("/usuarios/me", headers=auth_headers(token))
+    assert response.status_code == 401
+
+    login = await client.post("/login", data={"username": "ClaimsDegradado", "password": "test123"})
+    nuevo = login.json()["access_token"]
+    assert jwt.get_unverified_claims(nuevo)["adm"] is False
+    response = await client.get("/usuarios", headers=auth_headers(nuevo))
+    assert response.status_code == 403
+
+#Test 27: Refresh token rotativo
+@pytest.mark.asyncio
+async def test_refresh_token(client):
+    await crear_usuario(client, "Refresco")
+    login = await client.post("/login", data={"username": "Refresco", "password": "test123"})
+    assert login.status_code == 200
+    refresh = login.json()["refresh_token"]
+
+    response = await client.post("/token/refresh", json={"refresh_token": refresh})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["refresh_token"] != refresh
+    me = await client.get("/usuarios/me", headers=auth_headers(data["access_token"]))
+    assert me.json()["username"] == "Refresco"
+
+    # Reutilizar el token rotado falla y revoca toda la familia
+    response = await client.post("/token/refresh", json={"refresh_token": refresh})
+    assert response.status_code == 401
+    response = await client.post("/token/refresh", json={"refresh_token": data["refresh_token"]})
+    assert response.status_code == 401
+
+    response = await client.post("/token/refresh", json={"refresh_token": "inventado"})
+    assert response.status_code == 401
+
+#Test 28: Importación masiva de usuarios (JSON, NDJSON y CSV)
+@pytest.mark.asyncio
+async def test_importar_usuarios(client):
+    token = await admin_token(client, "Importador")
+    await crear_usuario(client, "YaImportado")
+
+    def fila(username, **extra):
+        datos = {"username": username, "mail": username + "@bulk.com", "password": "test123", "nombre": "Bulk", "edad": 20}
+        datos.update(extra)
+        return datos
+
+    filas = [
+        fila("Bulk1"),
+        fila("Bulk2", es_admin=True),
+        fila("Bulk1"),
+        fila("YaImportado"),
+        fila("BulkCorta", password="123"),
+        fila("BulkNegativa", edad=-1),
+    ]
+    response = await client.post("/usuarios/bulk", json=filas, headers=auth_headers(token))
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["total"] == 6
+    assert data["creados"] == 2
+    estados = [r["estado"] for r in data["resultados"]]
+    assert estados == ["creado", "creado", "error", "error", "error", "error"]
+    assert [r["fila"] for r in data["resultados"]] == [1, 2, 3, 4, 5, 6]
+
+    login = await client.post("/login", data={"username": "Bulk2", "password": "test123"})
+    assert login.status_code == 200
+
+    ndjson = "\n".join(json.dumps(fila(f"BulkNd{i}")) for i in range(3))
+    response = await client.post(
+        "/usuarios/bulk",
+        content=ndjson,
+        headers={**auth_headers(token), "Content-Type": "application/x-ndjson"}
+    )
+    assert response.json()["creados"] == 3
+
+    csv_data = "username,mail,password,nombre,edad,es_admin\nBulkCsv,bulkcsv@bulk.com,test123,Csv,33,false\n"
+    response = await client.post(
+        "/usuarios/bulk",
+        files={"archivo": ("usuarios.csv", csv_data, "text/csv")},
+        headers=auth_headers(token)
+    )
+    assert response.json()["creados"] == 1
+
+    user = await user_token(client, "BulkNoAdmin")
+    response = await client.post("/usuarios/bulk", json=filas, headers=auth_headers(user))
+    assert response.status_code == 403
+
+#Test 29: Métricas en formato Prometheus
+@pytest.mark.asyncio
+async def test_metrics(client):
+    token = await user_token(client, "Metricas")
+    await client.get("/usuarios/me", headers=auth_headers(token))
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    texto = response.text
+    assert '# TYPE http_request_duration_seconds histogram' in texto
+    assert 'http_requests_total{method="GET",route="/usuarios/me",status="200"}' in texto
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/login",le="+Inf"}' in texto
+    assert 'bcrypt_duration_seconds_count{op="verify"}' in texto
+    assert 'bcrypt_duration_seconds_count{op="hash"}' in texto
+    assert "jwt_decode_duration_seconds_count" in texto
+    assert 'db_queries_per_request_count{route="/login"}' in texto
+    assert 'auth_cache_hits_total{cache="principal"}' in texto
+
+#Test 30: Profiler SQL: cabeceras por petición y detección de N+1
+@pytest.mark.asyncio
+async def test_profiler_sql(caplog):
+    from app.metrics import EstadoPeticion
+    from app.profiler import ProfilerMiddleware, desactivar_profiler, forma_sentencia, revisar_n_mas_1
+
+    transport = ASGITransport(app=ProfilerMiddleware(app))
+    try:
+        async with AsyncClient(transport=transport, base_url="http://test") as profiled:
+            token = await user_token(profiled, "Perfilado")
+            response = await profiled.get("/usuarios/me", headers=auth_headers(token))
+            assert response.status_code == 200
+            assert "X-DB-Queries" in response.headers
+            assert response.headers["Server-Timing"].startswith("db;dur=")
+
+            login = await profiled.post("/login", data={"username": "Perfilado", "password": "test123"})
+            assert int(login.headers["X-DB-Queries"]) >= 1
+    finally:
+        desactivar_profiler()
+
+    assert forma_sentencia("SELECT *\n FROM t WHERE id IN (?, ?, ?)") == forma_sentencia("SELECT * FROM t WHERE id IN (?)")
+
+    estado = EstadoPeticion()
+    estado.sentencias = {"SELECT * FROM usuarios WHERE id = ?": 12, "SELECT 1": 1}
+    with caplog.at_level("WARNING", logger="app.sql"):
+        repetidas = revisar_n_mas_1(estado, umbral=10)
+    assert [forma for forma, _ in repetidas] == ["SELECT * FROM usuarios WHERE id = ?"]
+    assert "N+1" in caplog.text
+
+#Test 31: Ninguna lectura devuelve el hash de la contraseña
+@pytest.mark.asyncio
+async def test_sin_password_en_respuestas(client):
+    token = await admin_token(client, "SinSecretos")
+    me = await client.get("/usuarios/me", headers=auth_headers(token))
+    user_id = me.json()["id"]
+    assert "password" not in me.json()
+
+    response = await client.get(f"/usuarios/{user_id}", headers=auth_headers(token))
+    assert response.status_code == 200
+    assert "password" not in response.json()
+
+    response = await client.put(
+        f"/usuarios/{user_id}",
+        headers=auth_headers(token),
+        json={"nombre": "SinSecretos", "edad": 31, "es_admin": True}
+    )
+    assert response.status_code == 200
+    assert "password" not in response.json()
+    assert "token_version" not in response.json()
+    assert response.json()["edad"] == 31
+
+#Test 32: ETag y GET condicional
+@pytest.mark.asyncio
+async def test_etag_usuario(client):
+    admin = await admin_token(client, "EtagAdmin")
+    token = await user_token(client, "EtagUser")
+
+    me = await client.get("/usuarios/me", headers=auth_headers(token))
+    etag = me.headers["ETag"]
+    user_id = me.json()["id"]
+
+    response = await client.get("/usuarios/me", headers={**auth_headers(token), "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = await client.get(f"/usuarios/{user_id}")
+    assert response.headers["ETag"] == etag
+    response = await client.get(f"/usuarios/{user_id}", headers={"If-None-Match": f'"otro", W/{etag}'})
+    assert response.status_code == 304
+
+    await client.put(
+        f"/usuarios/{user_id}",
+        headers=auth_headers(admin),
+        json={"nombre": "EtagEditado", "edad": 26, "es_admin": False}
+    )
+
+    response = await client.get(f"/usuarios/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["nombre"] == "EtagEditado"
+
+    response = await client.get("/usuarios/me", headers={**auth_headers(token), "If-None-Match": etag})
+    assert response.status_code == 200
+
+#Test 33: Feed de cambios con cursor y tombstones
+@pytest.mark.asyncio
+async def test_feed_cambios(client):
+    admin = await admin_token(client, "FeedAdmin")
+    head = await client.get("/usuarios/changes", params={"since": "head"}, headers=auth_headers(admin))
+    assert head.status_code == 200
+    cursor = head.json()["cursor"]
+
+    token = await user_token(client, "FeedUser")
+    me = (await client.get("/usuarios/me", headers=auth_headers(token))).json()
+    await client.put(
+        f"/usuarios/{me['id']}",
+        headers=auth_headers(admin),
+        json={"nombre": "FeedEditado", "edad": 40, "es_admin": False}
+    )
+
+    response = await client.get("/usuarios/changes", params={"since": cursor}, headers=auth_headers(admin))
+    data = response.json()
+    # Alta + modificación del mismo usuario se compactan en un solo cambio
+    assert [(c["tipo"], c["usuario_id"]) for c in data["cambios"]] == [("actualizar", me["id"])]
+    assert data["cambios"][0]["usuario"]["nombre"] == "FeedEditado"
+    assert "password" not in data["cambios"][0]["usuario"]
+    cursor = data["cursor"]
+
+    await client.delete("/usuarios/me", headers=auth_headers(token))
+    response = await client.get("/usuarios/changes", params={"since": cursor}, headers=auth_headers(admin))
+    data = response.json()
+    assert [(c["tipo"], c["usuario_id"], c["usuario"]) for c in data["cambios"]] == [("eliminar", me["id"], None)]
+
+    response = await client.get("/usuarios/changes", params={"since": data["cursor"]}, headers=auth_headers(admin))
+    assert response.json()["cambios"] == []
+
+    response = await client.get("/usuarios/changes", headers=auth_headers(token))
+    assert response.status_code == 401
+
+#Test 34: Feed de cambios en modo Server-Sent Events
+@pytest.mark.asyncio
+async def test_feed_cambios_sse(client, monkeypatch):
+    import app.cambios as cambios
+
+    monkeypatch.setattr(cambios, "CAMBIOS_SSE_MAX_SECONDS", 0.2)
+    monkeypatch.setattr(cambios, "CAMBIOS_POLL_SECONDS", 0.05)
+
+    admin = await admin_token(client, "SseAdmin")
+    head = (await client.get("/usuarios/changes", params={"since": "head"}, headers=auth_headers(admin))).json()
+    await crear_usuario(client, "SseUser")
+
+    response = await client.get(
+        "/usuarios/changes",
+        headers={**auth_headers(admin), "Accept": "text/event-stream", "Last-Event-ID": head["cursor"]}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    eventos = [bloque for bloque in response.text.split("\n\n") if "event: cambio" in bloque]
+    assert len(eventos) == 1
+    data = json.loads(eventos[0].split("data: ", 1)[1])
+    assert data["tipo"] == "crear"
+    assert data["usuario"]["username"] == "SseUser"
+
+async def crear_usuario_con(client, username: str, nombre: str, edad: int, es_admin: bool = False):
+    return await client.post("/usuarios", json={
+        "nombre": nombre,
+        "username": username,
+        "mail": username.lower() + "@busca.com",
+        "edad": edad,
+        "password": "test123",
+        "es_admin": es_admin
+    })
+
+#Test 35: Búsqueda por prefijos, rangos de edad y rol
+@pytest.mark.asyncio
+async def test_buscar_usuarios(client):
+    admin = await admin_token(client, "BuscaAdmin")
+    await crear_usuario_con(client, "zeta_ana", "Ana Zeta", 20)
+    await crear_usuario_con(client, "zeta_ane", "Ane Zeta", 35)
+    await crear_usuario_con(client, "zeta_bea", "Bea Zeta", 50, es_admin=True)
+    await crear_usuario_con(client, "zeta%raro", "Raro", 20)
+
+    async def buscar(**params):
+        response = await client.get("/usuarios/search", params=params, headers=auth_headers(admin))
+        assert response.status_code == 200, response.text
+        return [u["username"] for u in response.json()["items"]]
+
+    assert await buscar(username="zeta_an") == ["zeta_ana", "zeta_ane"]
+    assert await buscar(username="zeta%") == ["zeta%raro"]
+    assert await buscar(nombre="An", edad_min=30) == ["zeta_ane"]
+    assert await buscar(username="zeta", edad_max=20) == ["zeta_ana", "zeta%raro"]
+    assert await buscar(username="zeta", es_admin=True) == ["zeta_bea"]
+    assert await buscar(mail="zeta_b") == ["zeta_bea"]
+
+    pagina = await client.get("/usuarios/search", params={"username": "zeta", "limit": 2}, headers=auth_headers(admin))
+    cursor = pagina.json()["next_cursor"]
+    resto = await client.get("/usuarios/search", params={"username": "zeta", "after": cursor}, headers=auth_headers(admin))
+    assert [u["username"] for u in pagina.json()["items"] + resto.json()["items"]] == ["zeta_ana", "zeta_ane", "zeta_bea", "zeta%raro"]
+
+    user = await user_token(client, "BuscaNoAdmin")
+    response = await client.get("/usuarios/search", params={"username": "zeta"}, headers=auth_headers(user))
+    assert response.status_code == 403
+
+#Test 36: Búsqueda con el índice de prefijos en memoria
+@pytest.mark.asyncio
+async def test_buscar_con_indice_prefijos(client, monkeypatch):
+    import app.usuarios as usuarios
+    from app.busqueda import IndicePrefijos
+    from tests.conftest import TestingSessionLocal
+
+    indice = IndicePrefijos()
+    monkeypatch.setattr(usuarios, "SEARCH_PREFIX_INDEX", True)
+    monkeypatch.setattr(usuarios, "indice_usernames", indice)
+
+    admin = await admin_token(client, "IndiceAdmin")
+    await crear_usuario_con(client, "ypsilon_1", "Ypsilon", 30)
+    with TestingSessionLocal() as db:
+        indice.cargar(db)
+    assert indice.cargado
+
+    # Alta posterior a la carga: se recoge del feed de cambios
+    await crear_usuario_con(client, "ypsilon_2", "Ypsilon", 40)
+    response = await client.get("/usuarios/search", params={"username": "ypsilon_"}, headers=auth_headers(admin))
+    assert [u["username"] for u in response.json()["items"]] == ["ypsilon_1", "ypsilon_2"]
+
+    response = await client.get("/usuarios/search", params={"username": "ypsilon_", "edad_min": 35}, headers=auth_headers(admin))
+    assert [u["username"] for u in response.json()["items"]] == ["ypsilon_2"]
+
+#Test 37: Lectura por lotes con un solo IN
+@pytest.mark.asyncio
+async def test_batch_get_usuarios(client):
+    ids = []
+    for i in range(3):
+        response = await crear_usuario_con(client, f"lote_{i}", "Lote", 20 + i)
+        ids.append(response.json()["id"])
+
+    response = await client.post("/usuarios/batch-get", json={"ids": [ids[2], ids[0], 999999, ids[2]]})
+    assert response.status_code == 200
+    data = response.json()
+    assert [u["username"] for u in data["items"]] == ["lote_2", "lote_0"]
+    assert data["missing"] == [999999]
+    assert "password" not in data["items"][0]
+
+    response = await client.post("/usuarios/batch-get", json={"ids": []})
+    assert response.status_code == 422
+
+#Test 38: Las lecturas concurrentes por id se agrupan en una consulta
+@pytest.mark.asyncio
+async def test_lecturas_concurrentes_agrupadas(client):
+    import asyncio
+    from app.usuarios import cargador_usuarios
+
+    ids = []
+    for i in range(4):
+        response = await crear_usuario_con(client, f"agrupa_{i}", "Agrupa", 30)
+        ids.append(response.json()["id"])
+
+    lotes_antes = cargador_usuarios.lotes
+    respuestas = await asyncio.gather(
+        *[client.get(f"/usuarios/{i}") for i in ids + [999999]]
+    )
+    assert [r.status_code for r in respuestas] == [200, 200, 200, 200, 404]
+    assert [r.json()["username"] for r in respuestas[:4]] == [f"agrupa_{i}" for i in range(4)]
+    assert cargador_usuarios.lotes - lotes_antes < len(ids) + 1
+
+#Test 39: Proyección de campos con ?fields=
+@pytest.mark.asyncio
+async def test_proyeccion_campos(client):
+    admin = await admin_token(client, "CamposAdmin")
+    response = await crear_usuario_con(client, "campos_1", "Campos", 44)
+    user_id = response.json()["id"]
+
+    response = await client.get("/usuarios", params={"fields": "username", "limit": 1}, headers=auth_headers(admin))
+    assert response.status_code == 200
+    data = response.json()
+    assert all(set(u) == {"id", "username"} for u in data["items"])
+    assert data["next_cursor"] is not None
+
+    response = await client.get("/usuarios", params={"fields": "edad,username", "stream": True}, headers=auth_headers(admin))
+    lineas = [json.loads(linea) for linea in response.text.splitlines()]
+    assert all(list(u) == ["id", "username", "edad"] for u in lineas)
+
+    response = await client.get(f"/usuarios/{user_id}", params={"fields": "username,edad"})
+    assert response.status_code == 200
+    assert response.json() == {"id": user_id, "username": "campos_1", "edad": 44}
+    etag_proyeccion = response.headers["etag"]
+    etag_completo = (await client.get(f"/usuarios/{user_id}")).headers["etag"]
+    assert etag_proyeccion != etag_completo
+
+    response = await client.get(
+        f"/usuarios/{user_id}",
+        params={"fields": "edad,username"},
+        headers={"If-None-Match": etag_proyeccion}
+    )
+    assert response.status_code == 304
+    response = await client.get(f"/usuarios/{user_id}", headers={"If-None-Match": etag_proyeccion})
+    assert response.status_code == 200
+
+    response = await client.get("/usuarios/me", params={"fields": "mail"}, headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert set(response.json()) == {"id", "mail"}
+
+    for fields in ("password", "username,token_version", ","):
+        response = await client.get(f"/usuarios/{user_id}", params={"fields": fields})
+        assert response.status_code == 400
+
+#Test 40: Modificación y borrado masivos por ids o por filtro
+@pytest.mark.asyncio
+async def test_actualizar_y_eliminar_en_bloque(client):
+    admin = await admin_token(client, "MasivoAdmin")
+    ids = []
+    for i in range(4):
+        response = await crear_usuario_con(client, f"masivo_{i}", "Masivo", 20 + i)
+        ids.append(response.json()["id"])
+    etag = (await client.get(f"/usuarios/{ids[0]}")).headers["etag"]
+
+    response = await client.patch("/usuarios", json={"ids": ids[:2], "cambios": {"edad": 70, "es_admin": True}}, headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert response.json() == {"afectados": 2}
+    usuario = (await client.get(f"/usuarios/{ids[0]}")).json()
+    assert usuario["edad"] == 70 and usuario["es_admin"] is True and usuario["nombre"] == "Masivo"
+    assert (await client.get(f"/usuarios/{ids[0]}", headers={"If-None-Match": etag})).status_code == 200
+    # El cambio de rol revoca los tokens emitidos
+    from app.models import Usuario
+    from tests.conftest import TestingSessionLocal
+    with TestingSessionLocal() as db:
+        versiones = dict(db.query(Usuario.id, Usuario.token_version).filter(Usuario.id.in_(ids)))
+    assert [versiones[i] for i in ids] == [1, 1, 0, 0]
+
+    response = await client.patch("/usuarios", json={"filtro": {"username": "masivo_", "edad_max": 30}, "cambios": {"nombre": "Renombrado"}}, headers=auth_headers(admin))
+    assert response.json() == {"afectados": 2}
+    assert (await client.get(f"/usuarios/{ids[3]}")).json()["nombre"] == "Renombrado"
+
+    response = await client.request("DELETE", "/usuarios", json={"filtro": {"username": "masivo_", "es_admin": True}}, headers=auth_headers(admin))
+    assert response.json() == {"afectados": 2}
+    assert (await client.get(f"/usuarios/{ids[0]}")).status_code == 404
+    response = await client.request("DELETE", "/usuarios", json={"ids": ids}, headers=auth_headers(admin))
+    assert response.json() == {"afectados": 2}
+
+    # Selección vacía o ambigua, y sin permisos de admin
+    for cuerpo in ({"filtro": {}}, {"ids": ids, "filtro": {"nombre": "x"}}, {}):
+        response = await client.request("DELETE", "/usuarios", json=cuerpo, headers=auth_headers(admin))
+        assert response.status_code == 422
+    user = await user_token(client, "MasivoNoAdmin")
+    response = await client.patch("/usuarios", json={"ids": [1], "cambios": {"edad": 1}}, headers=auth_headers(user))
+    assert response.status_code == 403
+
+#Test 41: Lecturas enrutadas a réplicas, read-your-writes y caída al primario
+@pytest.mark.asyncio
+async def test_replicas_de_lectura(client, monkeypatch, tmp_path):
+    import app.replicas as replicas
+    from sqlalchemy import insert
+    from app.database import Base
+    from app.models import Usuario
+
+    admin = await admin_token(client, "ReplicaAdmin")
+    response = await crear_usuario_con(client, "replica_1", "Primario", 30)
+    user_id = response.json()["id"]
+
+    # Dos ficheros SQLite: una réplica "con retraso" que tiene otro nombre para la
+    # misma fila, y otra inaccesible
+    enrutador = replicas.EnrutadorLecturas([
+        f"sqlite:///{tmp_path / 'replica.db'}",
+        f"sqlite:///{tmp_path / 'no_existe' / 'replica.db'}",
+    ])
+    sana, caida = enrutador.replicas
+    Base.metadata.create_all(bind=sana.engine)
+    with sana.engine.begin() as conn:
+        conn.execute(insert(Usuario), [{
+            "id": user_id, "nombre": "Replica", "username": "replica_1",
+            "mail": "replica_1@busca.com", "password": "x", "edad": 30,
+        }])
+    monkeypatch.setattr(replicas, "enrutador", enrutador)
+
+    nombres = [(await client.get(f"/usuarios/{user_id}")).json()["nombre"] for _ in range(4)]
+    # La réplica caída se aparta y sus lecturas van al primario
+    assert "Replica" in nombres and "Primario" in nombres
+    assert not caida.sana and sana.sana
+    nombres = [(await client.get(f"/usuarios/{user_id}")).json()["nombre"] for _ in range(3)]
+    assert nombres == ["Replica"] * 3
+    assert sana.en_uso == 0
+
+    # Tras escribir, el mismo usuario lee del primario
+    response = await client.put(
+        f"/usuarios/{user_id}",
+        json={"nombre": "Editado", "edad": 31, "es_admin": False},
+        headers=auth_headers(admin),
+    )
+    assert response.status_code == 200
+    response = await client.get(f"/usuarios/{user_id}", headers=auth_headers(admin))
+    assert response.json()["nombre"] == "Editado"
+    response = await client.get(f"/usuarios/{user_id}")
+    assert response.json()["nombre"] == "Replica"
+
+    # La autenticación va siempre al primario: un usuario recién creado que la
+    # réplica aún no tiene entra igual, y a la réplica solo va la consulta
+    token = await user_token(client, "ReplicaNuevo")
+    response = await client.get("/usuarios/me", headers=auth_headers(token))
+    assert response.status_code == 200, response.text
+    assert response.json()["username"] == "ReplicaNuevo"
+    lector = await admin_token(client, "ReplicaLector")
+    response = await client.get("/usuarios", headers=auth_headers(lector))
+    assert response.status_code == 200
+    assert [u["username"] for u in response.json()["items"]] == ["replica_1"]
+
+#Test 42: Perfil del engine: PRAGMAs de SQLite y espera del pool medida
+def test_perfil_engine_sqlite(tmp_path):
+    from sqlalchemy import text
+    from app.database import QueuePoolMedido, crear_engine
+    from app.metrics import registro
+
+    engine = crear_engine(f"sqlite:///{tmp_path / 'perfil.db'}", "perfil")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    assert isinstance(engine.pool, QueuePoolMedido)
+    engine.dispose()
+
+    assert 'db_pool_checkout_wait_seconds_count{pool="perfil"} 1' in registro.exponer()
+
+#Test 43: Group commit de altas concurrentes con errores por fila
+@pytest.mark.asyncio
+async def test_altas_agrupadas(client, monkeypatch):
+    import asyncio
+    import app.usuarios as usuarios
+
+    monkeypatch.setattr(usuarios, "SIGNUP_GROUP_COMMIT", True)
+    # Ventana larga: el lote sale al juntarse las 6 altas, sea cual sea el coste de bcrypt
+    monkeypatch.setattr(usuarios.escritor_altas, "ventana", 30)
+    monkeypatch.setattr(usuarios.escritor_altas, "maximo", 6)
+    lotes_antes = usuarios.escritor_altas.lotes
+
+    async def alta(username: str):
+        return await client.post("/usuarios", json={
+            "nombre": "Grupo",
+            "username": username,
+            "mail": username + "@grupo.com",
+            "edad": 30,
+            "password": "test123",
+        })
+
+    # Dos peticiones con el mismo username en el mismo lote: solo una entra
+    respuestas = await asyncio.gather(*[alta(f"grupo_{i}") for i in range(5)], alta("grupo_0"))
+    codigos = [r.status_code for r in respuestas]
+    assert codigos.count(200) == 5 and codigos.count(409) == 1
+    assert {r.json()["username"] for r in respuestas if r.status_code == 200} == {f"grupo_{i}" for i in range(5)}
+    assert all("password" not in r.json() for r in respuestas if r.status_code == 200)
+    assert usuarios.escritor_altas.lotes - lotes_antes == 1
+
+    # Las filas y sus entradas en el feed quedan confirmadas
+    for r in respuestas:
+        if r.status_code == 200:
+            response = await client.get(f"/usuarios/{r.json()['id']}")
+            assert response.status_code == 200
+
+#Test 44: Alta con 409 por campo y disponibilidad con filtro de Bloom
+@pytest.mark.asyncio
+async def test_disponibilidad_y_conflictos(client, monkeypatch):
+    import app.usuarios as usuarios
+    from app.disponibilidad import Disponibilidad, FiltroBloom
+    from tests.conftest import TestingSessionLocal
+
+    response = await crear_usuario_con(client, "libre_1", "Libre", 25)
+    assert response.status_code == 200
+    duplicado = {"nombre": "Otro", "username": "libre_otro", "mail": "libre_1@busca.com", "edad": 25, "password": "test123"}
+    response = await client.post("/usuarios", json=duplicado)
+    assert response.status_code == 409
+    assert response.json()["detail"]["campo"] == "mail"
+
+    # Sin cargar, el filtro no sabe nada y pregunta a la base de datos
+    disponibilidad = Disponibilidad(capacidad=1000, falsos_positivos=0.01)
+    monkeypatch.setattr(usuarios, "disponibilidad", disponibilidad)
+    response = await client.get("/usuarios/disponible", params={"username": "libre_1", "mail": "nuevo@busca.com"})
+    assert response.json() == {"username": False, "mail": True}
+
+    with TestingSessionLocal() as db:
+        disponibilidad.cargar(db)
+    assert not disponibilidad.puede_estar_ocupado("username", "libre_nadie")
+    response = await client.get("/usuarios/disponible", params={"username": "libre_nadie"})
+    assert response.json() == {"username": True}
+
+    # Un alta de este proceso entra en el filtro al momento
+    response = await crear_usuario_con(client, "libre_2", "Libre", 25)
+    assert disponibilidad.puede_estar_ocupado("username", "libre_2")
+    response = await client.get("/usuarios/disponible", params={"username": "libre_2", "mail": "libre_2@busca.com"})
+    assert response.json() == {"username": False, "mail": False}
+
+    response = await client.get("/usuarios/disponible")
+    assert response.status_code == 400
+
+    # Sin falsos negativos y con la tasa de falsos positivos prevista
+    filtro = FiltroBloom(10000, 0.01)
+    for i in range(10000):
+        filtro.agregar(f"dentro{i}")
+    assert all(f"dentro{i}" in filtro for i in range(10000))
+    assert sum(f"fuera{i}" in filtro for i in range(10000)) < 300
+
+#Test 45: Control de admisión: 429 por token bucket y 503 con la cola llena
+@pytest.mark.asyncio
+async def test_control_admision(client, monkeypatch):
+    import asyncio
+    import app.admision as admision
+
+    await crear_usuario(client, "Admision")
+    monkeypatch.setattr(admision, "login_por_usuario", admision.CubosTokens("login_usuario", 0.01, 2))
+    for _ in range(2):
+        response = await client.post("/login", data={"username": "Admision", "password": "mala"})
+        assert response.status_code == 401
+    response = await client.post("/login", data={"username": "ADMISION", "password": "test123"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+    # Un turno y sin cola: mientras dura un bcrypt, el siguiente se rechaza al momento
+    limitador = admision.LimitadorConcurrencia("prueba", maximo=1, cola=0, espera_max=1)
+    liberar = asyncio.Event()
+
+    async def ocupar():
+        async with limitador.turno():
+            await liberar.wait()
+
+    tarea = asyncio.create_task(ocupar())
+    await asyncio.sleep(0)
+    with pytest.raises(admision.Sobrecarga):
+        async with limitador.turno():
+            pass
+    liberar.set()
+    await tarea
+    async with limitador.turno():
+        assert limitador.en_curso == 1
+    assert limitador.en_curso == 0
+
+    # Con cola, la espera tiene un límite
+    limitador = admision.LimitadorConcurrencia("prueba", maximo=1, cola=1, espera_max=0.05)
+    liberar = asyncio.Event()
+    tarea = asyncio.create_task(ocupar())
+    await asyncio.sleep(0)
+    with pytest.raises(admision.Sobrecarga):
+        async with limitador.turno():
+            pass
+    assert limitador.en_cola == 0
+    liberar.set()
+    await tarea
+
+    # Y la respuesta HTTP es un 503 con Retry-After
+    monkeypatch.setattr(admision.limitador_bcrypt, "cola", 0)
+    monkeypatch.setattr(admision.limitador_bcrypt, "en_curso", 0)
+    monkeypatch.setattr(admision.limitador_bcrypt, "_semaforo", asyncio.Semaphore(0))
+    response = await client.post("/usuarios", json={
+        "nombre": "Saturado", "username": "saturado", "mail": "saturado@test.com",
+        "edad": 30, "password": "test123",
+    })
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert 'admision_rechazos_total{limite="bcrypt",motivo="cola_llena"}' in (await client.get("/metrics")).text
+
+#Test 46: Calibración del coste de bcrypt y rehash transparente en el login
+@pytest.mark.asyncio
+async def test_rehash_en_login(client, monkeypatch):
+    import app.security as security
+    from app.models import Usuario
+    from tests.conftest import TestingSessionLocal
+
+    assert security.BCRYPT_MIN_ROUNDS <= security.calibrar_rounds(50) <= security.BCRYPT_MAX_ROUNDS
+
+    rounds_original = security.bcrypt_rounds
+    monkeypatch.setattr(security, "bcrypt_rounds", rounds_original)
+    monkeypatch.setattr(security, "pwd_context", security.pwd_context)
+
+    # Usuario creado con un coste bajo; después sube el coste vigente
+    security.configurar_rounds(4)
+    await crear_usuario(client, "Rehash")
+    with TestingSessionLocal() as db:
+        assert db.query(Usuario.password).filter(Usuario.username == "Rehash").scalar().startswith("$2b$04$")
+
+    security.configurar_rounds(5)
+    response = await client.post("/login", data={"username": "Rehash", "password": "test123"})
+    assert response.status_code == 200
+    with TestingSessionLocal() as db:
+        nuevo = db.query(Usuario.password).filter(Usuario.username == "Rehash").scalar()
+    assert nuevo.startswith("$2b$05$")
+    assert not security.necesita_rehash(nuevo)
+
+    # La contraseña sigue valiendo con el hash nuevo
+    response = await client.post("/login", data={"username": "Rehash", "password": "test123"})
+    assert response.status_code == 200
+
+    # Si la calibración baja el coste, los hashes más caros también se rehacen
+    security.configurar_rounds(4)
+    assert security.necesita_rehash(nuevo)
+    response = await client.post("/login", data={"username": "Rehash", "password": "test123"})
+    assert response.status_code == 200
+    with TestingSessionLocal() as db:
+        assert db.query(Usuario.password).filter(Usuario.username == "Rehash").scalar().startswith("$2b$04$")
+
+#Test 47: Carga sintética determinista con app.seed
+@pytest.mark.asyncio
+async def test_seed_determinista(tmp_path, monkeypatch):
+    import app.security as security
+    from sqlalchemy import create_engine, inspect, text
+    from app.seed import sembrar
+
+    monkeypatch.setattr(security, "bcrypt_rounds", security.bcrypt_rounds)
+    monkeypatch.setattr(security, "pwd_context", security.pwd_context)
+    security.configurar_rounds(4)
+
+    url = f"sqlite:///{tmp_path / 'seed.db'}"
+    columnas = "id, nombre, username, mail, edad, es_admin"
+    filas = []
+    for _ in range(2):
+        sembrar(url, 500, 7, 200, 2, 0.1, feed=True, limpiar=True)
+        engine = create_engine(url)
+        with engine.connect() as conn:
+            filas.append(conn.execute(text(f"SELECT {columnas} FROM usuarios ORDER BY username")).all())
+            cambios = conn.execute(text("SELECT count(*) FROM cambios_usuarios")).scalar()
+            password = conn.execute(text("SELECT password FROM usuarios WHERE id % 2 = 1 LIMIT 1")).scalar()
+        indices = {indice["name"] for indice in inspect(engine).get_indexes("usuarios")}
+        engine.dispose()
+
+    assert filas[0] == filas[1]
+    assert len(filas[0]) == 500
+    assert len({fila.username for fila in filas[0]}) == 500
+    assert 0 < sum(fila.es_admin for fila in filas[0]) < 500
+    assert all(18 <= fila.edad <= 90 for fila in filas[0])
+    assert cambios == 500
+    # Los índices secundarios se quitan durante la carga y se rehacen al final
+    assert {"ix_usuarios_nombre", "ix_usuarios_edad"} <= indices
+    assert security.verify_password("seed1", password)
+
+#Test 48: app.serve calibra una vez antes del fork y cada worker abre sus conexiones
+def test_serve_tras_fork(monkeypatch):
+    import app.security as security
+    import app.database_async as database_async
+    from app.database import engine
+    from app.serve import _conexiones_propias
+
+    monkeypatch.setattr(security, "_calibrado", False)
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 0)
+    monkeypatch.setattr(security, "bcrypt_rounds", security.bcrypt_rounds)
+    monkeypatch.setattr(security, "pwd_context", security.pwd_context)
+    llamadas = []
+    monkeypatch.setattr(security, "calibrar_rounds", lambda: llamadas.append(1) or 10)
+    # El maestro calibra; los workers heredan el resultado y no repiten
+    assert security.calibrar_al_arrancar() == 10
+    assert security.calibrar_al_arrancar() == 10
+    assert len(llamadas) == 1
+
+    # Tras el fork: pool nuevo en el engine y nada heredado del padre
+    pool_padre = engine.pool
+    monkeypatch.setattr(security, "_bcrypt_pool", object())
+    _conexiones_propias()
+    assert engine.pool is not pool_padre
+    assert security._bcrypt_pool is None
+    assert database_async._async_engine is None
+
+#Test 49: Borrar la cuenta revoca sus refresh tokens y el id no se reutiliza
+@pytest.mark.asyncio
+async def test_borrado_refresh_y_id(client):
+    from sqlalchemy import delete, insert
+    from app.models import RefreshToken
+    from tests.conftest import TestingSessionLocal
+
+    token = await user_token(client, "Borrada")
+    refresh = (await client.post("/login", data={"username": "Borrada", "password": "test123"})).json()["refresh_token"]
+    id_borrada = (await client.get("/usuarios/me", headers=auth_headers(token))).json()["id"]
+
+    response = await client.delete("/usuarios/me", headers=auth_headers(token))
+    assert response.status_code == 200
+    with TestingSessionLocal() as db:
+        assert db.query(RefreshToken).filter(RefreshToken.usuario_id == id_borrada).count() == 0
+
+    token_sucesor = await user_token(client, "Sucesora")
+    sucesora = (await client.get("/usuarios/me", headers=auth_headers(token_sucesor))).json()
+    assert sucesora["id"] > id_borrada
+    assert (await client.post("/token/refresh", json={"refresh_token": refresh})).status_code == 401
+    assert (await client.get("/usuarios/me", headers=auth_headers(token))).status_code == 401
+
+    # Aunque quedara un token huérfano y otro usuario ocupara su id, no vale para él
+    refresh = (await client.post("/login", data={"username": "Sucesora", "password": "test123"})).json()["refresh_token"]
+    with TestingSessionLocal() as db:
+        fila = db.query(Usuario).filter(Usuario.id == sucesora["id"]).one()
+        datos = {c.key: getattr(fila, c.key) for c in Usuario.__table__.columns}
+        db.execute(delete(Usuario).where(Usuario.id == sucesora["id"]))
+        db.execute(insert(Usuario).values(**{**datos, "username": "Okupa", "mail": "okupa@test.com"}))
+        db.commit()
+    assert (await client.post("/token/refresh", json={"refresh_token": refresh})).status_code == 401
+    with TestingSessionLocal() as db:
+        db.execute(delete(RefreshToken).where(RefreshToken.usuario_id == sucesora["id"]))
+        db.execute(delete(Usuario).where(Usuario.id == sucesora["id"]))
+        db.commit()
+
+#Test 50: Un token stateless de un admin borrado no vale para quien ocupe su id
+@pytest.mark.asyncio
+async def test_stateless_claims_id_reutilizado(client, monkeypatch):
+    from jose import jwt
+    from sqlalchemy import delete, insert
+    import app.auth as auth
+    from tests.conftest import TestingSessionLocal
+
+    monkeypatch.setattr(auth, "JWT_STATELESS_CLAIMS", True)
+    monkeypatch.setattr(auth.version_cache, "ttl", 0)
+
+    token = await admin_token(client, "AdminBorrado")
+    uid = jwt.get_unverified_claims(token)["uid"]
+    with TestingSessionLocal() as db:
+        datos = {c.key: getattr(db.get(Usuario, uid), c.key) for c in Usuario.__table__.columns}
+    response = await client.delete("/usuarios/me", headers=auth_headers(token))
+    assert response.status_code == 200
+    assert (await client.get("/usuarios", headers=auth_headers(token))).status_code == 401
+
+    # Un alta normal ya no recibe ese id
+    otro = await user_token(client, "AltaTrasBorrado")
+    assert jwt.get_unverified_claims(otro)["uid"] != uid
+
+    # Y si la fila con ese id fuera de otro usuario, el sub del token no coincide
+    with TestingSessionLocal() as db:
+        db.execute(insert(Usuario).values(**{**datos, "username": "Heredero", "mail": "heredero@test.com", "es_admin": False}))
+        db.commit()
+    try:
+        assert (await client.get("/usuarios", headers=auth_headers(token))).status_code == 401
+        response = await client.request(
+            "DELETE", "/usuarios", headers=auth_headers(token), json={"filtro": {"username": "Heredero"}}
+        )
+        assert response.status_code == 401
+    finally:
+        with TestingSessionLocal() as db:
+            db.execute(delete(Usuario).where(Usuario.id == uid))
+            db.commit()
+
+#Test 51: Un lote de altas es una sola transacción en SQLite (un COMMIT por lote)
+def test_lote_un_commit(tmp_path):
+    from sqlalchemy import create_engine, event
+    from app.database import Base
+    from app.usuarios import UsuarioDuplicado, _guardar_lote_en
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'lote.db'}")
+    trazas = []
+
+    @event.listens_for(engine, "connect")
+    def _trazar(dbapi_connection, connection_record):
+        # Lo que de verdad recibe SQLite, incluidos BEGIN/COMMIT implícitos de pysqlite
+        dbapi_connection.set_trace_callback(trazas.append)
+
+    Base.metadata.create_all(bind=engine)
+    trazas.clear()
+
+    def nuevo(username: str, mail: str):
+        return Usuario(nombre="Lote", username=username, mail=mail, password="x", edad=30, es_admin=False)
+
+    resultados = _guardar_lote_en(engine, [
+        nuevo("lote_a", "lote_a@test.com"),
+        nuevo("lote_b", "lote_b@test.com"),
+        nuevo("lote_a", "otro@test.com"),
+        nuevo("lote_c", "lote_c@test.com"),
+    ])
+    assert [r["username"] for r in resultados if isinstance(r, dict)] == ["lote_a", "lote_b", "lote_c"]
+    assert isinstance(resultados[2], UsuarioDuplicado) and resultados[2].campo == "username"
+
+    sentencias = [t.strip().split()[0].upper() for t in trazas]
+    assert sentencias[0] == "BEGIN"
+    assert sentencias.count("SAVEPOINT") == 4
+    assert sentencias.count("COMMIT") == 1 and sentencias[-1] == "COMMIT"
+    assert "BEGIN" not in sentencias[1:]
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM usuarios").scalar() == 3
+        assert conn.exec_driver_sql("SELECT count(*) FROM cambios_usuarios").scalar() == 3
+    engine.dispose()
+
+#Test 52: La importación masiva pide turnos a limitador_bcrypt como logins y altas
+@pytest.mark.asyncio
+async def test_importar_con_admision(client, monkeypatch):
+    import asyncio
+    import app.admision as admision
+    import app.security as security
+
+    token = await admin_token(client, "ImportaAdmision")
+    filas = [
+        {"username": f"Cupo{i}", "mail": f"cupo{i}@bulk.com", "password": "test123", "nombre": "Cupo", "edad": 20}
+        for i in range(10)
+    ]
+
+    # Cuota de un turno y trozos de 3: la importación termina y no deja turnos ocupados
+    monkeypatch.setattr(security, "BCRYPT_IMPORT_LOTE", 3)
+    monkeypatch.setattr(security, "BCRYPT_IMPORT_CUOTA", 1)
+    monkeypatch.setattr(security, "_cuota_importacion", asyncio.Semaphore(1))
+    response = await client.post("/usuarios/bulk", json=filas[:5], headers=auth_headers(token))
+    assert response.status_code == 200, response.text
+    assert response.json()["creados"] == 5
+    assert admision.limitador_bcrypt.en_curso == 0
+
+    # Sin turnos libres ni cola, la importación se rechaza como cualquier bcrypt
+    monkeypatch.setattr(admision.limitador_bcrypt, "cola", 0)
+    monkeypatch.setattr(admision.limitador_bcrypt, "en_curso", 0)
+    monkeypatch.setattr(admision.limitador_bcrypt, "_semaforo", asyncio.Semaphore(0))
+    response = await client.post("/usuarios/bulk", json=filas[5:], headers=auth_headers(token))
+    assert response.status_code == 503
+    assert "retry-after" in response.headers
+    assert 'admision_rechazos_total{limite="bcrypt",motivo="cola_llena"}' in (await client.get("/metrics")).text
+
+#Test 53: Detrás de un proxy de confianza el límite de logins va por la IP de X-Forwarded-For
+@pytest.mark.asyncio
+async def test_login_por_ip_reenviada(client, monkeypatch):
+    import app.admision as admision
+
+    await crear_usuario(client, "Reenviada")
+    # El cliente de pruebas conecta desde 127.0.0.1, el proxy de confianza por defecto
+    monkeypatch.setattr(admision, "login_por_ip", admision.CubosTokens("login_ip", 0.01, 2))
+    monkeypatch.setattr(admision, "login_por_usuario", admision.CubosTokens("login_usuario", 100, 100))
+
+    async def intento(cabecera):
+        return await client.post(
+            "/login",
+            data={"username": "Reenviada", "password": "mala"},
+            headers={"X-Forwarded-For": cabecera},
+        )
+
+    for _ in range(2):
+        assert (await intento("203.0.113.1")).status_code == 401
+    assert (await intento("203.0.113.1")).status_code == 429
+    # Otra IP tiene su propio cubo
+    assert (await intento("203.0.113.2")).status_code == 401
+    # Lo que el cliente escribe a la izquierda no cambia su cubo
+    assert (await intento("198.51.100.7, 203.0.113.1")).status_code == 429
+
+    proxies = admision.ProxiesConfianza(["10.0.0.0/8"])
+    assert proxies.ip_cliente("10.1.2.3", "203.0.113.5, 10.9.9.9") == "203.0.113.5"
+    # Si quien conecta no es un proxy, X-Forwarded-For no cuenta
+    assert proxies.ip_cliente("203.0.113.9", "198.51.100.1") == "203.0.113.9"
+    assert admision.ProxiesConfianza(["*"]).ip_cliente("10.1.2.3", "203.0.113.5, 10.9.9.9") == "203.0.113.5"
+
+#Test 54: Un prefijo que acaba en el último carácter Unicode no rompe la búsqueda
+@pytest.mark.asyncio
+async def test_prefijo_ultimo_codigo(client):
+    from app.busqueda import IndicePrefijos, siguiente_prefijo
+
+    maximo = chr(0x10FFFF)
+    assert siguiente_prefijo("ab") == "ac"
+    assert siguiente_prefijo("ab" + maximo * 2) == "ac"
+    assert siguiente_prefijo(maximo) is None
+
+    indice = IndicePrefijos()
+    indice._agregar("zz" + maximo, 1)
+    indice._agregar("zz" + maximo + "a", 2)
+    assert indice.candidatos("zz" + maximo, 10) == [1, 2]
+    assert indice.candidatos(maximo, 10) == []
+
+    admin = await admin_token(client, "PrefijoMaximo")
+    for prefijo in ("Prefijo" + maximo, maximo):
+        response = await client.get("/usuarios/search", params={"username": prefijo}, headers=auth_headers(admin))
+        assert response.status_code == 200, response.text
+        assert response.json()["items"] == []
@@ -0,0 +1,178 @@
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.database_async import get_async_db, url_async
+from app.usuarios_async import router as usuarios_async_router
+
+
+def auth_headers(token):
+    return {"Authorization": f"Bearer {token}"}
+
+# App solo con las rutas async sobre una base aiosqlite en memoria
+@pytest_asyncio.fixture
+async def async_client():
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    SessionAsync = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with SessionAsync() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(usuarios_async_router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+    await engine.dispose()
+
+
+def test_url_async():
+    assert url_async("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+    assert url_async("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert url_async("postgres://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert url_async("sqlite+aiosqlite:///x.db") == "sqlite+aiosqlite:///x.db"
+
+
+@pytest.mark.asyncio
+async def test_rutas_async(async_client):
+    user_data = {
+        "nombre": "AsyncAdmin",
+        "username": "AsyncAdmin",
+        "mail": "asyncadmin@test.com",
+        "edad": 40,
+        "password": "test123",
+        "es_admin": True
+    }
+    response = await async_client.post("/usuarios", json=user_data)
+    assert response.status_code == 200, response.text
+    user_id = response.json()["id"]
+
+    response = await async_client.post("/usuarios", json=user_data)
+    assert response.status_code == 409
+
+    login = await async_client.post("/login", data={"username": "AsyncAdmin", "password": "test123"})
+    assert login.status_code == 200
+    token = login.json()["access_token"]
+    assert login.json()["refresh_token"]
+
+    me = await async_client.get("/usuarios/me", headers=auth_headers(token))
+    assert me.status_code == 200
+    assert me.json()["username"] == "AsyncAdmin"
+
+    response = await async_client.get(f"/usuarios/{user_id}")
+    assert response.status_code == 200
+    assert response.json()["mail"] == "asyncadmin@test.com"
+
+    response = await async_client.get("/usuarios", headers=auth_headers(token))
+    assert response.status_code == 200
+    assert [u["id"] for u in response.json()["items"]] == [user_id]
+
+    response = await async_client.get("/usuarios", params={"stream": True}, headers=auth_headers(token))
+    assert response.status_code == 200
+    assert "AsyncAdmin" in response.text
+
+
+# Como app.main con DB_ASYNC=1: rutas async primero y luego las síncronas,
+# ambas sobre el mismo fichero SQLite
+@pytest.mark.asyncio
+async def test_rutas_estaticas_con_db_async(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.database import get_db
+    from app.usuarios import router as usuarios_router
+
+    ruta = tmp_path / "mixta.db"
+    engine = create_engine(f"sqlite:///{ruta}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Sesion = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine_async = create_async_engine(f"sqlite+aiosqlite:///{ruta}")
+    SessionAsync = async_sessionmaker(bind=engine_async, expire_on_commit=False)
+
+    def override_get_db():
+        with Sesion() as db:
+            yield db
+
+    async def override_get_async_db():
+        async with SessionAsync() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(usuarios_async_router)
+    app.include_router(usuarios_router)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/usuarios", json={
+            "nombre": "Mixto", "username": "Mixto", "mail": "mixto@test.com",
+            "edad": 40, "password": "test123", "es_admin": True,
+        })
+        assert response.status_code == 200, response.text
+        user_id = response.json()["id"]
+        token = (await client.post("/login", data={"username": "Mixto", "password": "test123"})).json()["access_token"]
+
+        response = await client.get("/usuarios/search", params={"username": "Mix"}, headers=auth_headers(token))
+        assert response.status_code == 200, response.text
+        assert [u["id"] for u in response.json()["items"]] == [user_id]
+        response = await client.get("/usuarios/changes", headers=auth_headers(token))
+        assert response.status_code == 200, response.text
+        response = await client.get("/usuarios/disponible", params={"username": "Libre"})
+        assert response.status_code == 200, response.text
+        response = await client.get(f"/usuarios/{user_id}")
+        assert response.status_code == 200
+        assert (await client.get("/usuarios/9999")).status_code == 404
+
+    await engine_async.dispose()
+    engine.dispose()
+
+
+# Con DB_ASYNC y SIGNUP_GROUP_COMMIT las altas async también se agrupan
+@pytest.mark.asyncio
+async def test_group_commit_async(async_client, monkeypatch):
+    import asyncio
+    import app.admision as admision
+    import app.usuarios_async as usuarios_async
+    from app.lotes import EscritorLotes
+
+    # Ventana larga: el lote sale al llegar la tercera alta, tarde lo que tarde bcrypt
+    escritor = EscritorLotes(usuarios_async._escribir_usuarios_async, ventana=30, maximo=3)
+    monkeypatch.setattr(usuarios_async, "SIGNUP_GROUP_COMMIT", True)
+    monkeypatch.setattr(usuarios_async, "escritor_altas_async", escritor)
+    # El semáforo de bcrypt se crea en el primer uso y queda atado a ese event loop
+    monkeypatch.setattr(admision.limitador_bcrypt, "_semaforo", None)
+
+    def alta(username, mail):
+        return async_client.post("/usuarios", json={
+            "nombre": "Grupo", "username": username, "mail": mail,
+            "edad": 30, "password": "test123",
+        })
+
+    respuestas = await asyncio.gather(
+        alta("grupo_a", "grupo_a@test.com"),
+        alta("grupo_b", "grupo_b@test.com"),
+        alta("grupo_a", "otro@test.com"),
+    )
+    # Cuál de las dos "grupo_a" entra depende de qué bcrypt acaba antes
+    assert respuestas[1].status_code == 200
+    assert sorted(r.status_code for r in (respuestas[0], respuestas[2])) == [200, 409]
+    duplicada = next(r for r in respuestas if r.status_code == 409)
+    assert duplicada.json()["detail"]["campo"] == "username"
+    assert escritor.lotes == 1 and escritor.items == 3
+
+    ids = [r.json()["id"] for r in respuestas if r.status_code == 200]
+    for user_id in ids:
+        assert (await async_client.get(f"/usuarios/{user_id}")).status_code == 200